@@ -0,0 +1,336 @@
+from collections import OrderedDict
+from os import getenv
+from dotenv import load_dotenv
+from app.serializers import dumps, loads
+import threading
+import time
+
+
+load_dotenv()
+
+
+class TokenCache:
+    """
+    A bounded, thread-safe LRU cache of verified access tokens.
+
+    Each entry holds the decoded payload of a token and a detached snapshot of its user,
+    and expires at the token's `exp` or after `ttl` seconds, whichever comes first.
+    The `ttl` bounds how long a change made by another worker process can go unnoticed.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        """
+        Retrieves a cached token.
+
+        Parameters:
+            token (str): The raw access token.
+
+        Returns:
+            Tuple|None: The decoded payload and the user snapshot, or None if the token is not cached
+                or its entry expired.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload, user = entry
+            if expires_at <= time.time():
+                self._discard(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return payload, user
+
+    def set(self, token: str, payload: dict, user):
+        """
+        Caches a verified token, evicting the least recently used entry if the cache is full.
+
+        Parameters:
+            token (str): The raw access token.
+            payload (dict): The decoded payload of the token.
+            user (UserSnapshot): The snapshot of the user the token belongs to.
+        """
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        expires_at = min(payload.get('exp'), time.time() + self.ttl)
+        with self._lock:
+            self._discard(token)
+            self._entries[token] = (expires_at, payload, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        """
+        Drops every cached token that belongs to a user.
+
+        Parameters:
+            user_id (str): The id of the user.
+        """
+        with self._lock:
+            for token in self._tokens_by_user.pop(user_id, ()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        """
+        Drops every entry and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the size and the hit and miss counters of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _discard(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[2].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[2].id]
+
+
+token_cache = TokenCache(int(getenv('TOKEN_CACHE_SIZE', 10000)), float(getenv('TOKEN_CACHE_TTL', 60)))
+
+
+class MemoryBackend:
+    """
+    An in-process LRU store of encoded payloads, bounded both by number of entries and by total size.
+
+    Entries older than `ttl` seconds are treated as missing, which bounds how long a change
+    made by another worker process can go unnoticed.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.bytes += len(value)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_counters(self, *keys: str) -> list:
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'bytes': self.bytes,
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+
+class RedisBackend:
+    """
+    A store backed by a Redis-compatible server, shared by every worker process.
+
+    Memory limits and eviction are left to the server (`maxmemory` and an LRU `maxmemory-policy`),
+    entries also expire after `ttl` seconds.
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', ttl: float = 3600, prefix: str = 'amigox:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required by GROUP_CACHE_BACKEND=redis')
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def get_counters(self, *keys: str) -> list:
+        return [int(value or 0) for value in self.client.mget([self.prefix + key for key in keys])]
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self) -> dict:
+        info = self.client.info('memory')
+        return {'backend': 'redis', 'used_memory': info.get('used_memory'), 'maxmemory': info.get('maxmemory')}
+
+
+class GroupCache:
+    """
+    A versioned cache of serialized group payloads, keyed by group id and view
+    ('serialize' or 'su_serialize').
+
+    Each payload is stored under the `version` column of its group, which every change
+    to the group or its friends bumps in the same transaction (`Group.touch`). Callers read
+    the current versions from the database, a primary key lookup, so payloads built from
+    older data can never be served again, by any worker process. `invalidate_all` bumps a
+    global generation instead, for changes that touch every group, such as a user renaming.
+
+    Parameters:
+        backend (MemoryBackend|RedisBackend|None): Where payloads are stored. None disables the cache.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, versions: dict, view: str, build) -> dict:
+        """
+        Retrieves the payloads of several groups, building the missing ones in one call.
+
+        Parameters:
+            versions (dict): A map of the id of each group to its current version.
+            view (str): The name of the serialization view.
+            build (Callable): Receives the list of missing ids and returns a map of id to payload.
+                Ids missing from the returned map are not cached.
+
+        Returns:
+            dict: A map of group id to payload, for the groups that exist.
+        """
+        if self.backend is None:
+            return build(list(versions))
+        generation, = self.backend.get_counters('group:generation')
+        keys = {}
+        payloads = {}
+        for group_id, version in versions.items():
+            key = f'group:{group_id}:{view}:{generation}.{version}'
+            keys[group_id] = key
+            value = self.backend.get(key)
+            if value is not None:
+                payloads[group_id] = loads(value)
+        missing = [group_id for group_id in versions if group_id not in payloads]
+        self.hits += len(payloads)
+        self.misses += len(missing)
+        if missing:
+            built = build(missing)
+            for group_id, payload in built.items():
+                self.backend.set(keys[group_id], dumps(payload))
+            payloads.update(built)
+        return payloads
+
+    def get(self, group_id: str, version: int, view: str, build):
+        """
+        Retrieves the payload of a group, building and caching it on a miss.
+
+        Parameters:
+            group_id (str): The id of the group.
+            version (int): The current version of the group.
+            view (str): The name of the serialization view.
+            build (Callable): Receives the group id and returns its payload, or None if it does not exist.
+
+        Returns:
+            dict|None: The payload, or None if the group does not exist.
+        """
+        def build_one(missing):
+            payload = build(missing[0])
+            return {} if payload is None else {missing[0]: payload}
+        return self.get_many({group_id: version}, view, build_one).get(group_id)
+
+    def invalidate_all(self):
+        if self.backend is not None:
+            self.backend.incr('group:generation')
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+def group_cache_backend():
+    """
+    Builds the backend of the group cache from GROUP_CACHE_BACKEND ('memory', 'redis' or 'none').
+    """
+    backend = getenv('GROUP_CACHE_BACKEND', 'memory')
+    if backend == 'none':
+        return None
+    if backend == 'redis':
+        return RedisBackend(getenv('GROUP_CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+                            float(getenv('GROUP_CACHE_TTL', 3600)))
+    if backend == 'memory':
+        return MemoryBackend(int(getenv('GROUP_CACHE_MAX_ENTRIES', 10000)),
+                             int(getenv('GROUP_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+                             float(getenv('GROUP_CACHE_TTL', 30)))
+    raise ValueError(f'GROUP_CACHE_BACKEND must be memory, redis or none, got {backend!r}')
+
+
+group_cache = GroupCache(group_cache_backend())
@@ -5,6 +5,9 @@ from flask_restful import Api
 from dotenv import load_dotenv
 from os import getenv
 from flask_cors import CORS
+from app.logs import configure_request_logging
+from app.serializers import codec_name, output_json
+from app.routing import REPLICA_BIND, RoutingSession
 
 
 
@@ -12,38 +15,100 @@ from flask_cors import CORS
 load_dotenv()
 
 
+DB_DRIVERS = {
+    'mysqlconnector': ('mysql+mysqlconnector', {}),
+    'mysqlconnector-pure': ('mysql+mysqlconnector', {'use_pure': True}),
+    'mysqlconnector-c': ('mysql+mysqlconnector', {'use_pure': False}),
+    'pymysql': ('mysql+pymysql', {}),
+    'mysqlclient': ('mysql+mysqldb', {}),
+}
+
+
+def getenv_bool(name, default):
+    value = getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options():
+    """
+    Builds the SQLAlchemy engine options from the environment.
+
+    Environment Variables:
+        DB_DRIVER: One of DB_DRIVERS (default 'mysqlconnector').
+        DB_POOL_SIZE: The number of connections kept open by each worker (default 5).
+        DB_MAX_OVERFLOW: The number of extra connections opened under load (default 10).
+        DB_POOL_RECYCLE: The age in seconds after which a connection is replaced (default 3600),
+            keep it below MySQL's `wait_timeout`.
+        DB_POOL_PRE_PING: Test connections before using them (default true).
+        DB_POOL_TIMEOUT: Seconds to wait for a free connection before failing (default 30).
+
+    Returns:
+        Tuple: The SQLAlchemy dialect+driver prefix of the URI and the engine options.
+
+    Raises:
+        ValueError: If DB_DRIVER is not one of DB_DRIVERS.
+    """
+    driver = getenv('DB_DRIVER', 'mysqlconnector')
+    if driver not in DB_DRIVERS:
+        raise ValueError(f'DB_DRIVER must be one of {", ".join(DB_DRIVERS)}, got {driver!r}')
+    dialect, connect_args = DB_DRIVERS[driver]
+    options = {
+        'pool_size': int(getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': int(getenv('DB_POOL_RECYCLE', 3600)),
+        'pool_pre_ping': getenv_bool('DB_POOL_PRE_PING', True),
+        'pool_timeout': float(getenv('DB_POOL_TIMEOUT', 30)),
+    }
+    if connect_args:
+        options['connect_args'] = dict(connect_args)
+    return dialect, options
 
 
 def create_app():
-    
 
+    dialect, options = engine_options()
     if getenv('FLASK_ENV') == 'test':
-        conectionstring = 'mysql+mysqlconnector://{}:{}@{}:{}/{}'.format(
-        getenv('DB_USER'),
-        getenv('DB_PASSWORD'),
-        getenv('DB_HOST'),
-        getenv('DB_PORT'),
-        getenv('TEST_DB_NAME')
-    )
+        db_name = getenv('TEST_DB_NAME')
+        prefix = 'TEST_'
     else:
-        conectionstring = 'mysql+mysqlconnector://{}:{}@{}:{}/{}'.format(
+        db_name = getenv('DB_NAME')
+        prefix = ''
+    conectionstring = getenv(f'{prefix}DB_URI') or '{}://{}:{}@{}:{}/{}'.format(
+        dialect,
         getenv('DB_USER'),
         getenv('DB_PASSWORD'),
         getenv('DB_HOST'),
         getenv('DB_PORT'),
-        getenv('DB_NAME'))
-        
+        db_name)
+    replica_uri = getenv(f'{prefix}DB_REPLICA_URI')
+
 
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = conectionstring
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if replica_uri:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica_uri}
     app.secret_key = getenv('SECRET_KEY')
+    app.logger.setLevel(getenv('LOG_LEVEL', 'INFO'))
+    app.logger.info(
+        'Database %s: driver=%s pool_size=%s max_overflow=%s pool_recycle=%s pool_pre_ping=%s pool_timeout=%s',
+        db_name, getenv('DB_DRIVER', 'mysqlconnector'), options['pool_size'], options['max_overflow'],
+        options['pool_recycle'], options['pool_pre_ping'], options['pool_timeout'])
+    app.logger.info('Read replica: %s', 'configured' if replica_uri else 'not configured')
+    app.logger.info('JSON encoder: %s', codec_name)
+    if codec_name == 'json' and getenv('JSON_ENCODER', 'auto') == 'auto':
+        app.logger.warning('orjson is not installed, JSON responses are encoded by the standard library')
+    configure_request_logging(app)
 
 
     return app
 
 
 app = create_app()
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 api = Api(app)
+api.representations['application/json'] = output_json
 jwt = JWTManager(app)
 CORS(app)
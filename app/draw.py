@@ -0,0 +1,457 @@
+from collections import deque
+from typing import Iterable, List, Tuple
+import operator
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+NUMPY_THRESHOLD = 100000
+
+# Uniform draws tried before repairing one, for constrained draws.
+REJECTION_ATTEMPTS = 5
+# Perfect draws of up to this many members are solved exactly by backtracking.
+EXACT_CYCLE_SIZE = 10
+# Random swaps tried to merge two cycles, and the size of the exhaustive search that follows.
+MERGE_ATTEMPTS = 2000
+MERGE_EXHAUSTIVE = 250000
+# Cycle covers tried before giving up on finding a perfect draw.
+CYCLE_RESTARTS = 3
+
+_EMPTY = frozenset()
+
+
+class DrawInfeasible(ValueError):
+    """
+    Raised when no draw satisfies the exclusions of a group.
+    """
+
+
+class DrawNotFound(RuntimeError):
+    """
+    Raised when the search for a perfect draw of a large group gives up. Unlike
+    DrawInfeasible, a draw may exist, so the draw can be tried again.
+    """
+
+
+def has_fixed_point(permutation) -> bool:
+    """
+    Checks if any position of the permutation maps to itself.
+
+    Parameters:
+        permutation (List[int]): A permutation of range(len(permutation)).
+
+    Returns:
+        bool: True if `permutation[i] == i` for some `i`.
+    """
+    return any(map(operator.eq, permutation, range(len(permutation))))
+
+
+def _closing_probabilities(num: int) -> List[float]:
+    """
+    Computes, for each `u` up to `num`, the probability (u - 1) * D(u - 2) / D(u) that the
+    Martinez-Panholzer-Prodinger algorithm closes a cycle when `u` elements are left, where
+    D(u) is the number of derangements of `u` elements.
+
+    The ratios D(u - 1) / D(u) follow from D(u) = (u - 1) * (D(u - 1) + D(u - 2)), so the
+    derangement numbers, which grow like u!, are never computed.
+    """
+    probabilities = [0.0] * (num + 1)
+    if num >= 2:
+        probabilities[2] = 1.0
+    previous = 0.0  # D(1) / D(2)
+    for u in range(3, num + 1):
+        ratio = 1 / ((u - 1) * (1 + previous))
+        probabilities[u] = (u - 1) * ratio * previous
+        previous = ratio
+    return probabilities
+
+
+def random_derangement(num: int, seed=None, rng: random.Random | None = None, use_numpy: bool | None = None) -> List[int]:
+    """
+    Generates a uniformly random derangement of range(`num`), a permutation where no
+    position maps to itself.
+
+    The pure Python path runs the Martinez-Panholzer-Prodinger algorithm: it walks the
+    positions from the last one, swaps each open position with a random open position
+    before it and closes that cycle with the probability of a uniform derangement. The
+    open positions are kept in a dense list, so each step draws two random numbers and
+    the running time is linear in the worst case, not only in expectation.
+
+    The NumPy path draws uniform permutations and rejects those with a fixed point. Each
+    attempt succeeds with probability ~1/e, so it takes ~2.72 attempts in expectation and
+    more than 50 with a probability below 1e-10, but its time is only bounded in
+    expectation.
+
+    Args:
+        num (int): The number of elements, 0 or at least 2.
+        seed: The seed of the random generator, for reproducible draws. The two paths
+            consume it differently, so a seed only reproduces the same derangement within
+            one path.
+        rng (random.Random): A random generator to use instead of seeding a new one.
+        use_numpy (bool): Use the NumPy vectorized path. By default it is used when NumPy
+            is installed and `num` is at least NUMPY_THRESHOLD.
+
+    Returns:
+        List[int]: The derangement, where position `i` holds the element assigned to `i`.
+
+    Raises:
+        ValueError: If `num` is negative or 1, since no derangement exists.
+        RuntimeError: If `use_numpy` is True and NumPy is not installed.
+    """
+    if num < 0 or num == 1:
+        raise ValueError(f'There is no derangement of {num} elements')
+    if use_numpy is None:
+        use_numpy = np is not None and num >= NUMPY_THRESHOLD
+    if use_numpy:
+        if np is None:
+            raise RuntimeError('NumPy is not installed')
+        generator = np.random.default_rng(seed)
+        identity = np.arange(num)
+        while True:
+            permutation = generator.permutation(num)
+            if not (permutation == identity).any():
+                return permutation.tolist()
+
+    generator = rng if rng is not None else random.Random(seed)
+    closing = _closing_probabilities(num)
+    permutation = list(range(num))
+    # The open positions, and where each one is in that list, to remove it in O(1).
+    open_positions = list(range(num))
+    index = list(range(num))
+    closed = [False] * num
+
+    def remove(position):
+        last = open_positions.pop()
+        if last != position:
+            open_positions[index[position]] = last
+            index[last] = index[position]
+
+    left = num
+    for i in range(num - 1, -1, -1):
+        if left < 2:
+            break
+        if closed[i]:
+            continue
+        remove(i)
+        j = open_positions[generator.randrange(len(open_positions))]
+        permutation[i], permutation[j] = permutation[j], permutation[i]
+        if generator.random() < closing[left]:
+            closed[j] = True
+            remove(j)
+            left -= 1
+        left -= 1
+    return permutation
+
+
+def _blocked_map(*pair_lists) -> dict:
+    """
+    Maps each giver to the set of receivers it must not draw.
+    """
+    blocked = {}
+    for pairs in pair_lists:
+        for giver, receiver in pairs:
+            blocked.setdefault(giver, set()).add(receiver)
+    return blocked
+
+
+def _is_valid(permutation, blocked) -> bool:
+    return (not has_fixed_point(permutation)
+            and not any(permutation[giver] in receivers for giver, receivers in blocked.items()))
+
+
+def _cycle_from_order(order) -> List[int]:
+    permutation = [0] * len(order)
+    for position, giver in enumerate(order):
+        permutation[giver] = order[(position + 1) % len(order)]
+    return permutation
+
+
+def _augment(root, receiver_of, giver_of, blocked) -> bool:
+    """
+    Searches an augmenting path from the free giver `root` and flips it, matching `root`.
+
+    The graph is the complement of `blocked`, which is never built: every receiver is
+    visited at most once, and a giver only scans the receivers not visited yet, so a search
+    costs O(n + number of blocked pairs) however dense the graph is.
+
+    Returns:
+        bool: False if no augmenting path starts at `root`.
+    """
+    unvisited = set(range(len(receiver_of)))
+    came_from = {}
+    queue = deque([root])
+    while queue:
+        giver = queue.popleft()
+        skip = blocked.get(giver, _EMPTY)
+        reached = [receiver for receiver in unvisited if receiver != giver and receiver not in skip]
+        if reached:
+            # A new set, since iterating a set costs its peak size, not its current one.
+            unvisited = unvisited.difference(reached)
+        for receiver in reached:
+            came_from[receiver] = giver
+            if giver_of[receiver] is None:
+                while True:
+                    giver = came_from[receiver]
+                    previous = receiver_of[giver]
+                    receiver_of[giver], giver_of[receiver] = receiver, giver
+                    if giver == root:
+                        return True
+                    receiver = previous
+            queue.append(giver_of[receiver])
+    return False
+
+
+def _match(initial, passes, rng) -> List[int]:
+    """
+    Repairs a permutation into a perfect matching of givers and receivers.
+
+    The pairs of `initial` allowed by the first map of `passes` are kept, the other givers
+    are greedily given a free receiver when one is allowed, and the rest are matched by
+    augmenting paths, trying each map of `passes` in order, from the strictest to the
+    loosest. Since a giver with no augmenting path never gets one later (Kuhn's algorithm),
+    the first giver that cannot be matched with the last map proves that there is no
+    perfect matching.
+
+    Raises:
+        DrawInfeasible: If no perfect matching is allowed by the last map of `passes`.
+    """
+    receiver_of = list(initial)
+    giver_of = [None] * len(initial)
+    for giver, receiver in enumerate(initial):
+        if receiver == giver or receiver in passes[0].get(giver, _EMPTY):
+            receiver_of[giver] = None
+        else:
+            giver_of[receiver] = giver
+    free = [giver for giver, receiver in enumerate(receiver_of) if receiver is None]
+    open_receivers = [receiver for receiver, giver in enumerate(giver_of) if giver is None]
+    rng.shuffle(free)
+    rng.shuffle(open_receivers)
+    unmatched = []
+    for giver in free:
+        skip = passes[0].get(giver, _EMPTY)
+        for position, receiver in enumerate(open_receivers):
+            if receiver != giver and receiver not in skip:
+                receiver_of[giver], giver_of[receiver] = receiver, giver
+                open_receivers[position] = open_receivers[-1]
+                open_receivers.pop()
+                break
+        else:
+            unmatched.append(giver)
+    for blocked in passes[:-1]:
+        unmatched = [root for root in unmatched if not _augment(root, receiver_of, giver_of, blocked)]
+    for root in unmatched:
+        if not _augment(root, receiver_of, giver_of, passes[-1]):
+            raise DrawInfeasible('The exclusions leave no valid draw')
+    return receiver_of
+
+
+def _cycles(permutation) -> Tuple[List[int], List[List[int]]]:
+    """
+    Returns the cycle of each element and the elements of each cycle.
+    """
+    labels = [-1] * len(permutation)
+    cycles = []
+    for start in range(len(permutation)):
+        if labels[start] == -1:
+            cycle = []
+            node = start
+            while labels[node] == -1:
+                labels[node] = len(cycles)
+                cycle.append(node)
+                node = permutation[node]
+            cycles.append(cycle)
+    return labels, cycles
+
+
+def _merge(cycle, labels, receiver_of, blocked, rng) -> bool:
+    """
+    Merges `cycle` with another cycle by swapping the receivers of a giver of each one,
+    a -> a' and b -> b' becoming a -> b' and b -> a'.
+
+    Returns:
+        bool: False if no allowed swap was found.
+    """
+    num = len(receiver_of)
+    label = labels[cycle[0]]
+
+    def swap(a, b):
+        if labels[b] == label:
+            return False
+        if receiver_of[b] in blocked.get(a, _EMPTY) or receiver_of[a] in blocked.get(b, _EMPTY):
+            return False
+        receiver_of[a], receiver_of[b] = receiver_of[b], receiver_of[a]
+        return True
+
+    for _ in range(MERGE_ATTEMPTS):
+        if swap(rng.choice(cycle), rng.randrange(num)):
+            return True
+    if len(cycle) * (num - len(cycle)) <= MERGE_EXHAUSTIVE:
+        return any(swap(a, b) for a in cycle for b in range(num))
+    return False
+
+
+def _join_cycles(receiver_of, blocked, rng) -> bool:
+    """
+    Merges the cycles of a permutation, the smallest first, until a single cycle is left.
+    A random permutation has ~ln(n) cycles, so few merges are needed.
+    """
+    while True:
+        labels, cycles = _cycles(receiver_of)
+        if len(cycles) == 1:
+            return True
+        if not _merge(min(cycles, key=len), labels, receiver_of, blocked, rng):
+            return False
+
+
+def _reaches_all(num, blocked) -> bool:
+    """
+    Checks that every element is reachable from element 0 in the complement of `blocked`,
+    in O(n + number of blocked pairs).
+    """
+    unvisited = set(range(1, num))
+    stack = [0]
+    while stack and unvisited:
+        skip = blocked.get(stack.pop(), _EMPTY)
+        reached = [node for node in unvisited if node not in skip]
+        if reached:
+            unvisited = unvisited.difference(reached)
+        stack.extend(reached)
+    return not unvisited
+
+
+def _exact_cycle(num, blocked, rng) -> List[int] | None:
+    """
+    Searches a single cycle through every element by backtracking, in random order.
+    """
+    order = [0]
+    used = [True] + [False] * (num - 1)
+
+    def extend(node):
+        if len(order) == num:
+            return 0 not in blocked.get(node, _EMPTY)
+        candidates = [other for other in range(num) if not used[other] and other not in blocked.get(node, _EMPTY)]
+        rng.shuffle(candidates)
+        for other in candidates:
+            used[other] = True
+            order.append(other)
+            if extend(other):
+                return True
+            order.pop()
+            used[other] = False
+        return False
+
+    return _cycle_from_order(order) if extend(0) else None
+
+
+def constrained_derangement(num: int, exclude: Iterable[Tuple[int, int]] = (), avoid: Iterable[Tuple[int, int]] = (),
+                            seed=None, rng: random.Random | None = None) -> List[int]:
+    """
+    Generates a random derangement of range(`num`) where no giver draws an excluded receiver,
+    and, as far as possible, no giver draws a receiver it should avoid.
+
+    A few uniform derangements are drawn first, and the first one that breaks no rule is
+    returned, so sparse rules keep the draw uniform. Otherwise the last one is repaired
+    into a perfect bipartite matching: its allowed pairs are kept and the other givers are
+    matched with augmenting paths, avoiding the `avoid` pairs when they can. This takes
+    O(n + number of pairs) per repaired giver and never loops: if the exclusions leave
+    no derangement, it is known as soon as one giver cannot be matched.
+
+    Args:
+        num (int): The number of elements.
+        exclude (Iterable[Tuple[int, int]]): The (giver, receiver) pairs that must not be drawn.
+        avoid (Iterable[Tuple[int, int]]): The (giver, receiver) pairs that should not be drawn.
+        seed: The seed of the random generator, for reproducible draws.
+        rng (random.Random): A random generator to use instead of seeding a new one.
+
+    Returns:
+        List[int]: The derangement, where position `i` holds the element assigned to `i`.
+
+    Raises:
+        DrawInfeasible: If no derangement avoids the excluded pairs.
+    """
+    if num < 0 or num == 1:
+        raise DrawInfeasible(f'There is no derangement of {num} elements')
+    generator = rng if rng is not None else random.Random(seed)
+    hard = _blocked_map(exclude)
+    combined = _blocked_map(exclude, avoid)
+    permutation = []
+    for _ in range(REJECTION_ATTEMPTS):
+        permutation = random_derangement(num, rng=generator, use_numpy=False)
+        if _is_valid(permutation, combined):
+            return permutation
+    return _match(permutation, [combined, hard], generator)
+
+
+def constrained_cycle(num: int, exclude: Iterable[Tuple[int, int]] = (), avoid: Iterable[Tuple[int, int]] = (),
+                      seed=None, rng: random.Random | None = None) -> List[int]:
+    """
+    Generates a random single cycle through range(`num`), as a permutation, where no giver
+    draws an excluded receiver, and, as far as possible, no giver draws a receiver it should avoid.
+
+    A few uniform cycles are drawn first, and the first one that breaks no rule is returned.
+    Otherwise, groups of up to EXACT_CYCLE_SIZE are solved exactly by backtracking. Larger
+    groups get a cycle cover from `constrained_derangement`'s matching, whose cycles are
+    then merged two at a time by swapping the receivers of one giver of each.
+
+    Before searching, the excluded pairs are checked to leave every element reachable from
+    every other one, and to allow a cycle cover; if not, no cycle exists and the draw fails
+    at once. Finding a single cycle is NP-complete in general, so a large group that passes
+    these checks but where no cycle is found after CYCLE_RESTARTS covers raises DrawNotFound
+    instead, since a cycle may still exist; this happens when the exclusions leave a few
+    links between large subsets of the group.
+
+    Args:
+        num (int): The number of elements.
+        exclude (Iterable[Tuple[int, int]]): The (giver, receiver) pairs that must not be drawn.
+        avoid (Iterable[Tuple[int, int]]): The (giver, receiver) pairs that should not be drawn.
+        seed: The seed of the random generator, for reproducible draws.
+        rng (random.Random): A random generator to use instead of seeding a new one.
+
+    Returns:
+        List[int]: The cycle, where position `i` holds the element assigned to `i`.
+
+    Raises:
+        DrawInfeasible: If no single cycle avoiding the excluded pairs exists.
+        DrawNotFound: If the search gave up on a group of more than EXACT_CYCLE_SIZE elements.
+    """
+    if num < 2:
+        raise DrawInfeasible(f'There is no cycle of {num} elements')
+    generator = rng if rng is not None else random.Random(seed)
+    hard = _blocked_map(exclude)
+    combined = _blocked_map(exclude, avoid)
+    order = list(range(num))
+    for _ in range(REJECTION_ATTEMPTS):
+        generator.shuffle(order)
+        permutation = _cycle_from_order(order)
+        if _is_valid(permutation, combined):
+            return permutation
+
+    reverse = _blocked_map((receiver, giver) for giver, receiver in _pairs(hard))
+    if not (_reaches_all(num, hard) and _reaches_all(num, reverse)):
+        raise DrawInfeasible('The exclusions leave no single cycle through every member')
+    for blocked in ([combined, hard] if combined != hard else [hard]):
+        if num <= EXACT_CYCLE_SIZE:
+            permutation = _exact_cycle(num, blocked, generator)
+            if permutation:
+                return permutation
+            continue
+        for _ in range(CYCLE_RESTARTS):
+            try:
+                cover = _match(random_derangement(num, rng=generator, use_numpy=False), [blocked], generator)
+            except DrawInfeasible:
+                if blocked is hard:
+                    raise
+                break
+            if _join_cycles(cover, blocked, generator):
+                return cover
+    if num <= EXACT_CYCLE_SIZE:
+        raise DrawInfeasible('The exclusions leave no single cycle through every member')
+    raise DrawNotFound('No single cycle through every member avoiding the exclusions was found, try again')
+
+
+def _pairs(blocked):
+    return ((giver, receiver) for giver, receivers in blocked.items() for receiver in receivers)
@@ -0,0 +1,114 @@
+from app.draw import DrawInfeasible, DrawNotFound
+from app.models import DrawJob, Group, GroupConflict
+import app.config as app_config
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from os import getenv
+import json
+import logging
+import threading
+
+
+load_dotenv()
+
+
+db, app = app_config.db, app_config.app
+logger = logging.getLogger(__name__)
+
+DRAW_METHODS = {
+    'PERFECT': 'perfect_drawn',
+    'IMPERFECT': 'imperfect_drawn',
+}
+
+
+class DrawJobRunner:
+    """
+    Runs the draws queued in the `draw_job` table in a pool of worker threads of the API process,
+    so the request that asks for a draw returns at once.
+
+    A job is committed as RUNNING when a worker picks it up, and as DONE in the same transaction
+    that saves the draw, so its status never claims a draw that was not saved. The unique
+    `active_group_id` of the jobs keeps a single draw of each group active at a time.
+    """
+
+    def __init__(self, workers=2, timeout=600):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='draw')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(getenv('DRAW_WORKERS', 2)),
+            timeout=float(getenv('DRAW_JOB_TIMEOUT', 600)),
+        )
+
+    def submit(self, job_id):
+        """
+        Schedules a QUEUED job to run on a worker thread.
+
+        Returns:
+            Future: Resolved when the job finished.
+        """
+        future = self._executor.submit(self.run, job_id)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def run(self, job_id):
+        """
+        Runs a QUEUED job in its own app context and records its outcome.
+        """
+        with app.app_context():
+            try:
+                job = db.session.get(DrawJob, job_id)
+                if job is None or not job.start():
+                    db.session.rollback()
+                    return
+                db.session.commit()
+
+                group = db.session.get(Group, job.group_id)
+                exclude, avoid = json.loads(job.rules)
+                # Locks the job until the draw is saved, so it cannot time out meanwhile.
+                if not job.finish('DONE'):
+                    db.session.rollback()
+                    return
+                try:
+                    # Saving the draw commits the job too.
+                    getattr(group, DRAW_METHODS[job.drawn])(exclude, avoid)
+                except (DrawInfeasible, DrawNotFound, GroupConflict) as e:
+                    db.session.rollback()
+                    if job.finish('FAILED', str(e)):
+                        db.session.commit()
+            except Exception:
+                logger.exception('Draw job %s failed', job_id)
+                db.session.rollback()
+                job = db.session.get(DrawJob, job_id)
+                if job is not None and job.finish('FAILED', 'An error occurred'):
+                    db.session.commit()
+            finally:
+                db.session.remove()
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Waits for the submitted jobs to finish.
+
+        Returns:
+            bool: False if some job was still running after `timeout` seconds.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        return not wait(pending, timeout).not_done
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+draw_jobs = DrawJobRunner.from_env()
@@ -0,0 +1,108 @@
+from flask import g, request
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+from queue import Full, Queue
+import atexit
+import json
+import logging
+import random
+import time
+
+
+REQUEST_LOGGER = 'app.requests'
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a log record as one JSON object per line, merging the `fields` extra into it.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    A QueueHandler that drops records instead of blocking when the queue is full,
+    so a slow disk never stalls the request threads.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+def configure_request_logging(app):
+    """
+    Sets up structured request logging, once per app.
+
+    Each request is logged as a JSON line with its method, route, status and latency.
+    Records are put on a bounded queue and written to disk by a QueueListener thread,
+    so the request thread never waits on I/O.
+
+    Environment Variables:
+        LOG_FILE: The file the request log is appended to (default 'api.log').
+        LOG_SAMPLE_RATE: The fraction of successful requests that are logged (default 1.0).
+            Requests that fail with a 5xx status are always logged.
+        LOG_BODY_MAX: The maximum number of bytes of the body logged for the resources
+            decorated with `generate_logs` (default 1024).
+        LOG_QUEUE_SIZE: The maximum number of records waiting to be written (default 10000).
+
+    Parameters:
+        app (Flask): The Flask app.
+
+    Returns:
+        QueueListener: The listener writing the records, stopped at exit.
+    """
+    if 'request_logging' in app.extensions:
+        return app.extensions['request_logging']
+
+    sample_rate = float(getenv('LOG_SAMPLE_RATE', 1.0))
+    body_max = int(getenv('LOG_BODY_MAX', 1024))
+    queue = Queue(maxsize=int(getenv('LOG_QUEUE_SIZE', 10000)))
+    file_handler = logging.FileHandler(getenv('LOG_FILE', 'api.log'), delay=True)
+    file_handler.setFormatter(JSONFormatter())
+    listener = QueueListener(queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(REQUEST_LOGGER)
+    logger.addHandler(DroppingQueueHandler(queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if response.status_code < 500 and random.random() >= sample_rate:
+            return response
+        started = g.get('request_started')
+        fields = {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'path': request.path,
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 3) if started else None,
+        }
+        if g.get('log_body'):
+            fields['body'] = request.get_data(cache=True)[:body_max].decode('utf-8', 'replace')
+        logger.info('%s %s %s', request.method, request.path, response.status_code, extra={'fields': fields})
+        return response
+
+    app.extensions['request_logging'] = listener
+    return listener
@@ -0,0 +1,211 @@
+from app.models import EmailOutbox
+from app.utils import confirmation_message, recovery_message
+import app.config as app_config
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from os import getenv
+import datetime
+import logging
+import smtplib
+import sys
+import threading
+
+
+load_dotenv()
+
+
+db, app = app_config.db, app_config.app
+logger = logging.getLogger(__name__)
+
+MESSAGE_BUILDERS = {
+    'confirmation': confirmation_message,
+    'recovery': recovery_message,
+}
+
+
+class SMTPSender:
+    """
+    Delivers batches of emails, reusing one SMTP connection per batch.
+    """
+
+    def __init__(self, host='localhost', port=25, user=None, password=None, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            host=getenv('SMTP_HOST', 'localhost'),
+            port=int(getenv('SMTP_PORT', 25)),
+            user=getenv('SMTP_USER'),
+            password=getenv('SMTP_PASSWORD'),
+            starttls=app_config.getenv_bool('SMTP_STARTTLS', False),
+        )
+
+    def send_batch(self, messages):
+        """
+        Sends a batch of messages over a single connection.
+
+        Parameters:
+            messages (List[Tuple[int, EmailMessage]]): The id of each outbox row and its message.
+
+        Returns:
+            dict: A map of the id of each row to None if it was sent, or the error message otherwise.
+        """
+        results = {}
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.user:
+                    smtp.login(self.user, self.password)
+                for outbox_id, message in messages:
+                    try:
+                        smtp.send_message(message)
+                        results[outbox_id] = None
+                    except smtplib.SMTPException as error:
+                        results[outbox_id] = str(error)
+        except (OSError, smtplib.SMTPException) as error:
+            for outbox_id, _ in messages:
+                results.setdefault(outbox_id, str(error))
+        return results
+
+
+class OutboxDispatcher:
+    """
+    Delivers the emails stored in the `email_outbox` table.
+
+    Each round claims a batch of due emails, splits it between a pool of worker threads,
+    each one sending its share over one SMTP connection, and records the results.
+    Failed deliveries are retried with exponential backoff until `max_attempts`.
+    The token of an email is cleared once it is SENT or FAILED; its `dedupe_key` is kept.
+    Claimed emails are leased for `lease` seconds, so the emails of a dispatcher that
+    died mid-batch are picked up again by the next round.
+    """
+
+    def __init__(self, sender=None, batch_size=50, workers=4, max_attempts=5, backoff=30,
+                 poll_interval=2, lease=300):
+        self.sender = sender or SMTPSender.from_env()
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            batch_size=int(getenv('OUTBOX_BATCH_SIZE', 50)),
+            workers=int(getenv('OUTBOX_WORKERS', 4)),
+            max_attempts=int(getenv('OUTBOX_MAX_ATTEMPTS', 5)),
+            backoff=float(getenv('OUTBOX_BACKOFF', 30)),
+            poll_interval=float(getenv('OUTBOX_POLL_INTERVAL', 2)),
+        )
+
+    def claim(self):
+        """
+        Leases a batch of due emails to this dispatcher.
+
+        Returns:
+            List[EmailOutbox]: The claimed emails.
+        """
+        now = datetime.datetime.now()
+        emails = (EmailOutbox.query
+                  .filter(EmailOutbox.status.in_(('PENDING', 'SENDING')), EmailOutbox.next_attempt_at <= now)
+                  .order_by(EmailOutbox.next_attempt_at)
+                  .limit(self.batch_size)
+                  .with_for_update(skip_locked=True)
+                  .all())
+        for email in emails:
+            email.status = 'SENDING'
+            email.next_attempt_at = now + datetime.timedelta(seconds=self.lease)
+        db.session.commit()
+        return emails
+
+    def run_once(self) -> int:
+        """
+        Claims and delivers one batch of due emails. Must run inside an app context.
+
+        Returns:
+            int: The number of emails claimed.
+        """
+        emails = self.claim()
+        if not emails:
+            return 0
+        messages = [(email.id, MESSAGE_BUILDERS[email.kind](email.email, email.token)) for email in emails]
+        chunk_size = -(-len(messages) // self.workers)
+        chunks = [messages[start:start + chunk_size] for start in range(0, len(messages), chunk_size)]
+        results = {}
+        for chunk_results in self._executor.map(self.sender.send_batch, chunks):
+            results.update(chunk_results)
+
+        now = datetime.datetime.now()
+        for email in emails:
+            error = results.get(email.id, 'not sent')
+            email.attempts += 1
+            if error is None:
+                email.status = 'SENT'
+                email.sent_at = now
+                email.last_error = None
+                email.token = None
+            elif email.attempts >= self.max_attempts:
+                email.status = 'FAILED'
+                email.token = None
+                email.last_error = error[:255]
+                logger.error('Giving up on %r after %s attempts: %s', email, email.attempts, error)
+            else:
+                email.status = 'PENDING'
+                email.last_error = error[:255]
+                email.next_attempt_at = now + datetime.timedelta(seconds=self.backoff * 2 ** (email.attempts - 1))
+        db.session.commit()
+        return len(emails)
+
+    def run_forever(self):
+        """
+        Delivers batches until `stop` is called, sleeping `poll_interval` seconds when the outbox is empty.
+        """
+        with app.app_context():
+            while not self._stop.is_set():
+                try:
+                    claimed = self.run_once()
+                except Exception:
+                    logger.exception('Outbox dispatch failed')
+                    db.session.rollback()
+                    claimed = 0
+                finally:
+                    db.session.remove()
+                if claimed < self.batch_size:
+                    self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """
+        Runs the dispatcher in a background thread of the current process.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    dispatcher = OutboxDispatcher.from_env()
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        dispatcher.stop()
+        sys.exit(0)
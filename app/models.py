@@ -1,13 +1,20 @@
-from werkzeug.security import generate_password_hash, check_password_hash
-from app.utils import generate_pairs
+from app.passwords import password_hasher
+from app.draw import constrained_cycle, constrained_derangement, random_derangement
+from app.cache import group_cache, token_cache
+from app.keys import HexUUID, uuid7_hex
+from app.schemas import DrawJobPayload, FriendPayload, GroupPayload, UserPayload
 from flask_sqlalchemy import SQLAlchemy
 import app.config as app_config
-from sqlalchemy.orm import Query
+from sqlalchemy.orm import Query, Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from dataclasses import dataclass
 from typing import List, Tuple
-from sqlalchemy import DECIMAL
+from sqlalchemy import DECIMAL, and_, bindparam, event, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 import datetime
+import hashlib
+import json
 import random
-import uuid
 from os import getenv
 import jwt
 
@@ -21,9 +28,30 @@ class BaseModel(db.Model):
     query: Query
 
 
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    A detached, read-only copy of a user, safe to share between requests.
+    """
+    id: str
+    name: str
+    email: str
+    social_media: str
+    is_superuser: bool
+    banned: bool
+
+    def serialize(self) -> UserPayload:
+        return {
+            'id': self.id,
+            'username': self.name,
+            'email': self.email,
+            'social_media': self.social_media
+        }
+
+
 class User(BaseModel):
     __tablename__ = 'user'
-    id = db.Column(db.String(32), primary_key=True, default=lambda: str(uuid.uuid4().hex))
+    id = db.Column(HexUUID, primary_key=True, default=uuid7_hex)
     name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     social_media = db.Column(db.String(240), nullable=False)
@@ -35,10 +63,16 @@ class User(BaseModel):
         raise AttributeError('password is not a readable attribute')
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def needs_rehash(self):
+        """
+        Checks if the password hash was made with another method or cost than PASSWORD_HASH_METHOD.
+        """
+        return password_hasher.needs_rehash(self.password_hash)
     def generate_access_token(self):
         secret_key = getenv('SECRET_KEY')
         payload = {
@@ -60,38 +94,74 @@ class User(BaseModel):
 
     
 
-    def __init__(self, name, email, social_media, password):
+    def __init__(self, name, email, social_media, password=None, password_hash=None):
         self.name = name
         self.email = email
         self.social_media = social_media
-        self.password = password
+        if password_hash is not None:
+            self.password_hash = password_hash
+        else:
+            self.password = password
     
     def __repr__(self):
         return '<User %r>' % self.name
     
-    def serialize(self):
+    def serialize(self) -> UserPayload:
         return {
             'id': self.id,
             'username': self.name,
             'email': self.email,
             'social_media': self.social_media
         }
+
+    def snapshot(self) -> UserSnapshot:
+        """
+        Returns a detached, immutable copy of the user.
+        """
+        return UserSnapshot(self.id, self.name, self.email, self.social_media,
+                            bool(self.is_superuser), bool(self.banned))
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _track_changed_user(mapper, connection, target):
+    changed_users = Session.object_session(target).info.setdefault('changed_users', set())
+    changed_users.add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    changed_users = session.info.pop('changed_users', ())
+    for user_id in changed_users:
+        token_cache.invalidate_user(user_id)
+    if changed_users:
+        group_cache.invalidate_all()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_users', None)
     
 
 
+class GroupConflict(Exception):
+    """
+    Raised when a group was changed by another request since it was read.
+    """
+
+
 class Group(BaseModel):
     __tablename__ = 'group'
 
 
     
-    id = db.Column(db.String(32), primary_key=True,default=lambda: str(uuid.uuid4().hex))
+    id = db.Column(HexUUID, primary_key=True, default=uuid7_hex)
     description = db.Column(db.String(80), nullable=False)
-    creator = db.Column(db.String(32), db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.datetime.now())
+    creator = db.Column(HexUUID, db.ForeignKey('user.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
     event_date = db.Column(db.DateTime)
     min_gift_price = db.Column(DECIMAL(10,2))
     max_gift_price = db.Column(DECIMAL(10,2))
-    drawn = db.Column(db.String(10), nullable=False, default='NO')
+    drawn = db.Column(db.String(10), nullable=False, default='NO', index=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __init__(self, description, creator, event_date, min_gift_price, max_gift_price):
         self.description = description
@@ -100,52 +170,418 @@ class Group(BaseModel):
         self.min_gift_price = min_gift_price
         self.max_gift_price = max_gift_price
 
-    friends = db.relationship('Friend', backref='group', lazy='joined')
-    
-    def imperfect_drawn(self):
-        pairs = generate_pairs(len(self.friends))
-        for pair in pairs:                
-            self.friends[pair[0]].friend_id = self.friends[pair[1]].user_id
-        self.drawn = 'IMPERFECT'
+    # Loaded only when accessed; routes choose per query between selectinload, for the ones
+    # that serialize members, and raiseload, for the ones that only read the group's columns.
+    friends = db.relationship('Friend', backref='group', lazy='select')
+
+    @staticmethod
+    def create(description, creator, event_date, min_gift_price, max_gift_price, creator_desired_gift=None):
+        """
+        Creates a group with its creator as an admin friend, in a single transaction.
+
+        Returns:
+            Group: The new group.
+        """
+        group = Group(description, creator, event_date, min_gift_price, max_gift_price)
+        group.id = uuid7_hex()
+        friend = Friend(creator, group.id, creator_desired_gift)
+        friend.is_admin = True
+        db.session.add_all([group, friend])
         db.session.commit()
+        return group
+
+    @staticmethod
+    def create_many(groups) -> List[str]:
+        """
+        Creates several groups, each one with its creator as an admin friend, with one
+        executemany per table and a single commit.
 
-    def perfect_drawn(self):
-        random.shuffle(self.friends)
-        for i in range(len(self.friends)-1):
-            self.friends[i].friend_id = self.friends[i+1].user_id
-        self.friends[-1].friend_id = self.friends[0].user_id
-        self.drawn = 'PERFECT'
+        Parameters:
+            groups (List[dict]): The keyword arguments of `Group.create` for each group.
+
+        Returns:
+            List[str]: The ids of the new groups, in the same order.
+        """
+        now = datetime.datetime.now()
+        group_rows, friend_rows = [], []
+        for fields in groups:
+            group_id = uuid7_hex()
+            group_rows.append({
+                'id': group_id,
+                'description': fields['description'],
+                'creator': fields['creator'],
+                'created_at': now,
+                'event_date': fields['event_date'],
+                'min_gift_price': fields['min_gift_price'],
+                'max_gift_price': fields['max_gift_price'],
+                'drawn': 'NO',
+                'version': 0,
+            })
+            friend_rows.append({'user_id': fields['creator'], 'group_id': group_id, 'friend_id': None,
+                                'gift_desired': fields.get('creator_desired_gift'), 'is_admin': True})
+        if group_rows:
+            db.session.execute(insert(Group.__table__), group_rows)
+            db.session.execute(insert(Friend.__table__), friend_rows)
         db.session.commit()
+        return [row['id'] for row in group_rows]
+
+    @staticmethod
+    def current_version(group_id):
+        """
+        Reads the version of a group, without loading the group or its friends.
+
+        Returns:
+            int|None: The version, or None if the group does not exist.
+        """
+        return db.session.query(Group.version).filter_by(id=group_id).scalar()
+
+    def touch(self, **values):
+        """
+        Bumps the version of the group and sets `values` on its row, if the group was not changed
+        since it was read (a compare-and-swap on `version`).
+
+        Every change to the group or its friends must call it before its first write: the cached
+        payloads and the ETags of the group depend on the version, and the UPDATE locks the row
+        of the group until the commit, so a concurrent change fails here, after waiting at most
+        for the writes of this transaction, instead of interleaving with them.
+
+        Raises:
+            GroupConflict: If another transaction changed the group since it was read. The session is rolled back.
+        """
+        table = Group.__table__
+        version = self.version
+        result = db.session.execute(
+            update(table).where(table.c.id == self.id, table.c.version == version).values(version=version + 1, **values)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            raise GroupConflict('The group was changed by another request, try again')
+        for key, value in {'version': version + 1, **values}.items():
+            set_committed_value(self, key, value)
     
-    def kick_out(self, friend_id):
-        friend = Friend.query.filter_by(user_id=friend_id).first()
+    def member_ids(self) -> list:
+        """
+        Returns the user ids of the friends of the group, without loading the friends.
+        """
+        return [row.user_id for row in db.session.query(Friend.user_id).filter_by(group_id=self.id)]
+
+    @staticmethod
+    def drawn_pairs(group_id) -> List[Tuple[str, str]]:
+        """
+        Returns the (giver, receiver) user ids of the last draw of a group.
+        """
+        rows = (db.session.query(Friend.user_id, Friend.friend_id)
+                .filter(Friend.group_id == group_id, Friend.friend_id.isnot(None)))
+        return [(row.user_id, row.friend_id) for row in rows]
+
+    @staticmethod
+    def draw_rules(user_ids, exclude, avoid) -> Tuple[list, list]:
+        """
+        Translates the rules of a draw from user ids to positions in `user_ids`, ignoring the
+        users that are not in the group.
+
+        Parameters:
+            user_ids (List[str]): The user ids of the friends of the group.
+            exclude (Iterable[Tuple[str, str]]): Pairs of users that must not draw each other.
+            avoid (Iterable[Tuple[str, str]]): (giver, receiver) pairs that should not be drawn.
+
+        Returns:
+            Tuple: The excluded (giver, receiver) positions, both ways, and the avoided ones.
+        """
+        position = {user_id: index for index, user_id in enumerate(user_ids)}
+        excluded = [(position[a], position[b]) for a, b in exclude if a in position and b in position]
+        avoided = [(position[a], position[b]) for a, b in avoid if a in position and b in position]
+        return excluded + [(b, a) for a, b in excluded], avoided
+
+    def imperfect_drawn(self, exclude=(), avoid=()):
+        """
+        Draws a receiver for every friend, anyone but themselves, and saves the draw.
+
+        Parameters:
+            exclude (Iterable[Tuple[str, str]]): Pairs of user ids that must not draw each other.
+            avoid (Iterable[Tuple[str, str]]): (giver, receiver) user ids that should not be drawn,
+                such as the pairs of a previous draw.
+
+        Raises:
+            DrawInfeasible: If the exclusions leave no valid draw.
+        """
+        user_ids = self.member_ids()
+        if exclude or avoid:
+            derangement = constrained_derangement(len(user_ids), *Group.draw_rules(user_ids, exclude, avoid))
+        else:
+            derangement = random_derangement(len(user_ids))
+        assignment = {user_ids[giver]: user_ids[receiver] for giver, receiver in enumerate(derangement)}
+        self.save_assignment(assignment, 'IMPERFECT')
+
+    def perfect_drawn(self, exclude=(), avoid=()):
+        """
+        Draws a single cycle through every friend, and saves the draw.
+
+        Parameters:
+            exclude (Iterable[Tuple[str, str]]): Pairs of user ids that must not draw each other.
+            avoid (Iterable[Tuple[str, str]]): (giver, receiver) user ids that should not be drawn,
+                such as the pairs of a previous draw.
+
+        Raises:
+            DrawInfeasible: If no single cycle avoiding the exclusions exists.
+            DrawNotFound: If the search for a cycle gave up, although one may exist.
+        """
+        user_ids = self.member_ids()
+        if exclude or avoid:
+            cycle = constrained_cycle(len(user_ids), *Group.draw_rules(user_ids, exclude, avoid))
+            assignment = {user_ids[giver]: user_ids[receiver] for giver, receiver in enumerate(cycle)}
+        else:
+            random.shuffle(user_ids)
+            assignment = {user_ids[i]: user_ids[(i + 1) % len(user_ids)] for i in range(len(user_ids))}
+        self.save_assignment(assignment, 'PERFECT')
+
+    def save_assignment(self, assignment: dict, drawn: str):
+        """
+        Saves the result of a draw and commits it in a single transaction.
+
+        Raises:
+            GroupConflict: If the group was changed since it was read, nothing is saved.
+
+        The assignments are written with one executemany of a single UPDATE statement,
+        compiled once, instead of letting the unit of work flush one UPDATE per friend,
+        and are committed together with the change of the `drawn` flag.
+
+        Parameters:
+            assignment (dict): A map of the user id of each giver to the user id of its receiver.
+            drawn (str): The new `drawn` state of the group ('PERFECT' or 'IMPERFECT').
+        """
+        self.touch(drawn=drawn)
+        if assignment:
+            db.session.execute(ASSIGNMENT_UPDATE, [
+                {'b_group_id': self.id, 'b_user_id': giver, 'b_friend_id': receiver}
+                for giver, receiver in assignment.items()
+            ])
+        db.session.commit()
+    
+    def add_friends(self, entries, chunk_size=1000):
+        """
+        Adds users to the group in a single transaction, yielding the progress after each chunk.
+
+        Each chunk resolves its users with one IN query and inserts its friends with one
+        executemany. If any friend is added to a drawn group, its draw is cleared, like a kick.
+        The transaction is committed after the last chunk, so the generator must be exhausted;
+        if it is closed early, nothing is saved.
+
+        Parameters:
+            entries (List[dict]): The users to add, each one with an `email` or a `user_id`,
+                and optionally their `gift_desired`.
+            chunk_size (int): The number of entries resolved and inserted at a time.
+
+        Yields:
+            dict: After each chunk, the number of entries `processed` so far, the user ids `added`,
+                and the `duplicates` (already in the group or repeated) and `not_found` entries of the chunk,
+                as they were sent.
+
+        Raises:
+            GroupConflict: If the group was changed since it was read, before the first friend is added.
+        """
+        members = set(self.member_ids())
+        changed = False
+        committed = False
+        try:
+            for start in range(0, len(entries), chunk_size):
+                chunk = entries[start:start + chunk_size]
+                emails = [entry['email'] for entry in chunk if not entry.get('user_id')]
+                user_ids = [entry['user_id'].lower() for entry in chunk if entry.get('user_id')]
+                rows = (db.session.query(User.id, User.email)
+                        .filter(or_(User.email.in_(emails), User.id.in_(user_ids)))
+                        .all()) if chunk else []
+                by_email = {row.email: row.id for row in rows}
+                known_ids = {row.id for row in rows}
+                added, duplicates, not_found, values = [], [], [], []
+                for entry in chunk:
+                    reference = entry.get('user_id') or entry['email']
+                    user_id = entry['user_id'].lower() if entry.get('user_id') else by_email.get(entry['email'])
+                    if user_id is None or user_id not in known_ids:
+                        not_found.append(reference)
+                    elif user_id in members:
+                        duplicates.append(reference)
+                    else:
+                        members.add(user_id)
+                        added.append(user_id)
+                        values.append({'user_id': user_id, 'group_id': self.id,
+                                       'gift_desired': entry.get('gift_desired'), 'is_admin': False})
+                if values:
+                    if not changed:
+                        changed = True
+                        reset_draw = self.drawn != 'NO'
+                        self.touch(**({'drawn': 'NO'} if reset_draw else {}))
+                        if reset_draw:
+                            db.session.execute(
+                                update(Friend).where(Friend.group_id == self.id).values(friend_id=None)
+                                .execution_options(synchronize_session=False)
+                            )
+                    db.session.execute(insert(Friend.__table__), values)
+                yield {'processed': start + len(chunk), 'added': added, 'duplicates': duplicates, 'not_found': not_found}
+            db.session.commit()
+            committed = True
+        finally:
+            if not committed:
+                db.session.rollback()
+
+    def kick_out(self, friend_id, reset_draw=False, repair_draw=False) -> bool:
+        """
+        Removes a friend from the group and commits it.
+
+        Parameters:
+            friend_id (str): The user id of the friend to remove.
+            reset_draw (bool): If True, every assignment of the group is cleared and the group
+                goes back to not drawn, in the same transaction.
+            repair_draw (bool): If True, the draw is patched instead (see `draw_repair`), so every
+                other friend keeps its assignment. It falls back to `reset_draw` when the draw
+                cannot be repaired.
+
+        Returns:
+            bool: True if the draw of the group was repaired and kept.
+
+        Raises:
+            GroupConflict: If the group was changed since it was read, nothing is saved.
+        """
+        friend = db.session.get(Friend, (friend_id, self.id))
+        changes = self.draw_repair(friend) if repair_draw else None
+        reset_draw = (reset_draw or repair_draw) and changes is None
+        self.touch(**({'drawn': 'NO'} if reset_draw else {}))
         db.session.delete(friend)
+        if reset_draw:
+            db.session.execute(
+                update(Friend).where(Friend.group_id == self.id).values(friend_id=None)
+                .execution_options(synchronize_session=False)
+            )
+        elif changes:
+            db.session.execute(ASSIGNMENT_UPDATE, [
+                {'b_group_id': self.id, 'b_user_id': giver, 'b_friend_id': receiver}
+                for giver, receiver in changes.items()
+            ])
         db.session.commit()
+        return changes is not None
+
+    def draw_repair(self, friend) -> dict:
+        """
+        Computes the assignments that keep the draw valid once `friend` leaves the group.
+
+        The giver of the friend takes over its receiver, which closes a `PERFECT` cycle with a
+        single change. In an `IMPERFECT` draw the friend and its giver may have drawn each other;
+        the giver is then inserted after a random friend of another pair, so at most two
+        assignments change and everyone else keeps theirs. The rules of the draw are not stored,
+        so a draw made with rules should be made again instead of repaired.
+
+        Parameters:
+            friend (Friend): The friend that will leave the group.
+
+        Returns:
+            dict: A map of the user id of each giver to its new receiver, or None if the group
+                is not drawn or the draw cannot be repaired, such as when one friend would be left.
+        """
+        if self.drawn not in ('PERFECT', 'IMPERFECT') or friend.friend_id is None:
+            return None
+        receiver = friend.friend_id
+        giver = db.session.query(Friend.user_id).filter_by(group_id=self.id, friend_id=friend.user_id).scalar()
+        if giver is None:
+            return None
+        if giver != receiver:
+            return {giver: receiver}
+        if self.drawn != 'IMPERFECT':
+            return None
+        others = db.session.query(Friend.user_id, Friend.friend_id).filter(
+            Friend.group_id == self.id,
+            Friend.user_id.notin_([giver, friend.user_id]),
+            Friend.friend_id.isnot(None),
+        )
+        count = others.count()
+        if not count:
+            return None
+        other, other_receiver = others.order_by(Friend.user_id).offset(random.randrange(count)).first()
+        return {other: giver, giver: other_receiver}
 
         
 
 
 
-    def serialize(self):
+    @staticmethod
+    def load_users(groups) -> dict:
+        """
+        Loads, in a single query, every user referenced by the friends of the given groups.
+
+        Both the participants (`user_id`) and their assignees (`friend_id`) are fetched,
+        so serializing the groups afterwards does not hit the database again.
+
+        Parameters:
+            groups (Iterable[Group]): The groups whose friends will be serialized.
+
+        Returns:
+            dict: A map of user id to a row with the `id`, `name` and `social_media` of the user.
+        """
+        ids = set()
+        for group in groups:
+            for friend in group.friends:
+                ids.add(friend.user_id)
+                if friend.friend_id:
+                    ids.add(friend.friend_id)
+        if not ids:
+            return {}
+        rows = db.session.query(User.id, User.name, User.social_media).filter(User.id.in_(ids)).all()
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def serialize_many(groups, su=False) -> List[GroupPayload]:
+        """
+        Serializes a list of groups using one batched user lookup for all of them.
+
+        Parameters:
+            groups (List[Group]): The groups to serialize.
+            su (bool): If True, uses the superuser view (`su_serialize`).
+
+        Returns:
+            list: A list with the serialized groups.
+        """
+        users = Group.load_users(groups)
+        if su:
+            return [group.su_serialize(users) for group in groups]
+        return [group.serialize(users) for group in groups]
+
+    def serialize_friends(self, users=None, su=False) -> List[FriendPayload]:
+        """
+        Serializes the friends of the group, resolving their users from `users`.
+
+        Parameters:
+            users (dict): A map of user id to user, as returned by `Group.load_users`.
+                If None, it is loaded with a single query.
+            su (bool): If True, uses the superuser view of the friends.
+
+        Returns:
+            list: A list with the serialized friends.
+        """
+        if users is None:
+            users = Group.load_users([self])
+        if su:
+            return [friend.su_serialize(users) for friend in self.friends]
+        return [friend.serialize(users) for friend in self.friends]
+
+    def serialize(self, users=None) -> GroupPayload:
 
         return {
             'id': self.id,
             'description': self.description,
             'creator': self.creator,
-            'event_date': self.event_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'min_gift_price': self.min_gift_price.__str__(),
-            'max_gift_price': self.max_gift_price.__str__(), 
-            'friends': [friend.serialize() for friend in self.friends]
+            'event_date': self.event_date,
+            'min_gift_price': self.min_gift_price,
+            'max_gift_price': self.max_gift_price,
+            'friends': self.serialize_friends(users)
         }
-    def su_serialize(self):
+    def su_serialize(self, users=None) -> GroupPayload:
         return {
             'id': self.id,
             'description': self.description,
             'creator': self.creator,
-            'event_date': self.event_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'min_gift_price': self.min_gift_price.__str__(),
-            'max_gift_price': self.max_gift_price.__str__(), 
-            'friends': [friend.su_serialize() for friend in self.friends]
+            'event_date': self.event_date,
+            'min_gift_price': self.min_gift_price,
+            'max_gift_price': self.max_gift_price,
+            'friends': self.serialize_friends(users, su=True)
         }
 
     def __repr__(self):
@@ -153,20 +589,59 @@ class Group(BaseModel):
 
 class Friend(BaseModel):
     __tablename__ = 'friend'
-    user_id = db.Column(db.String(32), db.ForeignKey('user.id'), primary_key=True)
-    group_id = db.Column(db.String(32), db.ForeignKey('group.id'), primary_key=True)
-    friend_id = db.Column(db.String(32), db.ForeignKey('user.id'), nullable=True, default=None)
+    user_id = db.Column(HexUUID, db.ForeignKey('user.id'), primary_key=True)
+    group_id = db.Column(HexUUID, db.ForeignKey('group.id'), primary_key=True)
+    friend_id = db.Column(HexUUID, db.ForeignKey('user.id'), nullable=True, default=None, index=True)
     gift_desired = db.Column(db.String(80))
     is_admin = db.Column(db.Boolean, default=False) 
 
+    # Lookups by user_id alone use the leftmost column of the primary key.
+    __table_args__ = (
+        db.Index('ix_friend_group_id_user_id', 'group_id', 'user_id'),
+    )
+
     def __init__(self, user_id, group_id, gift_desired):
         self.user_id = user_id
         self.group_id = group_id
         self.gift_desired = gift_desired
 
-    def su_serialize(self):
-        user_name = db.session.query(User).filter_by(id=self.user_id).first().name
-        friend = db.session.query(User).filter_by(id=self.friend_id).first()
+    def load_users(self) -> dict:
+        """
+        Loads the user and the assignee of this friend with a single query.
+
+        Returns:
+            dict: A map of user id to a row with the `id`, `name` and `social_media` of the user.
+        """
+        ids = [self.user_id, self.friend_id] if self.friend_id else [self.user_id]
+        rows = db.session.query(User.id, User.name, User.social_media).filter(User.id.in_(ids)).all()
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def find_assignment(user_id, group_id):
+        """
+        Looks up, in a single query, the friend a user must give a gift to in a group.
+
+        The friend is joined to its assignee in the same group, for the gift, and to the
+        assignee's user, for the name.
+
+        Returns:
+            Row|None: A row with the `friend_id`, `friend_name` and `friend_gift` of the assignee,
+                all None if the group was not drawn yet, or None if the user is not in the group.
+        """
+        assignee = aliased(Friend)
+        return (db.session.query(Friend.friend_id,
+                                 User.name.label('friend_name'),
+                                 assignee.gift_desired.label('friend_gift'))
+                .outerjoin(assignee, (assignee.group_id == Friend.group_id) & (assignee.user_id == Friend.friend_id))
+                .outerjoin(User, User.id == Friend.friend_id)
+                .filter(Friend.user_id == user_id, Friend.group_id == group_id)
+                .first())
+
+    def su_serialize(self, users=None) -> FriendPayload:
+        if users is None:
+            users = self.load_users()
+        user_name = users[self.user_id].name
+        friend = users.get(self.friend_id)
 
         return {
             'user_id': self.user_id,
@@ -179,9 +654,11 @@ class Friend(BaseModel):
             'is_admin': self.is_admin
         }
     
-    def serialize(self):
-        user_name = db.session.query(User).filter_by(id=self.user_id).first().name
-        friend = db.session.query(User).filter_by(id=self.friend_id).first()
+    def serialize(self, users=None) -> FriendPayload:
+        if users is None:
+            users = self.load_users()
+        user_name = users[self.user_id].name
+        friend = users.get(self.friend_id)
 
         return {
             'user_id': self.user_id,
@@ -199,3 +676,201 @@ class Friend(BaseModel):
         return f'<Friend user_id={self.user_id}>'
 
     
+
+
+class EmailOutbox(BaseModel):
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    # Cleared once the email is SENT or FAILED, so delivered login codes are not kept at rest.
+    token = db.Column(db.Text, nullable=True)
+    dedupe_key = db.Column(db.String(64), unique=True, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='PENDING')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __init__(self, kind, email, token):
+        now = datetime.datetime.now()
+        self.kind = kind
+        self.email = email
+        self.token = token
+        self.dedupe_key = EmailOutbox.dedupe_key_for(kind, token)
+        self.status = 'PENDING'
+        self.attempts = 0
+        self.next_attempt_at = now
+        self.created_at = now
+
+    @staticmethod
+    def dedupe_key_for(kind, token) -> str:
+        return hashlib.sha256(f'{kind}:{token}'.encode()).hexdigest()
+
+    @staticmethod
+    def enqueue(kind, email, token) -> bool:
+        """
+        Stores an email to be delivered by the outbox dispatcher (`app.mailer`) and commits it.
+
+        The same token is only enqueued once, so retried requests do not send duplicated emails.
+
+        Parameters:
+            kind (str): The kind of email, 'confirmation' or 'recovery'.
+            email (str): The recipient's email address.
+            token (str): The token sent in the email.
+
+        Returns:
+            bool: True if the email was enqueued, False if it was already in the outbox.
+        """
+        if EmailOutbox.query.filter_by(dedupe_key=EmailOutbox.dedupe_key_for(kind, token)).first():
+            return False
+        db.session.add(EmailOutbox(kind, email, token))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return True
+
+    def __repr__(self):
+        return f'<EmailOutbox id={self.id} kind={self.kind} status={self.status}>'
+
+
+class DrawJob(BaseModel):
+    """
+    A draw queued to run in the background (`app.jobs`), and its status:
+    QUEUED, RUNNING, DONE or FAILED.
+    """
+    __tablename__ = 'draw_job'
+    id = db.Column(HexUUID, primary_key=True, default=uuid7_hex)
+    group_id = db.Column(HexUUID, db.ForeignKey('group.id'), nullable=False, index=True)
+    # The group id while the job is QUEUED or RUNNING, NULL afterwards. Its unique index
+    # lets a single draw of each group be active, across every worker process.
+    active_group_id = db.Column(HexUUID, unique=True, nullable=True)
+    requested_by = db.Column(HexUUID, db.ForeignKey('user.id'), nullable=False)
+    drawn = db.Column(db.String(10), nullable=False)
+    rules = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='QUEUED')
+    message = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __init__(self, group_id, requested_by, drawn, exclude=(), avoid=()):
+        self.group_id = group_id
+        self.active_group_id = group_id
+        self.requested_by = requested_by
+        self.drawn = drawn
+        self.rules = json.dumps([list(exclude), list(avoid)])
+        self.status = 'QUEUED'
+        self.created_at = datetime.datetime.now()
+
+    @staticmethod
+    def active(group_id):
+        """
+        Returns the QUEUED or RUNNING job of a group, or None.
+        """
+        return DrawJob.query.filter_by(active_group_id=group_id).first()
+
+    @staticmethod
+    def enqueue(group_id, requested_by, drawn, exclude=(), avoid=(), timeout=600):
+        """
+        Stores a draw to be run by `app.jobs` and commits it, unless another draw of the group is active.
+
+        An active job is considered lost, such as when the process running it died, and is
+        marked FAILED first, once it has been RUNNING for more than `timeout` seconds, or QUEUED
+        for that long without starting. A job that waited in the queue and then started is
+        timed from its `started_at`.
+
+        Parameters:
+            group_id (str): The id of the group.
+            requested_by (str): The id of the admin that asked for the draw.
+            drawn (str): 'PERFECT' or 'IMPERFECT'.
+            exclude, avoid (Iterable[Tuple[str, str]]): The rules of the draw, see `Group.perfect_drawn`.
+            timeout (float): The seconds after which an active job is considered lost.
+
+        Returns:
+            DrawJob|None: The new job, or None if another draw of the group is active.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+        db.session.execute(
+            update(DrawJob)
+            .where(DrawJob.active_group_id == group_id, or_(
+                and_(DrawJob.status == 'QUEUED', DrawJob.created_at < cutoff),
+                and_(DrawJob.status == 'RUNNING', DrawJob.started_at < cutoff),
+            ))
+            .values(status='FAILED', message='Timed out', active_group_id=None,
+                    finished_at=datetime.datetime.now())
+        )
+        job = DrawJob(group_id, requested_by, drawn, exclude, avoid)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return job
+
+    def _transition(self, condition, **values) -> bool:
+        """
+        Updates the job only if it still holds its group and matches `condition`, so a job
+        timed out by `enqueue` meanwhile is never overwritten. The caller commits.
+        """
+        result = db.session.execute(
+            update(DrawJob)
+            .where(DrawJob.id == self.id, DrawJob.active_group_id == self.group_id, condition)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            return False
+        for key, value in values.items():
+            set_committed_value(self, key, value)
+        return True
+
+    def start(self) -> bool:
+        """
+        Marks a QUEUED job as RUNNING. The caller commits.
+
+        Returns:
+            bool: False if the job is no longer QUEUED or was timed out.
+        """
+        return self._transition(DrawJob.status == 'QUEUED', status='RUNNING', started_at=datetime.datetime.now())
+
+    def finish(self, status, message=None) -> bool:
+        """
+        Marks the job as finished, releasing its group. The caller commits.
+
+        Returns:
+            bool: False if the job had already released its group, such as when it timed out.
+        """
+        return self._transition(DrawJob.status.in_(('QUEUED', 'RUNNING')), status=status,
+                                message=message[:255] if message else None, active_group_id=None,
+                                finished_at=datetime.datetime.now())
+
+    def serialize(self) -> DrawJobPayload:
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'drawn': self.drawn,
+            'status': self.status,
+            'message': self.message,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def __repr__(self):
+        return f'<DrawJob id={self.id} group_id={self.group_id} status={self.status}>'
+
+
+ASSIGNMENT_UPDATE = (
+    update(Friend.__table__)
+    .where(Friend.group_id == bindparam('b_group_id'), Friend.user_id == bindparam('b_user_id'))
+    .values(friend_id=bindparam('b_friend_id'))
+)
@@ -0,0 +1,75 @@
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from os import getenv
+import threading
+
+
+load_dotenv()
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords with a configurable werkzeug method and cost.
+
+    Parameters:
+        method (str|None): A werkzeug hash method, such as 'pbkdf2:sha256:600000' or
+            'scrypt:32768:8:1'. None uses werkzeug's default.
+        workers (int): If greater than 0, verifications run in a pool of this many processes,
+            so the hashing does not hold the GIL of the request workers. At most `2 * workers`
+            verifications wait in the pool, the following ones block until a slot frees up.
+        timeout (float): The maximum number of seconds to wait for a verification in the pool.
+    """
+
+    def __init__(self, method: str | None = None, workers: int = 0, timeout: float = 30):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._tag = None
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(max(1, 2 * workers))
+        self._lock = threading.Lock()
+
+    @property
+    def tag(self) -> str:
+        """
+        The `method:params` prefix of the hashes produced with the configured method and cost.
+        """
+        if self._tag is None:
+            self._tag = self.hash('').split('$', 1)[0]
+        return self._tag
+
+    def hash(self, password: str) -> str:
+        if self.method is None:
+            return generate_password_hash(password)
+        return generate_password_hash(password, method=self.method)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Checks if a hash was made with a different method or cost than the configured one.
+        """
+        return password_hash.split('$', 1)[0] != self.tag
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """
+        Checks a password against its hash, in the process pool if one is configured.
+        """
+        if self.workers <= 0:
+            return check_password_hash(password_hash, password)
+        with self._slots:
+            return self._get_pool().submit(check_password_hash, password_hash, password).result(self.timeout)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+
+password_hasher = PasswordHasher(getenv('PASSWORD_HASH_METHOD') or None, int(getenv('PASSWORD_HASH_WORKERS', 0)))
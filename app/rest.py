@@ -1,15 +1,25 @@
 
 from flask_restful import request, Resource
+from flask import Response, g, stream_with_context
 from dotenv import load_dotenv
 from os import getenv
-from app.models import User, Group, Friend
+from app.models import User, Group, GroupConflict, Friend, EmailOutbox, DrawJob
+from app.passwords import password_hasher
+from app.draw import DrawInfeasible, DrawNotFound
+from app.jobs import draw_jobs
+from app.cache import group_cache, token_cache
+from app.serializers import dumps
+from app.routing import primary_pins
 import app.config as app_config
 import re
 from sqlalchemy.exc import  DataError
+from sqlalchemy import select
+from sqlalchemy.orm import raiseload, selectinload
 from functools import wraps
 import jwt
 import datetime
-from app.utils import send_confirmation_email, send_recovery_email
+import hashlib
+import hmac
 load_dotenv()
 
 
@@ -18,6 +28,13 @@ db, api = app_config.db, app_config.api
 API_KEY = getenv('API_KEY')
 SECRET_KEY = getenv('SECRET_KEY')
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_SIZE = 100000
+MAX_CREATE_GROUPS = 1000
+
 
 
 def required_api_key(f):
@@ -45,6 +62,11 @@ def required_access_token(f):
         if 'Authorization' not in request.headers:
             return {'message': 'Authorization header not found'}, 401
         token = request.headers['Authorization'].removeprefix('Bearer ')
+
+        cached = token_cache.get(token)
+        if cached:
+            db.session.info['user_id'] = cached[1].id
+            return f(*args, **kwargs, user=cached[1])
     
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
@@ -55,23 +77,177 @@ def required_access_token(f):
             return {'message': 'Token expired'}, 401
         
         user = User.query.filter_by(id=payload.get('id')).first()
+        if user:
+            user = user.snapshot()
+            token_cache.set(token, payload, user)
+            db.session.info['user_id'] = user.id
 
         return f(*args, **kwargs, user=user)
     
 
     return decorator
 
+def read_only(f):
+    """
+    Decorator that runs the queries of a resource on the read replica, if one is configured.
+
+    Must be applied below `required_access_token`. Users who committed a write in the last
+    DB_REPLICA_STICKY_SECONDS keep reading from the primary, so they see their own writes.
+    """
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        user = kwargs.get('user')
+        if user is not None and primary_pins.is_pinned(user.id):
+            return f(*args, **kwargs)
+        session = db.session()
+        session.info['read_only'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            session.info['read_only'] = False
+    return decorator
+
 def generate_logs(func):
+    """
+    Decorator that adds the request body, capped at LOG_BODY_MAX bytes, to the request log entry
+    written by `app.logs.configure_request_logging`. Do not use it on resources that receive passwords.
+    """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        import logging
-        logging.basicConfig(filemode='api.log', level=logging.DEBUG)
-        logger = logging.getLogger(__name__)
-        #logger.debug('Request Headers: %s', request.headers)
-        logger.debug('Request Body: %s', request.get_json())
+        g.log_body = True
         return func(*args, **kwargs)
     return wrapper
 
+def page_args(default_limit=DEFAULT_PAGE_SIZE):
+    """
+    Reads the keyset pagination arguments from the query string.
+
+    Parameters:
+        default_limit (int|None): The page size used when `limit` is not sent. None means no limit.
+
+    Returns:
+        Tuple: The `after` cursor (the last id of the previous page, or None) and the page size,
+            clamped to MAX_PAGE_SIZE.
+    """
+    after = request.args.get('after') or None
+    try:
+        limit = int(request.args['limit'])
+    except (KeyError, ValueError):
+        limit = default_limit
+    if limit is None:
+        return after, None
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+def keyset_page(query, column, after, limit):
+    """
+    Applies keyset (cursor) pagination on `column` to a query.
+
+    Parameters:
+        query (Query): The query to paginate.
+        column (Column): The unique, ordered column used as cursor, usually the primary key.
+        after (str|None): Only rows with `column` greater than this value are returned.
+        limit (int|None): The page size. None returns every remaining row.
+
+    Returns:
+        Tuple: The rows of the page and the cursor of the next page (None on the last page).
+    """
+    if after:
+        query = query.filter(column > after)
+    query = query.order_by(column)
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], column.key)
+    return rows, None
+
+def page_headers(next_cursor):
+    """
+    Builds the response headers announcing the cursor of the next page, if there is one.
+    """
+    return {'X-Next-Cursor': next_cursor} if next_cursor else {}
+
+def wants_ndjson():
+    """
+    Checks if the client asked for a streamed NDJSON response, with `?format=ndjson`
+    or with the `Accept: application/x-ndjson` header.
+    """
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def stream_ndjson(statement, serialize_batch):
+    """
+    Streams the result of a select statement as NDJSON, one serialized row per line.
+
+    The rows are read from a server-side cursor in batches of STREAM_BATCH_SIZE (`yield_per`),
+    and each batch is serialized and released before the next one is fetched, so memory
+    stays flat no matter how large the table is.
+
+    Parameters:
+        statement (Select): The ORM select statement to stream.
+        serialize_batch (Callable): Receives a list of rows and returns the list of serialized rows.
+
+    Returns:
+        Response: A streamed response with the `application/x-ndjson` mimetype.
+    """
+    read_only = db.session.info.get('read_only', False)
+    def generate():
+        session = db.session()
+        session.info['read_only'] = read_only
+        result = session.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        try:
+            for batch in result.scalars().partitions():
+                for item in serialize_batch(batch):
+                    yield dumps(item) + b'\n'
+        finally:
+            result.close()
+            session.info['read_only'] = False
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def build_group_payloads(view):
+    """
+    Returns a builder for `group_cache.get_many` that loads the missing groups with their
+    friends and users in a fixed number of queries and serializes them with `view`.
+    """
+    def build(group_ids):
+        groups = Group.query.filter(Group.id.in_(group_ids)).options(selectinload(Group.friends)).all()
+        serialized_groups = Group.serialize_many(groups, su=view == 'su_serialize')
+        return {group.id: serialized for group, serialized in zip(groups, serialized_groups)}
+    return build
+
+def build_group_payload(view):
+    """
+    Returns a builder for `group_cache.get` that loads one group and serializes it with `view`.
+    """
+    build_many = build_group_payloads(view)
+    def build(group_id):
+        return build_many([group_id]).get(group_id)
+    return build
+
+def etag_for(*parts) -> str:
+    """
+    Builds an ETag from `parts`, signed with SECRET_KEY so clients cannot forge the tag
+    of a resource they never received.
+    """
+    message = ':'.join(str(part) for part in parts).encode()
+    return hmac.new((SECRET_KEY or '').encode(), message, hashlib.sha256).hexdigest()[:32]
+
+def not_modified(etag):
+    """
+    Returns an empty 304 response if the `If-None-Match` header of the request matches `etag`,
+    or None if the resource must be sent.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers={'Cache-Control': 'private, no-cache'})
+        response.set_etag(etag)
+        return response
+    return None
+
+def etag_headers(etag):
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache'}
+
 #TODO An decorator with verify if the user logged is
 
 class Login(Resource):
@@ -93,11 +269,15 @@ class Login(Resource):
             - If email not is in the database, returns a dictionary with the message 'User does not exist' and a status code of 404.
             - If password is incorrect, returns a dictionary with the message 'Invalid password' and a status code of 401.
             - If the user's password is correct, return a dictionary with the acess token and a status code of 200.
+              If the password was hashed with another method or cost than the configured one, it is rehashed.
 
         '''
         user = User.query.filter_by(email=request.json.get('email')).first()
         if user:
             if user.check_password(request.json.get('password')):
+                if user.needs_rehash():
+                    user.password = request.json.get('password')
+                    db.session.commit()
                 
                 token = user.generate_access_token()
                 return {'access_token': token}, 200
@@ -118,7 +298,8 @@ class SignUp(Resource):
             If the request is invalid, returns a dictionary with a 'message' key and a 400 status code.
             If the user already exists, returns a dictionary with a 'message' key and a 400 status code.
             If the email is invalid, returns a dictionary with a 'message' key and a 400 status code.
-            If the request is valid, returns a dictionary with a 'message' key, a 201 status code, and sends an email.
+            If the request is valid, returns a dictionary with a 'message' key, a 201 status code, and enqueues the confirmation email.
+            The token only carries the hash of the password, never the password itself.
         """
       
         data = request.get_json()
@@ -141,12 +322,12 @@ class SignUp(Resource):
         payload = {
             'name': name,
             'email': email,
-            'password': password,
+            'password_hash': password_hasher.hash(password),
             'social_media': social_media,
             'exp': datetime.datetime.now() + datetime.timedelta(days=1)
         }
         token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
-        send_confirmation_email(email, token)
+        EmailOutbox.enqueue('confirmation', email, token)
         
         
         return {'message': 'Verification email sent', 'access_token': token}, 201
@@ -181,7 +362,9 @@ class ValidateEmail(Resource):
         
        
         try:
-            user = User(payload.get('name'), payload.get('email'), payload.get('password'))
+            # Tokens issued before the password was hashed at signup still carry it in plain text.
+            user = User(payload.get('name'), payload.get('email'), payload.get('social_media') or '',
+                        password=payload.get('password'), password_hash=payload.get('password_hash'))
             db.session.add(user)
             db.session.commit()
             access_token = user.generate_access_token()
@@ -199,7 +382,7 @@ class GenerateRecoveryCode(Resource):
     
     def get(self, email):
         """
-        Retrieves the recovery code for a user and sends it to their email address.
+        Retrieves the recovery code for a user and enqueues an email to send it to their email address.
 
         Parameters:
             email (str): The email address of the user.
@@ -216,7 +399,7 @@ class GenerateRecoveryCode(Resource):
         if not user:
             return {'message': 'User does not exist'}, 404
         recovery_token = user.generate_recovery_token()
-        send_recovery_email(email, recovery_token)
+        EmailOutbox.enqueue('recovery', email, recovery_token)
         return {'message': 'Recovery code sent'}, 200
     # TODO: Implement a captcha
 api.add_resource(GenerateRecoveryCode, '/generate_recovery_code/<string:email>')
@@ -254,14 +437,46 @@ api.add_resource(LoginWithRecoveryCode, '/login_with_recovery_code/<string:recov
 
 
 
+def group_fields(data, creator):
+    """
+    Reads and validates the fields of a new group, as sent to CreateGroup and CreateGroups.
+
+    Returns:
+        Tuple: The keyword arguments of `Group.create` and None, or None and the error response.
+    """
+    description = data.get('description')
+    try:
+        event_date = datetime.datetime.strptime(data.get('event_date'), '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None, ({'message': 'Invalid input'}, 400)
+    min_gift_price = data.get('min_gift_price')
+    max_gift_price = data.get('max_gift_price')
+    try:
+        if min_gift_price > max_gift_price:
+            return None, ({'message': 'min_gift_price must be less than max_gift_price'}, 412)
+    except TypeError:
+        return None, ({'message': 'Invalid input'}, 400)
+    if not description or not event_date or not min_gift_price or not max_gift_price:
+        return None, ({'message': 'Invalid input'}, 400)
+    return {
+        'description': description,
+        'creator': creator,
+        'event_date': event_date,
+        'min_gift_price': min_gift_price,
+        'max_gift_price': max_gift_price,
+        'creator_desired_gift': data.get('creator_desired_gift'),
+    }, None
+
 class CreateGroup(Resource):
     
     
     
+    @generate_logs
     @required_access_token
     def post(self, user: User):
         """
-        Creates a new group and adds the current user as the creator and a member of the group.
+        Creates a new group and adds the current user as the creator and an admin member of the group,
+        in a single transaction.
 
         Args:
             user (User): The user object representing the current user.
@@ -279,44 +494,86 @@ class CreateGroup(Resource):
             int: The HTTP status code 201 indicating a successful creation.
         """
 
-        data = request.get_json()
-        description = data.get('description')
-        creator = user.id
-        event_date = datetime.datetime.strptime(data.get('event_date'), '%Y-%m-%d')
-        min_gift_price = data.get('min_gift_price')
-        max_gift_price = data.get('max_gift_price')
-        creator_desired_gift = data.get('creator_desired_gift')
-        if min_gift_price > max_gift_price:
-            return {'message': 'min_gift_price must be less than max_gift_price'}, 412
-        if not description or not event_date or not min_gift_price or not max_gift_price:
-            return {'message': 'Invalid input'}, 400
+        fields, error = group_fields(request.get_json(), user.id)
+        if error:
+            return error
         
-        group: Group = Group(description, creator, event_date, min_gift_price, max_gift_price)
-
-        db.session.add(group)
-        db.session.commit()
-        db.session.add(Friend(user.id, group.id, creator_desired_gift))
-        db.session.commit()
+        Group.create(**fields)
         return {'message': 'Group created'}, 201
     
        
 
 api.add_resource(CreateGroup, '/create_group')
+
+class CreateGroups(Resource):
+
+
+    @generate_logs
+    @required_access_token
+    def post(self, user: User):
+        """
+        Creates several groups at once, each one with the current user as the creator and an admin member,
+        in a single transaction.
+
+        Args:
+            user (User): The user object representing the current user.
+        Example Payload:
+            {
+                "groups": [
+                    {"description": "Family", "event_date": "2020-12-24", "min_gift_price": 10, "max_gift_price": 100},
+                    {"description": "Office", "event_date": "2020-12-20", "min_gift_price": 20, "max_gift_price": 50}
+                ]
+            }
+
+        Returns:
+            dict: The `ids` of the new groups, in the order they were sent.
+            int: The HTTP status code 201 indicating a successful creation.
+            dict: The error of the first invalid group, with its `index`, and nothing is created.
+            int: The HTTP status code 400 or 412 if a group is invalid.
+        """
+
+        groups = (request.get_json(silent=True) or {}).get('groups')
+        if not isinstance(groups, list) or len(groups) > MAX_CREATE_GROUPS:
+            return {'message': 'Invalid input'}, 400
+        all_fields = []
+        for index, data in enumerate(groups):
+            fields, error = group_fields(data, user.id) if isinstance(data, dict) else (None, ({'message': 'Invalid input'}, 400))
+            if error:
+                message, code = error
+                return {**message, 'index': index}, code
+            all_fields.append(fields)
+        return {'ids': Group.create_many(all_fields)}, 201
+
+api.add_resource(CreateGroups, '/create_groups')
 class SuGetUsers(Resource):
     
 
     @required_access_token
+    @read_only
     def get(self, user: User):
         """
-        A function that retrieves a list of users, this route requires the current user to be a superuser.
+        A function that retrieves a page of users, this route requires the current user to be a superuser.
+
+        Query Parameters:
+            after (str): The id of the last user of the previous page.
+            limit (int): The page size, DEFAULT_PAGE_SIZE by default and at most MAX_PAGE_SIZE.
+            format (str): If 'ndjson', every user after `after` is streamed, one per line.
 
         Returns:
-            - If the current user is a superuser, a serialized list of all users.
+            - If the current user is a superuser, a serialized list with a page of users, ordered by id.
+              The `X-Next-Cursor` header holds the `after` value of the next page, if there is one.
             - If the current user is not a superuser, a dictionary with a message indicating unauthorized access and a status code of 401.
         """
         if user.is_superuser:
-            serialized_users = [user.serialize() for user in User.query.all()]
-            return  serialized_users, 200
+            after, limit = page_args()
+            if wants_ndjson():
+                statement = select(User).order_by(User.id)
+                if after:
+                    statement = statement.where(User.id > after)
+                return stream_ndjson(statement, lambda users: [user.serialize() for user in users])
+            users, next_cursor = keyset_page(User.query, User.id, after, limit)
+            serialized_users = [user.serialize() for user in users]
+            return  serialized_users, 200, page_headers(next_cursor)
         return {'message': 'Unauthorized'}, 401
 api.add_resource(SuGetUsers, '/sugetusers')
 
@@ -325,18 +582,32 @@ class SuGetGroups(Resource):
     
     
     @required_access_token
+    @read_only
     def get(self, user: User):
         """
-        A function that retrieves a list of groups, this route requires the current user to be a superuser.
+        A function that retrieves a page of groups, this route requires the current user to be a superuser.
+
+        Query Parameters:
+            after (str): The id of the last group of the previous page.
+            limit (int): The page size, DEFAULT_PAGE_SIZE by default and at most MAX_PAGE_SIZE.
+            format (str): If 'ndjson', every group after `after` is streamed, one per line.
 
         Returns:
-            - If the current user is a superuser, a serialized list of all groups.
+            - If the current user is a superuser, a serialized list with a page of groups, ordered by id.
+              The `X-Next-Cursor` header holds the `after` value of the next page, if there is one.
             - If the current user is not a superuser, a dictionary with a message indicating unauthorized access and a status code of 401.
         """
      
         if user.is_superuser:
-            serialized_groups = [group.serialize() for group in Group.query.all()]
-            return serialized_groups, 200
+            after, limit = page_args()
+            if wants_ndjson():
+                statement = select(Group).options(selectinload(Group.friends)).order_by(Group.id)
+                if after:
+                    statement = statement.where(Group.id > after)
+                return stream_ndjson(statement, Group.serialize_many)
+            groups, next_cursor = keyset_page(Group.query.options(selectinload(Group.friends)), Group.id, after, limit)
+            serialized_groups = Group.serialize_many(groups)
+            return serialized_groups, 200, page_headers(next_cursor)
         return {'message': 'Unauthorized'}, 401
 api.add_resource(SuGetGroups, '/sugetgroups')
 
@@ -359,7 +630,12 @@ class SuGetGroup(Resource):
         
         if user.is_superuser:
             
-            serialized_group = Group.query.filter_by(id=group_id).first().su_serialize()
+            version = Group.current_version(group_id)
+            serialized_group = None
+            if version is not None:
+                serialized_group = group_cache.get(group_id, version, 'su_serialize', build_group_payload('su_serialize'))
+            if serialized_group is None:
+                return {'message': 'Group not found'}, 404
             return serialized_group
         return {'message': 'Unauthorized'}, 401
 
@@ -381,8 +657,10 @@ class GetGroup(Resource):
             tuple: A tuple containing the serialized group object and the HTTP status code 200.
         """
 
-        group = Group.query.filter_by(id=group_id).first()
-        serialized_group = group.serialize()
+        version = Group.current_version(group_id)
+        serialized_group = None
+        if version is not None:
+            serialized_group = group_cache.get(group_id, version, 'serialize', build_group_payload('serialize'))
         
         return {'serialized_group': serialized_group}, 200
 
@@ -391,6 +669,7 @@ class GetGroupCreatedBy(Resource):
     
     
     @required_access_token
+    @read_only
     
     def get(self, user):
         """
@@ -400,8 +679,9 @@ class GetGroupCreatedBy(Resource):
             list: A list of serialized group objects representing the groups created by the current user. If no groups are found, an empty list is returned.
         """
 
-        groups = Group.query.filter_by(creator=user.id).all()
-        serialized_groups = [group.serialize() for group in groups]
+        versions = dict(db.session.query(Group.id, Group.version).filter_by(creator=user.id).order_by(Group.id).all())
+        payloads = group_cache.get_many(versions, 'serialize', build_group_payloads('serialize'))
+        serialized_groups = [payloads[group_id] for group_id in versions if group_id in payloads]
         return serialized_groups if serialized_groups else []
 api.add_resource(GetGroupCreatedBy, '/getgroupcreatedby')
 
@@ -409,6 +689,7 @@ class GetFriendsGroup(Resource):
     
     
     @required_access_token
+    @read_only
     
     def get(self, user, group_id):
         """
@@ -418,39 +699,162 @@ class GetFriendsGroup(Resource):
             group_id (int): The ID of the group.
 
         Returns:
-            list: A list of serialized friend objects.
+            list: A list of serialized friend objects, with an `ETag` header.
+                If the `If-None-Match` header matches it, an empty 304 response is returned instead.
 
         Raises:
             dict: A dictionary with an 'message' key and a status code of 401 if the user is not authorized.
         """
         
-        group = Group.query.filter_by(id=group_id).first()
-        friend_user = [friend for friend in group.friends if friend.user_id == user.id]
-        if friend_user:
-            friends = [friend.serialize() for friend in group.friends]
-            return friends
+        version = Group.current_version(group_id)
+        if version is None:
+            return {'message': 'Unauthorized'}, 401
+        etag = etag_for('friends', group_id, version, user.id)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        serialized_group = group_cache.get(group_id, version, 'serialize', build_group_payload('serialize'))
+        if serialized_group and any(friend['user_id'] == user.id for friend in serialized_group['friends']):
+            return serialized_group['friends'], 200, etag_headers(etag)
         return {'message': 'Unauthorized'}, 401
 api.add_resource(GetFriendsGroup, '/getfriendsgroup/<string:group_id>')
 
+def user_pairs(value):
+    """
+    Reads a list of [user_id, user_id] pairs from a request body.
+
+    Returns:
+        List[Tuple[str, str]]|None: The pairs, with lowercased ids, or None if `value` is not a list of pairs of strings.
+    """
+    if not isinstance(value, list):
+        return None
+    pairs = []
+    for pair in value:
+        if not isinstance(pair, list) or len(pair) != 2 or not all(isinstance(user_id, str) for user_id in pair):
+            return None
+        pairs.append((pair[0].lower(), pair[1].lower()))
+    return pairs
+
+def draw_rules(data, user):
+    """
+    Reads the optional rules of a draw from its request body.
+
+    Example Payload:
+        {
+            "group_id": "...",
+            "exclude": [["<user_id>", "<user_id>"]],
+            "avoid": [["<giver_id>", "<receiver_id>"]],
+            "avoid_group_id": "<id of a previous group>"
+        }
+
+    `exclude` holds pairs of users that must not draw each other, such as couples. `avoid` holds
+    (giver, receiver) pairs that are avoided when possible, and `avoid_group_id` adds the pairs
+    of the last draw of another group the current user is a member of, such as last year's.
+
+    Returns:
+        Tuple: The excluded and the avoided pairs, and None, or None and an error response
+            (400 if the rules are malformed, 401 if the user is not a member of `avoid_group_id`).
+    """
+    exclude = user_pairs(data.get('exclude', []))
+    avoid = user_pairs(data.get('avoid', []))
+    if exclude is None or avoid is None:
+        return None, ({'message': 'Invalid input'}, 400)
+    avoid_group_id = data.get('avoid_group_id')
+    if avoid_group_id:
+        if not Friend.query.filter_by(user_id=user.id, group_id=avoid_group_id).first():
+            return None, ({'message': 'Unauthorized'}, 401)
+        avoid += Group.drawn_pairs(avoid_group_id)
+    return (exclude, avoid), None
+
+def query_flag(name):
+    """
+    Checks if a boolean flag was set in the query string, as `?<name>=1` or `?<name>=true`.
+    """
+    return request.args.get(name, '').lower() in ('1', 'true')
+
+def wants_async():
+    """
+    Checks if the client asked for the draw to run in the background, with `?async=1`.
+    """
+    return query_flag('async')
+
+def draw_in_progress(group_id):
+    """
+    Returns a 409 response if a background draw of the group is active, or None.
+    """
+    job = DrawJob.active(group_id)
+    if job:
+        return {'message': 'A draw of this group is in progress', 'job_id': job.id}, 409
+    return None
+
+def enqueue_draw(group, user, drawn, rules):
+    """
+    Queues a background draw of a group.
+
+    Returns:
+        Tuple: The id of the job, with the status code 202 and its `Location`,
+            or a 409 response if another draw of the group is active.
+    """
+    job = DrawJob.enqueue(group.id, user.id, drawn, *rules, timeout=draw_jobs.timeout)
+    if job is None:
+        return draw_in_progress(group.id) or ({'message': 'A draw of this group is in progress'}, 409)
+    draw_jobs.submit(job.id)
+    return {'job_id': job.id, 'status': job.status}, 202, {'Location': f'/drawjob/{job.id}'}
+
 class PerfectDrawnGroup(Resource):
     
     
+    @generate_logs
     @required_access_token
 
     
     
     def put(self, user):
         
-        group:Group = Group.query.filter_by(id=request.json.get('group_id')).first()
-        try:
+        """
+        Draws a single cycle through every friend of a group, this route requires the current user to be an admin of the group.
 
-            friend_user = [friend for friend in group.friends if friend.user_id == user.id]
-        except AttributeError:
+        Args:
+            user (User): The user object representing the authenticated user.
+        Example Payload:
+            {
+                "group_id": "...",
+                "exclude": [["<user_id>", "<user_id>"]]
+            }
+            See `draw_rules` for the optional rules of the draw.
+        Query Parameters:
+            async (str): If '1', the draw runs in the background and the response is 202
+                with the `job_id` to poll at `/drawjob/<job_id>`.
+
+        Returns:
+            dict: A dictionary containing the response message and status code,
+                422 if the rules leave no valid draw, 503 if no draw was found although one may exist
+                (try again), 409 if a background draw of the group is in progress
+                or if the group was changed by another request meanwhile.
+        """
+        group:Group = Group.query.filter_by(id=request.json.get('group_id')).options(raiseload(Group.friends)).first()
+        if group is None:
             return {'message': 'An error occurred'}, 500
+        friend_user = Friend.query.filter_by(user_id=user.id, group_id=group.id).first()
         
         if friend_user:
-            if friend_user[0].is_admin:
-                group.perfect_drawn()
+            if friend_user.is_admin:
+                rules, error = draw_rules(request.json, user)
+                if error:
+                    return error
+                if wants_async():
+                    return enqueue_draw(group, user, 'PERFECT', rules)
+                in_progress = draw_in_progress(group.id)
+                if in_progress:
+                    return in_progress
+                try:
+                    group.perfect_drawn(*rules)
+                except DrawInfeasible as e:
+                    return {'message': str(e)}, 422
+                except DrawNotFound as e:
+                    return {'message': str(e)}, 503
+                except GroupConflict as e:
+                    return {'message': str(e)}, 409
                 return {'message': 'Perfect Drawn completed'}, 200
         return {'message': 'Unauthorized'}, 401
 api.add_resource(PerfectDrawnGroup, '/perfectdrawngroup')
@@ -467,24 +871,28 @@ class KickOutGroup(Resource):
             user (User): The user object representing the authenticated user (sent in the request header as authorization).
             group (Group): The group object representing the group to be kicked out.
             friend (Friend): The friend object representing the friend to be kicked out.
+        With `?repair=1`, a drawn group keeps its draw: only the assignments around the kicked
+        friend change (see `Group.draw_repair`), unless it cannot be repaired.
+
         Returns:
-            dict: A dictionary containing the response message and status code.
+            dict: A dictionary containing the response message and status code,
+                409 if the group was changed by another request meanwhile, such as a draw.
         """
 
-        group:Group = Group.query.filter_by(id=group_id).first()
+        group:Group = Group.query.filter_by(id=group_id).options(raiseload(Group.friends)).first()
         kicker_friend = Friend.query.filter_by(user_id=user.id, group_id=group_id).first()
         kicked_friend = Friend.query.filter_by(user_id=kicked_user_id, group_id=group_id).first()
         if kicker_friend and kicker_friend.is_admin and kicked_friend:
-            if group.drawn == "PERFECT" or group.drawn == "IMPERFECT":
-                for friend in group.friends:
-                    friend.friend_id = None
-                group.kick_out(kicked_user_id)
-                group.drawn = "NO"
-                db.session.commit()
-                return {'message': 'User Kicked, Another Draw Must Be Made'}, 200
-            else:
-                group.kick_out(kicked_user_id)
-                return {'message': 'User Kicked'}, 200
+            try:
+                if group.drawn == "PERFECT" or group.drawn == "IMPERFECT":
+                    if group.kick_out(kicked_user_id, reset_draw=True, repair_draw=query_flag('repair')):
+                        return {'message': 'User Kicked, Draw Repaired'}, 200
+                    return {'message': 'User Kicked, Another Draw Must Be Made'}, 200
+                else:
+                    group.kick_out(kicked_user_id)
+                    return {'message': 'User Kicked'}, 200
+            except GroupConflict as e:
+                return {'message': str(e)}, 409
         return {'message': 'Unauthorized'}, 401
     
 
@@ -493,10 +901,95 @@ class KickOutGroup(Resource):
 api.add_resource(KickOutGroup, '/kickoutgroup/<string:group_id>/<string:kicked_user_id>')
 
 
+def valid_friend_entries(entries):
+    if not isinstance(entries, list) or len(entries) > MAX_IMPORT_SIZE:
+        return False
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('user_id') or entry.get('email'), str):
+            return False
+        gift_desired = entry.get('gift_desired')
+        if gift_desired is not None and (not isinstance(gift_desired, str) or len(gift_desired) > 80):
+            return False
+    return True
+
+def merge_progress(totals, progress):
+    totals['processed'] = progress['processed']
+    for key in ('added', 'duplicates', 'not_found'):
+        totals[key].extend(progress[key])
+    return totals
+
+class AddFriendsGroup(Resource):
+
+
+    @generate_logs
+    @required_access_token
+    def post(self, user, group_id):
+        """
+        Adds several users to a group at once, this route requires the current user to be an admin of the group.
+
+        The users are resolved and inserted in batches, and saved in a single transaction.
+        If the group was drawn, its draw is cleared and another one must be made.
+
+        args:
+            user (User): The user object representing the authenticated user.
+            group_id (str): The ID of the group.
+        Example Payload:
+            {
+                "friends": [
+                    {"email": "email2@example.com", "gift_desired": "A book"},
+                    {"user_id": "0190c6b1f2a97c3e8d4b5a6f7e8d9c0b"}
+                ]
+            }
+        query parameters:
+            format (str): If 'ndjson', the progress is streamed after every IMPORT_CHUNK_SIZE users, one object per line
+                with the counts so far, and the last line holds the result. Without it, nothing was saved.
+                If the group was changed by another request meanwhile, the last line holds its `message` instead.
+        returns:
+            dict: The user ids `added`, and the `duplicates` (already in the group or repeated) and `not_found` entries,
+                as they were sent.
+            int: The HTTP status code 200 if the request is successful.
+            dict: A dictionary containing an error message if the input is invalid or the request is unauthorized.
+            int: The HTTP status code 400 if the input is invalid, 401 if the request is unauthorized,
+                409 if the group was changed by another request meanwhile.
+        """
+        entries = (request.get_json(silent=True) or {}).get('friends')
+        if not valid_friend_entries(entries):
+            return {'message': 'Invalid input'}, 400
+        group = Group.query.filter_by(id=group_id).options(raiseload(Group.friends)).first()
+        admin = Friend.query.filter_by(user_id=user.id, group_id=group_id).first()
+        if group is None or admin is None or not admin.is_admin:
+            return {'message': 'Unauthorized'}, 401
+
+        progress = group.add_friends(entries, IMPORT_CHUNK_SIZE)
+        totals = {'processed': 0, 'added': [], 'duplicates': [], 'not_found': []}
+        if wants_ndjson():
+            def generate():
+                try:
+                    for chunk in progress:
+                        merge_progress(totals, chunk)
+                        yield dumps({key: value if key == 'processed' else len(value) for key, value in totals.items()}) + b'\n'
+                except GroupConflict as e:
+                    yield dumps({'message': str(e)}) + b'\n'
+                    return
+                finally:
+                    progress.close()
+                yield dumps(totals) + b'\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        try:
+            for chunk in progress:
+                merge_progress(totals, chunk)
+        except GroupConflict as e:
+            return {'message': str(e)}, 409
+        return totals, 200
+
+api.add_resource(AddFriendsGroup, '/addfriendsgroup/<string:group_id>')
+
+
 
 class ImperfectDrawnGroup(Resource):
     
     
+    @generate_logs
     @required_access_token
 
     
@@ -507,24 +1000,69 @@ class ImperfectDrawnGroup(Resource):
 
         Args:
             user (User): The user object representing the authenticated user.
+        Example Payload:
+            {
+                "group_id": "...",
+                "exclude": [["<user_id>", "<user_id>"]]
+            }
+            See `draw_rules` for the optional rules of the draw.
+        Query Parameters:
+            async (str): If '1', the draw runs in the background and the response is 202
+                with the `job_id` to poll at `/drawjob/<job_id>`.
 
         Returns:
-            dict: A dictionary containing the response message and status code.
+            dict: A dictionary containing the response message and status code,
+                422 if the rules leave no valid draw, 409 if a background draw of the group is in progress
+                or if the group was changed by another request meanwhile.
         """
         
         
        
-        group = Group.query.filter_by(id=request.get_json().get('group_id')).first()
-        try:
-            friend_user = [friend for friend in group.friends if friend.user_id == user.id]
-        except AttributeError:
+        group = Group.query.filter_by(id=request.get_json().get('group_id')).options(raiseload(Group.friends)).first()
+        if group is None:
             return {'message': 'An error occurred'}, 500
+        friend_user = Friend.query.filter_by(user_id=user.id, group_id=group.id).first()
         if friend_user:
-            if friend_user[0].is_admin:
-                group.imperfect_drawn()
+            if friend_user.is_admin:
+                rules, error = draw_rules(request.get_json(), user)
+                if error:
+                    return error
+                if wants_async():
+                    return enqueue_draw(group, user, 'IMPERFECT', rules)
+                in_progress = draw_in_progress(group.id)
+                if in_progress:
+                    return in_progress
+                try:
+                    group.imperfect_drawn(*rules)
+                except DrawInfeasible as e:
+                    return {'message': str(e)}, 422
+                except GroupConflict as e:
+                    return {'message': str(e)}, 409
                 return {'message': 'Imperfect Drawn completed'}, 200
         return {'message': 'Unauthorized'}, 401
 api.add_resource(ImperfectDrawnGroup, '/imperfectdrawngroup')
+
+class GetDrawJob(Resource):
+    @required_access_token
+    def get(self, job_id, user):
+        """
+        Reports the status of a background draw to the members of its group.
+
+        Args:
+            job_id (str): The id returned by a draw with `?async=1`.
+            user (User): The user object representing the authenticated user.
+
+        Returns:
+            dict: The job, with its `status` (QUEUED, RUNNING, DONE or FAILED) and, if it failed, its `message`.
+            int: 200, 404 if the job does not exist, or 401 if the user is not a member of its group.
+        """
+        job = db.session.get(DrawJob, job_id.lower())
+        if job is None:
+            return {'message': 'Job not found'}, 404
+        if not Friend.query.filter_by(user_id=user.id, group_id=job.group_id).first():
+            return {'message': 'Unauthorized'}, 401
+        return job.serialize(), 200
+api.add_resource(GetDrawJob, '/drawjob/<string:job_id>')
             
 
 class GetMyFriend(Resource):
@@ -532,27 +1070,35 @@ class GetMyFriend(Resource):
     
     
     @required_access_token
+    @read_only
     def get(self, user, group_id):
         """
-        Retrieves information about a friend in a group.
+        Retrieves information about a friend in a group, with a single query.
 
         Args:
             group_id (int): The ID of the group.
 
         Returns:
-            dict: A dictionary containing the friend's name, ID, and desired gift.
-            int: The HTTP status code 200 if the request is successful.
+            dict: A dictionary containing the friend's name, ID, and desired gift in this group, all None before the draw.
+            int: The HTTP status code 200 if the request is successful, with an `ETag` header.
+                If the `If-None-Match` header matches it, an empty 304 response is returned instead.
             dict: A dictionary containing an error message if the request is unauthorized.
             int: The HTTP status code 401 if the request is unauthorized.
         """
      
-        group = Group.query.filter_by(id=group_id).first()
-        friend_user = [friend for friend in group.friends if friend.user_id == user.id]
+        version = Group.current_version(group_id)
+        if version is None:
+            return {'message': 'Unauthorized'}, 401
+        etag = etag_for('myfriend', group_id, version, user.id)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        assignment = Friend.find_assignment(user.id, group_id)
         
-        if friend_user:
-            return{'friend_name': friend_user[0].serialize()['friend_name'], 
-                   'friend_id': friend_user[0].friend_id, 
-                   'friend_gift':Friend.query.filter_by(user_id=friend_user[0].friend_id).first().gift_desired}, 200
+        if assignment:
+            return{'friend_name': assignment.friend_name, 
+                   'friend_id': assignment.friend_id, 
+                   'friend_gift': assignment.friend_gift}, 200, etag_headers(etag)
         return {'message': 'Unauthorized'}, 401
 api.add_resource(GetMyFriend, '/getmyfriend/<string:group_id>')
 
@@ -566,38 +1112,72 @@ class GetCurrentUser(Resource):
             user (User): The user object representing the authenticated user.
         returns:
             dict: A dictionary containing the user's name, ID, and email.
-            int: The HTTP status code 200 if the request is successful.
+            int: The HTTP status code 200 if the request is successful, with an `ETag` header.
+                If the `If-None-Match` header matches it, an empty 304 response is returned instead.
             dict: A dictionary containing an error message if the request is unauthorized.
             int: The HTTP status code 401 if the request is unauthorized.
         """
 
-        return user.serialize(), 200
+        serialized_user = user.serialize()
+        etag = etag_for('user', *serialized_user.values())
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        return serialized_user, 200, etag_headers(etag)
 
 api.add_resource(GetCurrentUser, '/user')
 
 
 class GetJoinedGroups(Resource):
     @required_access_token
+    @read_only
     def get(self, user):
         """
         Retrieves all groups the current user is a member of.
 
+        The groups, their friends and the users of the friends are loaded with a fixed
+        number of queries, no matter how many groups the user joined.
+
         args:
             user (User): The user object representing the authenticated user.
+        query parameters:
+            after (str): The id of the last group of the previous page.
+            limit (int): The page size, at most MAX_PAGE_SIZE. If not sent, every group is returned.
         returns:
-            list: A list of serialized group objects representing the groups the current user is a member of.
+            list: A list of serialized group objects representing the groups the current user is a member of, ordered by id.
+                The `X-Next-Cursor` header holds the `after` value of the next page, if there is one.
             int: The HTTP status code 200 if the request is successful.
             dict: A dictionary containing an error message if the request is unauthorized.
             int: The HTTP status code 401 if the request is unauthorized.
         """
 
-        friends = Friend.query.filter_by(user_id=user.id).all()
-        if friends:
-            groups = []
-            for friend in friends:
-                groups.append(Group.query.get(friend.group_id))
-
-            return [group.serialize() for group in groups], 200
+        after, limit = page_args(default_limit=None)
+        query = (Group.query
+                 .join(Friend, Friend.group_id == Group.id)
+                 .filter(Friend.user_id == user.id)
+                 .options(selectinload(Group.friends)))
+        groups, next_cursor = keyset_page(query, Group.id, after, limit)
+        return Group.serialize_many(groups), 200, page_headers(next_cursor)
         
 api.add_resource(GetJoinedGroups, '/getjoinedgroups')
 
+
+class SuCacheStats(Resource):
+    @required_access_token
+    def get(self, user):
+        """
+        Retrieves the size and the hit and miss counters of the in-process caches, this route requires the current user to be a superuser.
+
+        args:
+            user (User): The user object representing the authenticated user.
+        returns:
+            dict: A dictionary with the statistics of each cache.
+            int: The HTTP status code 200 if the request is successful.
+            dict: A dictionary containing an error message if the request is unauthorized.
+            int: The HTTP status code 401 if the request is unauthorized.
+        """
+        if user.is_superuser:
+            return {'token_cache': token_cache.stats(), 'group_cache': group_cache.stats()}, 200
+        return {'message': 'Unauthorized'}, 401
+
+api.add_resource(SuCacheStats, '/sucachestats')
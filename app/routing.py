@@ -0,0 +1,91 @@
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from os import getenv
+import threading
+import time
+
+
+load_dotenv()
+
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(FlaskSession):
+    """
+    A session that sends the queries of read-only units of work to the 'replica' bind.
+
+    A unit of work is read-only while `session.info['read_only']` is set, see the `read_only`
+    decorator of `app.rest`. Flushes, and every query when no replica is configured, use the
+    primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing:
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class PrimaryPins:
+    """
+    Remembers the users who committed a write in the last `ttl` seconds, whose reads must stay
+    on the primary database until the replica has caught up with their writes.
+
+    Pins are kept per worker process, so `ttl` should cover the replication lag, and clients
+    are expected to reuse their connection to the worker that handled the write.
+    """
+
+    def __init__(self, ttl: float = 5):
+        self.ttl = ttl
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def pin(self, user_id: str):
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + self.ttl
+            if len(self._until) > 10000:
+                self._until = {key: until for key, until in self._until.items() if until > now}
+
+    def is_pinned(self, user_id: str) -> bool:
+        with self._lock:
+            until = self._until.get(user_id)
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._until[user_id]
+                return False
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+
+primary_pins = PrimaryPins(float(getenv('DB_REPLICA_STICKY_SECONDS', 5)))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_write(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_statement_write(orm_execute_state):
+    # INSERT, UPDATE and DELETE statements run with `session.execute`, which do not flush.
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _pin_writer(session):
+    if session.info.pop('wrote', False) and session.info.get('user_id'):
+        primary_pins.pin(session.info['user_id'])
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
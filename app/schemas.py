@@ -0,0 +1,46 @@
+from typing import List, Optional, TypedDict
+import datetime
+import decimal
+
+
+class UserPayload(TypedDict):
+    id: str
+    username: str
+    email: str
+    social_media: str
+
+
+class FriendPayload(TypedDict):
+    user_id: str
+    user_name: str
+    group_id: str
+    gift_desired: Optional[str]
+    friend_name: Optional[str]
+    social_media: Optional[str]
+    friend_id: Optional[str]
+    is_admin: bool
+
+
+class GroupPayload(TypedDict):
+    """
+    A serialized group. `event_date` and the prices are left as datetime and Decimal,
+    `app.serializers` encodes them as 'YYYY-MM-DD HH:MM:SS' and as exact decimal strings.
+    """
+    id: str
+    description: str
+    creator: str
+    event_date: datetime.datetime
+    min_gift_price: decimal.Decimal
+    max_gift_price: decimal.Decimal
+    friends: List[FriendPayload]
+
+
+class DrawJobPayload(TypedDict):
+    id: str
+    group_id: str
+    drawn: str
+    status: str
+    message: Optional[str]
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime]
+    finished_at: Optional[datetime.datetime]
@@ -0,0 +1,81 @@
+from flask import make_response
+from dotenv import load_dotenv
+from os import getenv
+import datetime
+import decimal
+import json
+
+
+load_dotenv()
+
+
+def default(value):
+    """
+    Encodes the values the JSON encoders do not handle in the format of the API:
+    datetimes as 'YYYY-MM-DD HH:MM:SS' and Decimals as their exact string.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ', 'seconds')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def orjson_codec():
+    import orjson
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    def dumps(value) -> bytes:
+        return orjson.dumps(value, default=default, option=options)
+    return dumps, orjson.loads
+
+
+def json_codec():
+    def dumps(value) -> bytes:
+        return json.dumps(value, default=default, separators=(',', ':')).encode()
+    return dumps, json.loads
+
+
+CODECS = {
+    'orjson': orjson_codec,
+    'json': json_codec,
+}
+
+
+def load_codec(name='auto'):
+    """
+    Loads a JSON codec.
+
+    Parameters:
+        name (str): One of CODECS, or 'auto' for the first one whose package is installed.
+
+    Returns:
+        Tuple: The name of the codec, its `dumps` (returning bytes) and its `loads`.
+
+    Raises:
+        ValueError: If the name is unknown.
+        ImportError: If the package of the requested codec is not installed.
+    """
+    if name == 'auto':
+        for candidate in CODECS:
+            try:
+                return (candidate, *CODECS[candidate]())
+            except ImportError:
+                continue
+    if name not in CODECS:
+        raise ValueError(f'JSON_ENCODER must be auto or one of {", ".join(CODECS)}, got {name!r}')
+    return (name, *CODECS[name]())
+
+
+codec_name, dumps, loads = load_codec(getenv('JSON_ENCODER', 'auto'))
+
+
+def output_json(data, code, headers=None):
+    """
+    The Flask-RESTful representation of 'application/json', encoding with the configured codec.
+    """
+    response = make_response(dumps(data) + b'\n', code)
+    response.mimetype = 'application/json'
+    response.headers.extend(headers or {})
+    return response
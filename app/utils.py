@@ -1,71 +1,66 @@
-import datetime
+from email.message import EmailMessage
 from os import getenv
 from typing import List, Tuple
-import random
 from dotenv import load_dotenv
+from app.draw import random_derangement
 
 
 load_dotenv()
-def generate_pairs(num) -> List[Tuple[int, int]]:
+def generate_pairs(num, seed=None) -> List[Tuple[int, int]]:
     """
-    Generate pairs of integers from 0 to `num`.
+    Generate pairs of integers from 0 to `num`, where no integer is paired with itself.
 
     Args:
         num (int): The upper limit for generating the integers.
+        seed: The seed of the random generator, for reproducible draws.
 
     Returns:
         List[Tuple[int, int]]: A list of tuples, each containing a pair
             of integers.
 
     Raises:
-        None.
+        ValueError: If `num` is 1, since the only integer would be paired with itself.
     """
-    lista = [x for x in range(num)]
-    listb = [x for x in range(num)]
-    result = []
+    return list(enumerate(random_derangement(num, seed=seed)))
 
-    for x in range(len(lista) - 1):
-        random_index = random.randrange(len(listb))
-        while lista[x] == listb[random_index]:
-            random_index = random.randrange(len(listb))
-        result.append((lista[x], listb[random_index]))
-        listb.pop(random_index)
 
-
-    if lista[-1] == listb[0]:
-        return generate_pairs(num)
-    else:
-        result.append((lista[-1], listb[0]))
-        return result
-
-
-def send_confirmation_email(email, token):
+def confirmation_message(email, token) -> EmailMessage:
     """
-    A function that sends an email using the provided email address and token, do not implemented yet.
-    
+    Builds the email that asks a new user to confirm their address.
+
     Parameters:
         email (str): The recipient's email address.
-        token (str): The token required to authenticate the email sending process.
-        
+        token (str): The email validation token.
+
     Returns:
-        A string containing the message sent to the email address.
+        EmailMessage: The message, ready to be sent.
     """
-    return {"email": email, "token": token, "exp": datetime.datetime.now() + datetime.timedelta(days=1)}
-    #TODO Implement a email sending function
+    message = EmailMessage()
+    message['From'] = getenv('MAIL_SENDER', 'no-reply@amigox.local')
+    message['To'] = email
+    message['Subject'] = 'Confirm your AmigoX account'
+    message.set_content(f'Open the link below to confirm your account:\n\n'
+                        f'{getenv("APP_URL", "")}/validate_email/{token}\n')
+    return message
 
-def send_recovery_email(email, token):
+def recovery_message(email, token) -> EmailMessage:
     """
-    A function that sends an email using the provided email address and token, do not implemented yet.
-    
+    Builds the email that lets a user log in with a recovery code.
+
     Parameters:
         email (str): The recipient's email address.
-        token (str): The token required to authenticate the email sending process.
-        
+        token (str): The recovery token.
+
     Returns:
-        A string containing the message sent to the email address.
+        EmailMessage: The message, ready to be sent.
     """
-    return {"email": email, "token": token, "exp": datetime.datetime.now() + datetime.timedelta(days=1)}
-    #TODO Implement a recoveryh email sending function
+    message = EmailMessage()
+    message['From'] = getenv('MAIL_SENDER', 'no-reply@amigox.local')
+    message['To'] = email
+    message['Subject'] = 'Your AmigoX recovery code'
+    message.set_content(f'Open the link below to log in to your account:\n\n'
+                        f'{getenv("APP_URL", "")}/login_with_recovery_code/{token}\n')
+    return message
 
 def test_headers(payload: dict[str, str]|None= None, authorization: str|None=None)->dict[str, str]:
     """
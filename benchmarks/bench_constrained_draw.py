@@ -0,0 +1,94 @@
+"""
+Compares the constrained draws of `app.draw` with the unconstrained ones used when a draw
+has no rules, and with a naive retry loop that reshuffles until no rule is broken.
+
+Each member belongs to a family of --family consecutive members who must not draw each
+other, and avoids the receiver of a previous draw. The naive loop gives up after
+--max-attempts shuffles; its expected number of attempts grows exponentially with the
+family size, while the constrained draws repair a single shuffle. The last row times how
+fast an infeasible draw is reported, where nobody may draw the first member.
+
+Usage:
+    python -m benchmarks.bench_constrained_draw [--sizes 10 100 1000 10000] [--family 4] [--repeat 3]
+"""
+from app.draw import DrawInfeasible, constrained_cycle, constrained_derangement, has_fixed_point, random_derangement
+import argparse
+import random
+import sys
+import time
+
+
+def family_pairs(num, size):
+    return [(a, b) for start in range(0, num, size)
+            for a in range(start, min(start + size, num)) for b in range(start, min(start + size, num)) if a != b]
+
+
+def random_cycle(num, rng):
+    order = list(range(num))
+    rng.shuffle(order)
+    cycle = [0] * num
+    for position, giver in enumerate(order):
+        cycle[giver] = order[(position + 1) % num]
+    return cycle
+
+
+def naive(num, blocked, shuffle, max_attempts, rng):
+    """
+    Reshuffles until no rule is broken. Returns the number of attempts, or None if it gave up.
+    """
+    for attempt in range(1, max_attempts + 1):
+        permutation = shuffle(num, rng)
+        if not has_fixed_point(permutation) and not any((giver, receiver) in blocked
+                                                        for giver, receiver in enumerate(permutation)):
+            return attempt
+    return None
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--family', type=int, default=4)
+    parser.add_argument('--max-attempts', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    print(f'{"members":>8} {"draw":>10} {"unconstrained ms":>17} {"constrained ms":>15} {"naive ms":>10} {"naive attempts":>15}')
+    for size in args.sizes:
+        exclude = family_pairs(size, args.family)
+        avoid = list(enumerate(constrained_cycle(size, exclude, seed=1)))
+        blocked = set(exclude) | set(avoid)
+        for name, unconstrained, constrained, shuffle in [
+            ('perfect', lambda: random_cycle(size, rng), constrained_cycle, random_cycle),
+            ('imperfect', lambda: random_derangement(size, rng=rng), constrained_derangement,
+             lambda num, generator: random_derangement(num, rng=generator)),
+        ]:
+            plain, _ = best_of(args.repeat, unconstrained)
+            solved, _ = best_of(args.repeat, lambda: constrained(size, exclude, avoid, rng=rng))
+            retried, attempts = best_of(1, lambda: naive(size, blocked, shuffle, args.max_attempts, rng))
+            attempts = attempts if attempts is not None else f'>{args.max_attempts}'
+            print(f'{size:>8} {name:>10} {plain:>17.2f} {solved:>15.2f} {retried:>10.2f} {attempts:>15}')
+
+    size = max(args.sizes)
+    exclude = [(giver, 0) for giver in range(1, size)]
+    for name, constrained in [('perfect', constrained_cycle), ('imperfect', constrained_derangement)]:
+        start = time.perf_counter()
+        try:
+            constrained(size, exclude, rng=rng)
+        except DrawInfeasible:
+            pass
+        print(f'{size:>8} {name:>10} infeasible reported in {(time.perf_counter() - start) * 1000:.2f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Measures how many groups per second are created with the former two-commit path, with
+`Group.create` (one transaction per group) and with `Group.create_many` (one transaction
+per batch).
+
+The groups are created in the database configured for the application (use the test
+database) and removed when the benchmark ends.
+
+Usage:
+    python -m benchmarks.bench_create_groups [--groups 1000] [--batch 100]
+"""
+from app.keys import uuid7_hex
+from app.models import User, Group, Friend
+import app.config as app_config
+from sqlalchemy import delete, insert
+import argparse
+import datetime
+import sys
+import time
+
+
+db, app = app_config.db, app_config.app
+
+
+def seed_creator():
+    user_id = uuid7_hex()
+    db.session.execute(insert(User), [{'id': user_id, 'name': 'bench', 'email': f'{user_id}@bench.local',
+                                       'social_media': '', 'password_hash': '!'}])
+    db.session.commit()
+    return user_id
+
+
+def remove_groups(creator):
+    group_ids = db.session.scalars(db.select(Group.id).where(Group.creator == creator)).all()
+    db.session.execute(delete(Friend).where(Friend.group_id.in_(group_ids)))
+    db.session.execute(delete(Group).where(Group.creator == creator))
+    db.session.commit()
+
+
+def fields(creator, i):
+    return {'description': f'bench{i}', 'creator': creator, 'event_date': datetime.datetime.now(),
+            'min_gift_price': 10, 'max_gift_price': 20, 'creator_desired_gift': 'gift'}
+
+
+def create_two_commits(creator, count, batch):
+    for i in range(count):
+        values = fields(creator, i)
+        group = Group(values['description'], creator, values['event_date'],
+                      values['min_gift_price'], values['max_gift_price'])
+        db.session.add(group)
+        db.session.commit()
+        db.session.add(Friend(creator, group.id, values['creator_desired_gift']))
+        db.session.commit()
+
+
+def create_one_commit(creator, count, batch):
+    for i in range(count):
+        Group.create(**fields(creator, i))
+
+
+def create_many(creator, count, batch):
+    for start in range(0, count, batch):
+        Group.create_many([fields(creator, i) for i in range(start, min(start + batch, count))])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        creator = seed_creator()
+        print(f'{"method":>22} {"groups/sec":>11}')
+        try:
+            for name, create in [('two commits', create_two_commits),
+                                 ('Group.create', create_one_commit),
+                                 (f'Group.create_many({args.batch})', create_many)]:
+                start = time.perf_counter()
+                create(creator, args.groups, args.batch)
+                elapsed = time.perf_counter() - start
+                remove_groups(creator)
+                print(f'{name:>22} {args.groups / elapsed:>11.0f}')
+        finally:
+            remove_groups(creator)
+            db.session.execute(delete(User).where(User.id == creator))
+            db.session.commit()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
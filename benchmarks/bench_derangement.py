@@ -0,0 +1,65 @@
+"""
+Measures how the derangement engine used by the imperfect draw scales with the group size.
+
+Usage:
+    python -m benchmarks.bench_derangement [--sizes 10 100 1000] [--repeat 5]
+"""
+from app.draw import random_derangement, np
+import argparse
+import random
+import sys
+import time
+
+
+LEGACY_MAX_SIZE = 10000
+
+
+def legacy_generate_pairs(num):
+    """
+    The previous `generate_pairs`: quadratic list pops with a recursive restart, kept for comparison.
+    """
+    lista = [x for x in range(num)]
+    listb = [x for x in range(num)]
+    result = []
+    for x in range(len(lista) - 1):
+        random_index = random.randrange(len(listb))
+        while lista[x] == listb[random_index]:
+            random_index = random.randrange(len(listb))
+        result.append((lista[x], listb[random_index]))
+        listb.pop(random_index)
+    if lista[-1] == listb[0]:
+        return legacy_generate_pairs(num)
+    result.append((lista[-1], listb[0]))
+    return result
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f'{"participants":>12} {"legacy (ms)":>12} {"python (ms)":>12} {"numpy (ms)":>12}')
+    for size in args.sizes:
+        legacy = '-'
+        if size <= LEGACY_MAX_SIZE:
+            legacy = f'{best_time(lambda: legacy_generate_pairs(size), args.repeat) * 1000:.2f}'
+        python = best_time(lambda: random_derangement(size, use_numpy=False), args.repeat) * 1000
+        vectorized = '-'
+        if np is not None:
+            vectorized = f'{best_time(lambda: random_derangement(size, use_numpy=True), args.repeat) * 1000:.2f}'
+        print(f'{size:>12} {legacy:>12} {python:>12.2f} {vectorized:>12}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
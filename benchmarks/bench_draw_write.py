@@ -0,0 +1,85 @@
+"""
+Measures how long perfect and imperfect draws take to compute and save for large groups.
+
+The users, the group and its friends are seeded into the database configured for the
+application (use the test database) and removed when the benchmark ends.
+
+Usage:
+    python -m benchmarks.bench_draw_write [--sizes 100 1000 5000] [--repeat 3]
+"""
+from app.keys import uuid7_hex
+from app.models import User, Group, Friend
+import app.config as app_config
+from sqlalchemy import delete, insert
+import argparse
+import datetime
+import sys
+import time
+
+
+db, app = app_config.db, app_config.app
+
+
+def seed_group(size):
+    """
+    Inserts `size` users and a group where all of them are friends, without hashing passwords.
+
+    Returns:
+        Tuple: The id of the group and the ids of the users.
+    """
+    user_ids = [uuid7_hex() for _ in range(size)]
+    db.session.execute(insert(User), [
+        {'id': user_id, 'name': f'bench{i}', 'email': f'{user_id}@bench.local',
+         'social_media': '', 'password_hash': '!'}
+        for i, user_id in enumerate(user_ids)
+    ])
+    group = Group('bench', user_ids[0], datetime.datetime.now(), 10, 20)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(insert(Friend), [
+        {'user_id': user_id, 'group_id': group.id, 'gift_desired': 'gift'} for user_id in user_ids
+    ])
+    db.session.commit()
+    return group.id, user_ids
+
+
+def remove_group(group_id, user_ids):
+    db.session.execute(delete(Friend).where(Friend.group_id == group_id))
+    db.session.execute(delete(Group).where(Group.id == group_id))
+    db.session.execute(delete(User).where(User.id.in_(user_ids)))
+    db.session.commit()
+
+
+def time_draw(group_id, method, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expire_all()
+        group = Group.query.filter_by(id=group_id).first()
+        start = time.perf_counter()
+        getattr(group, method)()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        print(f'{"participants":>12} {"perfect (ms)":>13} {"imperfect (ms)":>15}')
+        for size in args.sizes:
+            group_id, user_ids = seed_group(size)
+            try:
+                perfect = time_draw(group_id, 'perfect_drawn', args.repeat) * 1000
+                imperfect = time_draw(group_id, 'imperfect_drawn', args.repeat) * 1000
+            finally:
+                remove_group(group_id, user_ids)
+            print(f'{size:>12} {perfect:>13.2f} {imperfect:>15.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Measures the time to build and encode a large /sugetgroups payload, with the stdlib json
+encoder used by Flask-RESTful and with each codec of `app.serializers`.
+
+The groups, friends and users are built in memory, no database is needed. The `legacy`
+row formats dates and prices in `su_serialize`, as the models did before, and encodes
+with `json.dumps`.
+
+Usage:
+    python -m benchmarks.bench_encoding [--groups 1000] [--friends 50] [--repeat 5]
+"""
+from app.models import Group, Friend
+from app.serializers import CODECS, load_codec
+from collections import namedtuple
+import argparse
+import datetime
+import decimal
+import json
+import sys
+import time
+import uuid
+
+
+UserRow = namedtuple('UserRow', 'id name social_media')
+
+
+def build_groups(groups, friends):
+    """
+    Returns `groups` transient groups of `friends` drawn friends each, and the map of their users.
+    """
+    users = {}
+    result = []
+    for number in range(groups):
+        group = Group(f'group{number}', None, datetime.datetime(2023, 12, 24, 20), decimal.Decimal('50.00'),
+                      decimal.Decimal('150.00'))
+        group.id = uuid.uuid4().hex
+        user_ids = [uuid.uuid4().hex for _ in range(friends)]
+        group.creator = user_ids[0]
+        for position, user_id in enumerate(user_ids):
+            users[user_id] = UserRow(user_id, f'user {position}', f'www.instagram.com/{user_id[:8]}')
+            friend = Friend(user_id, group.id, 'a gift')
+            friend.friend_id = user_ids[(position + 1) % friends]
+            friend.is_admin = position == 0
+            group.friends.append(friend)
+        result.append(group)
+    return result, users
+
+
+def legacy_payload(groups, users):
+    payload = []
+    for group in groups:
+        serialized = group.su_serialize(users)
+        serialized['event_date'] = group.event_date.strftime('%Y-%m-%d %H:%M:%S')
+        serialized['min_gift_price'] = group.min_gift_price.__str__()
+        serialized['max_gift_price'] = group.max_gift_price.__str__()
+        payload.append(serialized)
+    return payload
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--friends', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    groups, users = build_groups(args.groups, args.friends)
+    print(f'{args.groups} groups of {args.friends} friends')
+    print(f'{"encoder":>8} {"build (ms)":>11} {"encode (ms)":>12} {"total (ms)":>11} {"size (KB)":>10}')
+
+    build, payload = best_of(args.repeat, lambda: legacy_payload(groups, users))
+    encode, body = best_of(args.repeat, lambda: json.dumps(payload) + '\n')
+    print(f'{"legacy":>8} {build:>11.1f} {encode:>12.1f} {build + encode:>11.1f} {len(body.encode()) / 1024:>10.0f}')
+
+    build, payload = best_of(args.repeat, lambda: [group.su_serialize(users) for group in groups])
+    for name in CODECS:
+        try:
+            _, dumps, _ = load_codec(name)
+        except ImportError:
+            print(f'{name:>8} not installed')
+            continue
+        encode, body = best_of(args.repeat, lambda: dumps(payload) + b'\n')
+        print(f'{name:>8} {build:>11.1f} {encode:>12.1f} {build + encode:>11.1f} {len(body) / 1024:>10.0f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
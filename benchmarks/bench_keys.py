@@ -0,0 +1,113 @@
+"""
+Compares hex string keys (uuid4, VARCHAR(32)) with binary ordered keys (uuid7, BINARY(16))
+on a copy of the `friend` table: insert throughput and the size of its indexes.
+
+Two scratch tables, with the primary key and the secondary indexes of `friend`, are
+created in the database configured for the application (use the test database),
+filled with `--rows` friends in groups of `--group-size`, and dropped at the end.
+Sizes are read from information_schema on MySQL, and from dbstat on SQLite when available.
+
+Usage:
+    python -m benchmarks.bench_keys [--rows 2000000] [--group-size 20] [--batch 10000]
+"""
+from app.keys import HexUUID, uuid7_hex
+import app.config as app_config
+from sqlalchemy import Boolean, Column, Index, MetaData, String, Table, insert, text
+import argparse
+import sys
+import time
+import uuid
+
+
+db, app = app_config.db, app_config.app
+
+
+def friend_table(metadata, name, key_type):
+    return Table(
+        name, metadata,
+        Column('user_id', key_type, primary_key=True),
+        Column('group_id', key_type, primary_key=True),
+        Column('friend_id', key_type, nullable=True, index=True),
+        Column('gift_desired', String(80)),
+        Column('is_admin', Boolean, default=False),
+        Index(f'ix_{name}_group_id_user_id', 'group_id', 'user_id'),
+    )
+
+
+def fill(table, new_id, rows, group_size, batch):
+    """
+    Inserts `rows` friends in batches, each group getting `group_size` new users.
+
+    Returns:
+        float: The number of rows inserted per second.
+    """
+    start = time.perf_counter()
+    group_id = None
+    for offset in range(0, rows, batch):
+        values = []
+        for i in range(offset, min(rows, offset + batch)):
+            if i % group_size == 0:
+                group_id = new_id()
+            values.append({'user_id': new_id(), 'group_id': group_id, 'friend_id': None,
+                           'gift_desired': 'gift', 'is_admin': False})
+        with db.engine.begin() as connection:
+            connection.execute(insert(table), values)
+    return rows / (time.perf_counter() - start)
+
+
+def table_size(table):
+    """
+    Returns the sizes in bytes of the data and of the indexes of a table, or None where
+    the database does not report them.
+    """
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.execute(text(f'ANALYZE TABLE {table.name}'))
+            row = connection.execute(text(
+                'SELECT data_length, index_length FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = :name'), {'name': table.name}).one()
+            return row.data_length, row.index_length
+        if connection.dialect.name == 'sqlite':
+            try:
+                rows = connection.execute(text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')).all()
+            except Exception:
+                return None, None
+            sizes = dict(rows)
+            indexes = [f'sqlite_autoindex_{table.name}_1'] + [index.name for index in table.indexes]
+            return sizes.get(table.name), sum(sizes.get(name, 0) for name in indexes)
+    return None, None
+
+
+def megabytes(size):
+    return f'{size / 2 ** 20:.1f}' if size is not None else '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    metadata = MetaData()
+    variants = [
+        ('uuid4 VARCHAR(32)', friend_table(metadata, 'bench_friend_hex', String(32)), lambda: uuid.uuid4().hex),
+        ('uuid7 BINARY(16)', friend_table(metadata, 'bench_friend_binary', HexUUID), uuid7_hex),
+    ]
+    with app.app_context():
+        metadata.drop_all(db.engine)
+        metadata.create_all(db.engine)
+        try:
+            print(f'{args.rows} friends, groups of {args.group_size}')
+            print(f'{"keys":>18} {"rows/s":>10} {"data (MB)":>10} {"indexes (MB)":>13}')
+            for label, table, new_id in variants:
+                rate = fill(table, new_id, args.rows, args.group_size, args.batch)
+                data, indexes = table_size(table)
+                print(f'{label:>18} {rate:>10.0f} {megabytes(data):>10} {megabytes(indexes):>13}')
+        finally:
+            metadata.drop_all(db.engine)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
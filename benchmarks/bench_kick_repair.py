@@ -0,0 +1,67 @@
+"""
+Measures how long kicking a member out of a drawn group takes when the draw is cleared and
+made again, and when it is repaired in place by `Group.kick_out(..., repair_draw=True)`.
+
+The users, the group and its friends are seeded into the database configured for the
+application (use the test database) and removed when the benchmark ends.
+
+Usage:
+    python -m benchmarks.bench_kick_repair [--sizes 1000 10000 50000] [--kicks 5]
+"""
+from app.models import Group
+from benchmarks.bench_draw_write import remove_group, seed_group
+import app.config as app_config
+import argparse
+import sys
+import time
+
+
+db, app = app_config.db, app_config.app
+
+DRAW_METHODS = {'PERFECT': 'perfect_drawn', 'IMPERFECT': 'imperfect_drawn'}
+
+
+def time_kicks(group_id, kicked_ids, drawn, repair):
+    """
+    Draws the group, then kicks each of `kicked_ids`, repairing the draw or drawing it again.
+
+    Returns:
+        float: The mean time of a kick, including the new draw when it is not repaired.
+    """
+    group = db.session.get(Group, group_id)
+    getattr(group, DRAW_METHODS[drawn])()
+    timings = []
+    for kicked_id in kicked_ids:
+        db.session.expire_all()
+        group = db.session.get(Group, group_id)
+        start = time.perf_counter()
+        if not group.kick_out(kicked_id, reset_draw=True, repair_draw=repair):
+            getattr(group, DRAW_METHODS[drawn])()
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--kicks', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        print(f'{"participants":>12} {"drawn":>10} {"redraw (ms)":>12} {"repair (ms)":>12}')
+        for size in args.sizes:
+            group_id, user_ids = seed_group(size)
+            try:
+                kicked = iter(user_ids[1:])
+                for drawn in DRAW_METHODS:
+                    redraw = time_kicks(group_id, [next(kicked) for _ in range(args.kicks)], drawn, False) * 1000
+                    repair = time_kicks(group_id, [next(kicked) for _ in range(args.kicks)], drawn, True) * 1000
+                    print(f'{size:>12} {drawn:>10} {redraw:>12.2f} {repair:>12.2f}')
+            finally:
+                remove_group(group_id, user_ids)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
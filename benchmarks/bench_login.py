@@ -0,0 +1,61 @@
+"""
+Measures password verification throughput, which bounds /login, for several hash settings.
+
+For each method it reports the logins/sec one core can verify inline and, with
+--workers, the throughput of the process pool used when PASSWORD_HASH_WORKERS is set.
+
+Usage:
+    python -m benchmarks.bench_login [--methods pbkdf2:sha256:600000 scrypt:32768:8:1] [--workers 4]
+"""
+from app.passwords import PasswordHasher
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import sys
+import time
+
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:100000',
+    'scrypt:32768:8:1',
+    'scrypt:16384:8:1',
+]
+
+
+def logins_per_second(hasher, password_hash, logins, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: hasher.verify(password_hash, 'password'), range(logins)))
+    assert all(results)
+    return logins / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS)
+    parser.add_argument('--logins', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    header = f'{"method":<24} {"inline logins/s/core":>21}'
+    if args.workers:
+        header += f' {f"pool({args.workers}) logins/s":>19} {"per core":>9}'
+    print(header)
+    for method in args.methods:
+        password_hash = PasswordHasher(method).hash('password')
+        line = f'{method:<24} {logins_per_second(PasswordHasher(method), password_hash, args.logins, 1):>21.1f}'
+        if args.workers:
+            hasher = PasswordHasher(method, workers=args.workers)
+            try:
+                hasher.verify(password_hash, 'password')
+                rate = logins_per_second(hasher, password_hash, args.logins * args.workers, 2 * args.workers)
+            finally:
+                hasher.shutdown()
+            line += f' {rate:>19.1f} {rate / args.workers:>9.1f}'
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
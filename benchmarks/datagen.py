@@ -0,0 +1,143 @@
+"""
+Seeds a synthetic data set of users, groups and group members for the benchmarks.
+
+Every user shares the same password, hashed once with the configured PASSWORD_HASH_METHOD,
+so seeding does not pay for one hash per user. The first user is a superuser. Each group
+has `members` distinct random users, the first of them being its creator and admin. The
+rows are written with one executemany per table and chunk.
+
+Usage:
+    python -m benchmarks.datagen [--users 1000] [--groups 200] [--members 20] [--seed 0]
+    python -m benchmarks.datagen --remove TAG
+"""
+from app.keys import uuid7_hex
+from app.models import User, Group, Friend
+from app.passwords import password_hasher
+import app.config as app_config
+from dataclasses import dataclass, field
+from sqlalchemy import delete, insert, select
+from typing import List
+import argparse
+import datetime
+import random
+import sys
+
+
+db, app = app_config.db, app_config.app
+
+PASSWORD = 'benchmark'
+CHUNK_SIZE = 5000
+
+
+@dataclass
+class Dataset:
+    """
+    The ids of the rows seeded by `generate`.
+
+    `tag` is part of every email and group description, so the rows can be found and removed
+    by another process.
+    """
+    tag: str
+    user_ids: List[str] = field(default_factory=list)
+    emails: List[str] = field(default_factory=list)
+    group_ids: List[str] = field(default_factory=list)
+    members: List[List[str]] = field(default_factory=list)
+
+    @property
+    def superuser_id(self):
+        return self.user_ids[0]
+
+    def admin_of(self, group_index):
+        return self.members[group_index][0]
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def generate(users, groups, members, seed=None) -> Dataset:
+    """
+    Inserts `users` users and `groups` groups of `members` friends each, and commits them.
+
+    Parameters:
+        users (int): The number of users.
+        groups (int): The number of groups.
+        members (int): The number of friends of each group, at most `users`.
+        seed: The seed of the random generator, for reproducible data sets.
+
+    Returns:
+        Dataset: The ids of the new rows.
+
+    Raises:
+        ValueError: If a group would have more members than there are users.
+    """
+    if members > users:
+        raise ValueError('members must not be greater than users')
+    rng = random.Random(seed)
+    dataset = Dataset(tag=uuid7_hex()[-12:])
+    password_hash = password_hasher.hash(PASSWORD)
+    user_rows = []
+    for number in range(users):
+        user_id = uuid7_hex()
+        email = f'user{number}.{dataset.tag}@bench.local'
+        dataset.user_ids.append(user_id)
+        dataset.emails.append(email)
+        user_rows.append({'id': user_id, 'name': f'user {number}', 'email': email,
+                          'social_media': f'www.instagram.com/user{number}', 'password_hash': password_hash,
+                          'is_superuser': number == 0, 'banned': False})
+    now = datetime.datetime.now()
+    group_rows, friend_rows = [], []
+    for number in range(groups):
+        group_id = uuid7_hex()
+        group_members = rng.sample(dataset.user_ids, members)
+        dataset.group_ids.append(group_id)
+        dataset.members.append(group_members)
+        group_rows.append({'id': group_id, 'description': f'group {number} {dataset.tag}', 'creator': group_members[0],
+                           'created_at': now, 'event_date': now + datetime.timedelta(days=30),
+                           'min_gift_price': 10, 'max_gift_price': 50, 'drawn': 'NO', 'version': 0})
+        friend_rows.extend({'user_id': user_id, 'group_id': group_id, 'friend_id': None,
+                            'gift_desired': f'gift {position}', 'is_admin': position == 0}
+                           for position, user_id in enumerate(group_members))
+    for table, rows in [(User.__table__, user_rows), (Group.__table__, group_rows), (Friend.__table__, friend_rows)]:
+        for chunk in chunks(rows):
+            db.session.execute(insert(table), chunk)
+    db.session.commit()
+    return dataset
+
+
+def remove(tag):
+    """
+    Deletes the users, groups and friends seeded with `tag`, and commits.
+    """
+    group_ids = db.session.scalars(select(Group.id).where(Group.description.endswith(f' {tag}'))).all()
+    for chunk in chunks(group_ids):
+        db.session.execute(delete(Friend).where(Friend.group_id.in_(chunk)))
+        db.session.execute(delete(Group).where(Group.id.in_(chunk)))
+    db.session.execute(delete(User).where(User.email.endswith(f'.{tag}@bench.local')))
+    db.session.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--remove', metavar='TAG')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        if args.remove:
+            remove(args.remove)
+            print(f'Removed data set {args.remove}')
+            return 0
+        dataset = generate(args.users, args.groups, args.members, args.seed)
+        print(f'Seeded data set {dataset.tag}: {args.users} users, {args.groups} groups of {args.members} members. '
+              f'Password of every user: {PASSWORD!r}. Superuser: {dataset.emails[0]}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
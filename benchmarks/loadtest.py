@@ -0,0 +1,258 @@
+"""
+Drives the API in process with Flask's test client and reports, for each endpoint, the
+p50/p95/p99 latency, the throughput and the number of SQL statements per request.
+
+A data set is seeded with `benchmarks.datagen` in the database configured for the
+application (use the test database) and removed at the end, unless --keep is given. The
+requests of each endpoint are planned up front from --seed, so two runs with the same
+arguments send the same requests; the access tokens are verified once before measuring, so
+the token cache is warm as on a running server.
+
+The results can be saved as a baseline and compared with a later run, to spot regressions
+between commits:
+
+    python -m benchmarks.loadtest --save                      # benchmarks/baselines/<commit>.json
+    python -m benchmarks.loadtest --compare benchmarks/baselines/<commit>.json
+
+A run is a regression if the p95 latency of an endpoint grew by more than --tolerance, or if
+it runs more SQL statements per request than in the baseline. The exit status is 1 if any
+endpoint regressed.
+
+Usage:
+    python -m benchmarks.loadtest [--users 1000] [--groups 200] [--members 20] [--requests 200]
+                                  [--concurrency 1] [--endpoints login getfriendsgroup ...]
+"""
+from benchmarks import datagen
+import app.config as app_config
+import app.rest  # registers the resources
+from app.models import User
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+db, app = app_config.db, app_config.app
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+class Planner:
+    """
+    Builds the requests sent to each endpoint from a data set, with a seeded random generator.
+
+    Each endpoint method returns a `(method, url, json, user_id)` tuple, where `user_id` is the
+    user whose access token is sent, or None.
+    """
+    def __init__(self, dataset: datagen.Dataset, seed):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+
+    def random_member(self):
+        index = self.rng.randrange(len(self.dataset.group_ids))
+        return index, self.rng.choice(self.dataset.members[index])
+
+    def login(self):
+        email = self.rng.choice(self.dataset.emails)
+        return 'POST', '/login', {'email': email, 'password': datagen.PASSWORD}, None
+
+    def getfriendsgroup(self):
+        index, user_id = self.random_member()
+        return 'GET', f'/getfriendsgroup/{self.dataset.group_ids[index]}', None, user_id
+
+    def sugetgroups(self):
+        return 'GET', '/sugetgroups', None, self.dataset.superuser_id
+
+    def getjoinedgroups(self):
+        return 'GET', '/getjoinedgroups', None, self.random_member()[1]
+
+    def perfectdrawngroup(self):
+        index = self.rng.randrange(len(self.dataset.group_ids))
+        return 'PUT', '/perfectdrawngroup', {'group_id': self.dataset.group_ids[index]}, self.dataset.admin_of(index)
+
+    def imperfectdrawngroup(self):
+        index = self.rng.randrange(len(self.dataset.group_ids))
+        return 'PUT', '/imperfectdrawngroup', {'group_id': self.dataset.group_ids[index]}, self.dataset.admin_of(index)
+
+
+# The draws write to the groups, so they run after the reads.
+ENDPOINTS = ['login', 'getfriendsgroup', 'sugetgroups', 'getjoinedgroups', 'perfectdrawngroup', 'imperfectdrawngroup']
+
+
+def access_tokens(user_ids):
+    """
+    Returns a map of each user id to a new access token.
+    """
+    users = User.query.filter(User.id.in_(list(user_ids))).all()
+    return {user.id: user.generate_access_token() for user in users}
+
+
+def percentile(latencies, percent):
+    if len(latencies) < 2:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method='inclusive')[percent - 1]
+
+
+def run(plan, tokens, concurrency):
+    """
+    Sends the planned requests and measures them.
+
+    Parameters:
+        plan (List[Tuple]): The requests built by a `Planner`.
+        tokens (dict): The access token of each user id in the plan.
+        concurrency (int): The number of threads sending requests.
+
+    Returns:
+        dict: The `p50`, `p95` and `p99` latencies in milliseconds, the `throughput` in
+            requests per second, the mean number of `queries` per request and the number of
+            `errors` (responses other than 2xx and 304).
+    """
+    statements = []
+    local = threading.local()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def send(request):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        method, url, body, user_id = request
+        headers = {'Authorization': f'Bearer {tokens[user_id]}'} if user_id else {}
+        start = time.perf_counter()
+        response = local.client.open(url, method=method, json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code < 300 or response.status_code == 304
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, plan))
+        wall = time.perf_counter() - start
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    return {
+        'requests': len(plan),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': len(plan) / wall,
+        'queries': len(statements) / len(plan),
+        'errors': sum(1 for _, ok in results if not ok),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_baseline(path, params, results):
+    commit = current_commit()
+    path = path or os.path.join(BASELINE_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'commit': commit, 'date': datetime.datetime.now().isoformat(' ', 'seconds'),
+                   'params': params, 'results': results}, file, indent=2)
+    return path
+
+
+def compare(baseline, results, tolerance):
+    """
+    Compares the results of a run with a saved baseline.
+
+    Parameters:
+        baseline (dict): The contents of a baseline file.
+        results (dict): The results of the run, by endpoint.
+        tolerance (float): The relative growth of the p95 latency accepted before flagging a regression.
+
+    Returns:
+        List[str]: A line for each endpoint measured in both runs, ending with REGRESSION for
+            the ones that regressed.
+    """
+    lines = []
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        p95_change = result['p95'] / before['p95'] - 1 if before['p95'] else 0.0
+        regressed = p95_change > tolerance or result['queries'] > before['queries']
+        lines.append(f'{name:<20} p95 {before["p95"]:>8.2f} -> {result["p95"]:>8.2f} ms ({p95_change:>+7.1%})'
+                     f'  queries {before["queries"]:>5.1f} -> {result["queries"]:>5.1f}'
+                     f'{"  REGRESSION" if regressed else ""}')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', nargs='?', const='', metavar='PATH',
+                        help='save the results as a baseline (default: benchmarks/baselines/<commit>.json)')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--keep', action='store_true', help='keep the seeded data set')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        dataset = datagen.generate(args.users, args.groups, args.members, args.seed)
+        try:
+            planner = Planner(dataset, args.seed)
+            plans = {name: [getattr(planner, name)() for _ in range(args.warmup + args.requests)]
+                     for name in args.endpoints}
+            tokens = access_tokens({request[3] for plan in plans.values() for request in plan if request[3]})
+        finally:
+            db.session.remove()
+
+    try:
+        run([('GET', '/user', None, user_id) for user_id in tokens], tokens, args.concurrency)
+        results = {}
+        print(f'{"endpoint":<20} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8} {"errors":>7}')
+        for name, plan in plans.items():
+            if args.warmup:
+                run(plan[:args.warmup], tokens, args.concurrency)
+            result = results[name] = run(plan[args.warmup:], tokens, args.concurrency)
+            print(f'{name:<20} {result["p50"]:>8.2f} {result["p95"]:>8.2f} {result["p99"]:>8.2f} '
+                  f'{result["throughput"]:>8.1f} {result["queries"]:>8.1f} {result["errors"]:>7}')
+    finally:
+        if not args.keep:
+            with app.app_context():
+                datagen.remove(dataset.tag)
+
+    if args.save is not None:
+        params = {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'keep')}
+        print(f'Baseline saved to {save_baseline(args.save, params, results)}')
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f'Compared with {baseline["commit"]} ({baseline["date"]}):')
+        lines = compare(baseline, results, args.tolerance)
+        print('\n'.join(lines))
+        if any(line.endswith('REGRESSION') for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+from importlib import import_module
+
+
+MIGRATIONS = [
+    'm0001_hot_lookup_indexes',
+    'm0002_email_outbox',
+    'm0003_group_version',
+    'm0004_binary_keys',
+    'm0005_draw_job',
+    'm0006_outbox_token_nullable',
+]
+
+
+def upgrade(engine, log=print):
+    """
+    Applies every migration, in order, to an existing database.
+
+    Each migration inspects the schema before changing it, so running them again
+    on an up-to-date database does nothing. Changes to tables that do not exist
+    yet are skipped, `db.create_all()` creates them already up to date.
+
+    Parameters:
+        engine (Engine): The engine of the database to migrate.
+        log (Callable): Receives a line describing each applied migration.
+    """
+    for name in MIGRATIONS:
+        module = import_module(f'{__name__}.{name}')
+        with engine.begin() as connection:
+            changes = module.upgrade(connection)
+        log(f'{name}: {", ".join(changes) if changes else "nothing to do"}')
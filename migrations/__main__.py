@@ -0,0 +1,32 @@
+import app.config as app_config
+import app.models
+from migrations import upgrade
+from migrations.explain import report
+import sys
+
+
+db, app = app_config.db, app_config.app
+
+
+def main(argv):
+    """
+    Migrates the configured database. With `--explain`, also checks that the hot
+    queries of the routes use an index.
+    """
+    with app.app_context():
+        upgrade(db.engine)
+        if '--explain' in argv:
+            try:
+                with db.engine.connect() as connection:
+                    results = report(connection)
+            except NotImplementedError as e:
+                print(f'Skipping the EXPLAIN check: {e}')
+                return 0
+            for name, indexed in results.items():
+                print(f'{"ok  " if indexed else "SCAN"} {name}')
+            return 0 if all(results.values()) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+from app.models import DrawJob, Friend, Group
+from sqlalchemy import select, text
+
+
+SAMPLE_ID = '0' * 32
+
+
+def hot_queries():
+    """
+    Returns the lookups made by the routes on hot columns, keyed by a description.
+    """
+    return {
+        'kick_out / KickOutGroup: friend by (user_id, group_id)':
+            select(Friend).where(Friend.user_id == SAMPLE_ID, Friend.group_id == SAMPLE_ID),
+        'GetJoinedGroups: friend by user_id':
+            select(Friend.group_id).where(Friend.user_id == SAMPLE_ID),
+        'GetFriendsGroup / draws: members of a group':
+            select(Friend).where(Friend.group_id == SAMPLE_ID),
+        'Group.load_users: friends assigned to a user':
+            select(Friend).where(Friend.friend_id == SAMPLE_ID),
+        'GetGroupCreatedBy: group by creator':
+            select(Group).where(Group.creator == SAMPLE_ID),
+        'draws: active background draw of a group':
+            select(DrawJob.id).where(DrawJob.active_group_id == SAMPLE_ID),
+        'groups by drawn state':
+            select(Group.id).where(Group.drawn == 'NO'),
+    }
+
+
+def mysql_plan_uses_index(rows) -> bool:
+    """
+    Checks the rows of a MySQL EXPLAIN: each table must be read through the key MySQL
+    chose, not only have `possible_keys`, and must not be a full table scan (`ALL`).
+
+    Parameters:
+        rows (List[dict]): The rows of the plan.
+
+    Returns:
+        bool: True if no table is fully scanned.
+    """
+    return all(row['key'] and row['type'] != 'ALL' for row in rows)
+
+
+def uses_index(connection, statement) -> bool:
+    """
+    Runs EXPLAIN on a statement and checks that every table is read through an index.
+
+    Supports MySQL, where each row of the plan must use a key (see `mysql_plan_uses_index`), and SQLite,
+    where each table must be searched (not scanned).
+
+    Parameters:
+        connection (Connection): A connection to the database.
+        statement (Select): The statement to explain.
+
+    Returns:
+        bool: True if no table is fully scanned.
+
+    Raises:
+        NotImplementedError: If the database is not MySQL nor SQLite.
+    """
+    dialect = connection.dialect.name
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    if dialect == 'mysql':
+        rows = connection.execute(text(f'EXPLAIN {compiled}')).mappings().all()
+        return mysql_plan_uses_index(rows)
+    if dialect == 'sqlite':
+        rows = connection.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+        return all(not row[-1].startswith('SCAN') for row in rows)
+    raise NotImplementedError(f'EXPLAIN check is not implemented for {dialect}')
+
+
+def report(connection):
+    """
+    Checks every hot query.
+
+    Returns:
+        dict: A map of the description of each query to True if it uses an index.
+
+    Raises:
+        NotImplementedError: If the database is not MySQL nor SQLite.
+    """
+    return {name: uses_index(connection, statement) for name, statement in hot_queries().items()}
@@ -0,0 +1,22 @@
+from app.models import Friend, Group
+from sqlalchemy import inspect
+
+
+def upgrade(connection):
+    """
+    Creates the secondary indexes declared on `friend` and `group` that are missing.
+
+    Returns:
+        List[str]: The names of the created indexes.
+    """
+    inspector = inspect(connection)
+    created = []
+    for table in (Friend.__table__, Group.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+    return created
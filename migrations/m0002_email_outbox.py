@@ -0,0 +1,15 @@
+from app.models import EmailOutbox
+from sqlalchemy import inspect
+
+
+def upgrade(connection):
+    """
+    Creates the `email_outbox` table if it does not exist.
+
+    Returns:
+        List[str]: The names of the created tables.
+    """
+    if inspect(connection).has_table(EmailOutbox.__tablename__):
+        return []
+    EmailOutbox.__table__.create(connection)
+    return [EmailOutbox.__tablename__]
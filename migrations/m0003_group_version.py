@@ -0,0 +1,19 @@
+from app.models import Group
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    """
+    Adds the `version` column to `group` if it is missing, starting every group at 0.
+
+    Returns:
+        List[str]: The names of the added columns.
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table(Group.__tablename__):
+        return []
+    if 'version' in {column['name'] for column in inspector.get_columns(Group.__tablename__)}:
+        return []
+    table = connection.dialect.identifier_preparer.quote(Group.__tablename__)
+    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0'))
+    return ['group.version']
@@ -0,0 +1,85 @@
+from app.models import Friend, Group, User
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import AddConstraint
+
+
+KEY_COLUMNS = [
+    (User.__tablename__, 'id'),
+    (Group.__tablename__, 'id'),
+    (Group.__tablename__, 'creator'),
+    (Friend.__tablename__, 'user_id'),
+    (Friend.__tablename__, 'group_id'),
+    (Friend.__tablename__, 'friend_id'),
+]
+
+
+def is_converted(column) -> bool:
+    """
+    Checks if a reflected column is already BINARY(16). Any other type, including the
+    VARBINARY(32) a previous run may have left behind, still has to be converted.
+    """
+    return column['type'].__visit_name__ == 'BINARY' and getattr(column['type'], 'length', None) == 16
+
+
+def model_foreign_keys():
+    """
+    Returns the foreign keys declared by the models that reference `user` or `group`,
+    which must be dropped while their columns are converted.
+    """
+    referred = {User.__tablename__, Group.__tablename__}
+    return [foreign_key for table in User.metadata.sorted_tables
+            for foreign_key in table.foreign_key_constraints if foreign_key.referred_table.name in referred]
+
+
+def upgrade(connection):
+    """
+    Converts the ids of `user` and `group`, and the columns referencing them, from 32 hex
+    characters to BINARY(16). Only MySQL databases are converted, the ids read by the API
+    stay the same hex strings.
+
+    The foreign keys are dropped, each column is turned into VARBINARY, its 32 character
+    values are unhexed in place and it is shrunk to BINARY(16), then the foreign keys
+    declared by the models are added back. MySQL commits each DDL statement, so every
+    step is decided from the current schema: a run that died halfway is completed by the
+    next one, including the foreign keys it had dropped.
+
+    Returns:
+        List[str]: The converted columns, as `table.column`, and the restored foreign keys.
+    """
+    if connection.dialect.name != 'mysql':
+        return []
+    inspector = inspect(connection)
+    tables = {table for table, _ in KEY_COLUMNS if inspector.has_table(table)}
+    columns = {table: {column['name']: column for column in inspector.get_columns(table)} for table in tables}
+    pending = [(table, name) for table, name in KEY_COLUMNS
+               if table in tables and not is_converted(columns[table][name])]
+
+    foreign_keys = [foreign_key for foreign_key in model_foreign_keys() if inspector.has_table(foreign_key.table.name)]
+    live = {table: inspector.get_foreign_keys(table) for table in {foreign_key.table.name for foreign_key in foreign_keys}}
+
+    def live_names(foreign_key):
+        constrained = [column.name for column in foreign_key.columns]
+        return [live_key['name'] for live_key in live[foreign_key.table.name]
+                if live_key['constrained_columns'] == constrained]
+
+    missing = [foreign_key for foreign_key in foreign_keys if not live_names(foreign_key)]
+    if not pending and not missing:
+        return []
+
+    quote = connection.dialect.identifier_preparer.quote
+    if pending:
+        for foreign_key in foreign_keys:
+            for name in live_names(foreign_key):
+                connection.execute(text(f'ALTER TABLE {quote(foreign_key.table.name)} DROP FOREIGN KEY {quote(name)}'))
+        for table, name in pending:
+            null = 'NULL' if columns[table][name]['nullable'] else 'NOT NULL'
+            connection.execute(text(f'ALTER TABLE {quote(table)} MODIFY {quote(name)} VARBINARY(32) {null}'))
+            connection.execute(text(f'UPDATE {quote(table)} SET {quote(name)} = UNHEX({quote(name)}) '
+                                    f'WHERE LENGTH({quote(name)}) = 32'))
+            connection.execute(text(f'ALTER TABLE {quote(table)} MODIFY {quote(name)} BINARY(16) {null}'))
+
+    for foreign_key in (foreign_keys if pending else missing):
+        connection.execute(AddConstraint(foreign_key))
+    return [f'{table}.{name}' for table, name in pending] + [
+        f'{foreign_key.table.name}.{foreign_key.column_keys[0]} foreign key' for foreign_key in missing
+    ]
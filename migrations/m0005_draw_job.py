@@ -0,0 +1,15 @@
+from app.models import DrawJob
+from sqlalchemy import inspect
+
+
+def upgrade(connection):
+    """
+    Creates the `draw_job` table if it does not exist.
+
+    Returns:
+        List[str]: The names of the created tables.
+    """
+    if inspect(connection).has_table(DrawJob.__tablename__):
+        return []
+    DrawJob.__table__.create(connection)
+    return [DrawJob.__tablename__]
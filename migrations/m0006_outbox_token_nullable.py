@@ -0,0 +1,43 @@
+from app.models import EmailOutbox
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    """
+    Makes `email_outbox.token` nullable and clears the tokens of the emails already SENT
+    or FAILED, which `app.mailer` no longer keeps.
+
+    SQLite cannot change a column, so there the table is copied into a new one.
+
+    Returns:
+        List[str]: The changed column, and the number of cleared tokens if any.
+    """
+    inspector = inspect(connection)
+    table = EmailOutbox.__tablename__
+    if not inspector.has_table(table):
+        return []
+    changes = []
+    token = next(column for column in inspector.get_columns(table) if column['name'] == 'token')
+    if not token['nullable']:
+        quoted = connection.dialect.identifier_preparer.quote(table)
+        if connection.dialect.name == 'mysql':
+            connection.execute(text(f'ALTER TABLE {quoted} MODIFY token TEXT NULL'))
+        elif connection.dialect.name == 'sqlite':
+            columns = ', '.join(column.name for column in EmailOutbox.__table__.columns)
+            for index in inspector.get_indexes(table):
+                connection.execute(text(f'DROP INDEX {index["name"]}'))
+            connection.execute(text(f'ALTER TABLE {quoted} RENAME TO {table}_old'))
+            EmailOutbox.__table__.create(connection)
+            connection.execute(text(f'INSERT INTO {quoted} ({columns}) SELECT {columns} FROM {table}_old'))
+            connection.execute(text(f'DROP TABLE {table}_old'))
+        else:
+            connection.execute(text(f'ALTER TABLE {quoted} ALTER COLUMN token DROP NOT NULL'))
+        changes.append(f'{table}.token')
+    cleared = connection.execute(
+        EmailOutbox.__table__.update()
+        .where(EmailOutbox.status.in_(('SENT', 'FAILED')), EmailOutbox.token.isnot(None))
+        .values(token=None)
+    ).rowcount
+    if cleared:
+        changes.append(f'{cleared} delivered tokens cleared')
+    return changes
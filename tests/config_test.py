@@ -1,5 +1,7 @@
 from app.models import User, Group, Friend
 import app.config as app_config
+from contextlib import contextmanager
+from sqlalchemy import event
 import datetime
 
 
@@ -52,3 +54,23 @@ def create_db():
 
         app.testing = True
         return app
+
+
+@contextmanager
+def count_queries():
+    """
+    Records the SQL statements run on the database while the block executes.
+
+    Yields:
+        list: The statements, appended as they are run.
+    """
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,63 @@
+from email import message_from_bytes
+import socketserver
+import threading
+
+
+class FakeSMTPServer:
+    """
+    A local SMTP sink for tests. It accepts every message and keeps it in `messages`.
+
+    Parameters:
+        fail (bool): If True, every message is rejected with a 554 reply.
+    """
+
+    def __init__(self, fail=False):
+        self.messages = []
+        self.connections = 0
+        self.fail = fail
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                sink.connections += 1
+                self.reply('220 fake-smtp ready')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip().upper()
+                    if command.startswith(('EHLO', 'HELO')):
+                        self.reply('250 fake-smtp')
+                    elif command == 'DATA':
+                        self.reply('354 end data with <CR><LF>.<CR><LF>')
+                        data = b''
+                        while True:
+                            line = self.rfile.readline()
+                            if line in (b'.\r\n', b''):
+                                break
+                            data += line[1:] if line.startswith(b'..') else line
+                        if sink.fail:
+                            self.reply('554 rejected')
+                        else:
+                            sink.messages.append(message_from_bytes(data))
+                            self.reply('250 queued')
+                    elif command == 'QUIT':
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 ok')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
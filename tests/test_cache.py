@@ -0,0 +1,63 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+from app.cache import GroupCache, MemoryBackend, TokenCache
+from app.models import UserSnapshot
+from freezegun import freeze_time
+import time
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TokenCache(max_entries=2, ttl=60)
+        user = UserSnapshot('id', 'name', 'email', '', False, False)
+        exp = time.time() + 60
+        for token in ['a', 'b', 'c']:
+            cache.set(token, {'exp': exp}, user)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), ({'exp': exp}, user))
+        cache.invalidate_user('id')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_entries_expire_with_the_token(self):
+        cache = TokenCache(max_entries=10, ttl=600)
+        user = UserSnapshot('id', 'name', 'email', '', False, False)
+        with freeze_time('2019-12-01 01:01:01'):
+            cache.set('token', {'exp': time.time() + 10}, user)
+            self.assertIsNotNone(cache.get('token'))
+        with freeze_time('2019-12-01 01:01:12'):
+            self.assertIsNone(cache.get('token'))
+
+
+class GroupCacheTestCase(unittest.TestCase):
+    def test_payloads_are_keyed_by_version(self):
+        cache = GroupCache(MemoryBackend())
+        builds = []
+        def build(group_id):
+            builds.append(group_id)
+            return {'id': group_id, 'build': len(builds)}
+        self.assertEqual(cache.get('g', 0, 'serialize', build)['build'], 1)
+        self.assertEqual(cache.get('g', 0, 'serialize', build)['build'], 1)
+        self.assertEqual(cache.get('g', 1, 'serialize', build)['build'], 2)
+        cache.invalidate_all()
+        self.assertEqual(cache.get('g', 1, 'serialize', build)['build'], 3)
+        self.assertEqual(cache.get('g', 1, 'su_serialize', build)['build'], 4)
+
+    def test_missing_groups_are_not_cached(self):
+        cache = GroupCache(MemoryBackend())
+        self.assertIsNone(cache.get('g', 0, 'serialize', lambda group_id: None))
+        self.assertEqual(cache.get('g', 0, 'serialize', lambda group_id: {'id': group_id}), {'id': 'g'})
+
+    def test_memory_limits(self):
+        backend = MemoryBackend(max_entries=10, max_bytes=25)
+        for key in 'abc':
+            backend.set(key, 'x' * 10)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), 'x' * 10)
+        self.assertEqual(backend.stats()['bytes'], 20)
+        self.assertEqual(backend.stats()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+import app.rest as rest
+from app.cache import group_cache, token_cache
+from app.models import User, Friend, Group, GroupConflict
+from app.utils import test_headers
+from config_test import create_db
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+import random
+
+
+db = rest.db
+
+EXTRA_MEMBERS = 12
+THREADS = 8
+
+
+class GroupConflictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_db()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.group = Group.query.filter_by(description='group1').first()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+
+    def change_elsewhere(self):
+        # Another request commits a change to the group after this session read it.
+        with db.engine.begin() as connection:
+            connection.execute(update(Group.__table__).where(Group.__table__.c.id == self.group.id)
+                               .values(version=Group.__table__.c.version + 1))
+
+    def test_stale_draw_is_rejected(self):
+        self.change_elsewhere()
+        with self.assertRaises(GroupConflict):
+            self.group.perfect_drawn()
+        group = Group.query.filter_by(description='group1').first()
+        self.assertEqual((group.drawn, group.version), ('NO', 1))
+        self.assertEqual(Group.drawn_pairs(group.id), [])
+
+    def test_stale_kick_is_rejected(self):
+        user = User.query.filter_by(email='email2@example.com').first()
+        self.group.perfect_drawn()
+        group = Group.query.filter_by(description='group1').first()
+        self.change_elsewhere()
+        with self.assertRaises(GroupConflict):
+            group.kick_out(user.id, reset_draw=True)
+        group = Group.query.filter_by(description='group1').first()
+        self.assertEqual(group.drawn, 'PERFECT')
+        self.assertEqual(len(Group.drawn_pairs(group.id)), 4)
+
+    def test_fresh_writes_bump_the_version(self):
+        self.group.perfect_drawn()
+        self.assertEqual(self.group.version, 1)
+        self.group.imperfect_drawn()
+        self.assertEqual(Group.current_version(self.group.id), 2)
+
+
+class ConcurrentWritesTestCase(unittest.TestCase):
+    """
+    Sends draws and kicks of the same group from several threads at once, against the test
+    database, and checks that each request either succeeded or got a 409, that no write was
+    lost and that the group is left with a consistent draw.
+    """
+    def setUp(self):
+        self.app = create_db()
+        token_cache.clear()
+        group_cache.clear()
+        with self.app.app_context():
+            group = Group.query.filter_by(description='group1').first()
+            admin = User.query.filter_by(email='email1@example.com').first()
+            users = [User(f'extra{number}', f'extra{number}@example.com', '', 'password') for number in range(EXTRA_MEMBERS)]
+            db.session.add_all(users)
+            db.session.commit()
+            db.session.add_all([Friend(user.id, group.id, 'gift') for user in users])
+            db.session.commit()
+            self.group_id = group.id
+            self.token = admin.generate_access_token()
+            self.kicked = [user.id for user in users[:EXTRA_MEMBERS // 2]]
+
+    def send(self, request):
+        method, path, payload = request
+        with self.app.test_client() as client:
+            response = client.open(path, method=method, json=payload, headers=test_headers(authorization=self.token))
+            return response.status_code
+
+    def test_draws_and_kicks(self):
+        requests = ([('PUT', '/perfectdrawngroup', {'group_id': self.group_id})] * 30
+                    + [('PUT', '/imperfectdrawngroup', {'group_id': self.group_id})] * 30
+                    + [('DELETE', f'/kickoutgroup/{self.group_id}/{user_id}', None) for user_id in self.kicked])
+        random.Random(0).shuffle(requests)
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            statuses = list(executor.map(self.send, requests))
+
+        self.assertTrue(set(statuses) <= {200, 409}, statuses)
+        self.assertIn(200, statuses)
+        with self.app.app_context():
+            group = Group.query.filter_by(id=self.group_id).first()
+            # Every successful write bumped the version exactly once.
+            self.assertEqual(group.version, statuses.count(200))
+            kicked = [path.rsplit('/', 1)[-1] for (method, path, _), status in zip(requests, statuses)
+                      if method == 'DELETE' and status == 200]
+            friends = Friend.query.filter_by(group_id=self.group_id).all()
+            members = {friend.user_id for friend in friends}
+            self.assertEqual(len(members), 4 + EXTRA_MEMBERS - len(kicked))
+            self.assertFalse(members & set(kicked))
+            assignment = {friend.user_id: friend.friend_id for friend in friends}
+            if group.drawn == 'NO':
+                self.assertEqual(set(assignment.values()), {None})
+            else:
+                self.assertEqual(sorted(assignment.values()), sorted(members))
+                self.assertFalse(any(giver == receiver for giver, receiver in assignment.items()))
+            if group.drawn == 'PERFECT':
+                node, seen = next(iter(members)), set()
+                while node not in seen:
+                    seen.add(node)
+                    node = assignment[node]
+                self.assertEqual(seen, members)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+from collections import Counter
+import random
+import time
+from app.draw import (DrawInfeasible, DrawNotFound, constrained_cycle, constrained_derangement, has_fixed_point, np,
+                      random_derangement)
+from app.utils import generate_pairs
+
+
+class DerangementTestCase(unittest.TestCase):
+    def test_derangement_has_no_fixed_point(self):
+        for num in [0, 2, 3, 10, 1000]:
+            derangement = random_derangement(num)
+            self.assertEqual(sorted(derangement), list(range(num)))
+            self.assertFalse(has_fixed_point(derangement))
+
+    def test_seed_is_reproducible(self):
+        self.assertEqual(random_derangement(500, seed=42), random_derangement(500, seed=42))
+
+    def test_single_element_has_no_derangement(self):
+        with self.assertRaises(ValueError):
+            random_derangement(1)
+
+    def test_derangements_are_uniform(self):
+        # There are 9 derangements of 4 elements, each should show up ~1/9 of the time.
+        counts = Counter(tuple(random_derangement(4, seed=seed)) for seed in range(9000))
+        self.assertEqual(len(counts), 9)
+        self.assertTrue(all(800 < count < 1200 for count in counts.values()))
+
+    def test_derangements_of_five_are_uniform(self):
+        # There are 44 derangements of 5 elements.
+        rng = random.Random(3)
+        counts = Counter(tuple(random_derangement(5, rng=rng, use_numpy=False)) for _ in range(44000))
+        self.assertEqual(len(counts), 44)
+        self.assertTrue(all(800 < count < 1200 for count in counts.values()))
+
+    def test_python_path_draws_a_bounded_number_of_randoms(self):
+        class CountingRandom:
+            def __init__(self, seed):
+                self.generator, self.calls = random.Random(seed), 0
+            def random(self):
+                self.calls += 1
+                return self.generator.random()
+            def randrange(self, stop):
+                self.calls += 1
+                return self.generator.randrange(stop)
+
+        for seed in range(20):
+            rng = CountingRandom(seed)
+            derangement = random_derangement(1000, rng=rng, use_numpy=False)
+            self.assertFalse(has_fixed_point(derangement))
+            self.assertLessEqual(rng.calls, 2 * 1000)
+
+    def test_large_group_does_not_recurse(self):
+        derangement = random_derangement(200000, use_numpy=False)
+        self.assertFalse(has_fixed_point(derangement))
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_numpy_path(self):
+        derangement = random_derangement(1000, seed=7, use_numpy=True)
+        self.assertEqual(sorted(derangement), list(range(1000)))
+        self.assertFalse(has_fixed_point(derangement))
+
+    def test_generate_pairs(self):
+        pairs = generate_pairs(10)
+        self.assertEqual(sorted(pair[0] for pair in pairs), list(range(10)))
+        self.assertEqual(sorted(pair[1] for pair in pairs), list(range(10)))
+        self.assertFalse(any(giver == receiver for giver, receiver in pairs))
+
+
+
+def count_cycles(permutation):
+    seen, cycles = set(), 0
+    for start in range(len(permutation)):
+        if start not in seen:
+            cycles += 1
+            node = start
+            while node not in seen:
+                seen.add(node)
+                node = permutation[node]
+    return cycles
+
+
+def families(num, size):
+    """
+    Returns the pairs of elements of the same family, of `size` consecutive elements, both ways.
+    """
+    return [(a, b) for a in range(num) for b in range(num) if a != b and a // size == b // size]
+
+
+class ConstrainedDrawTestCase(unittest.TestCase):
+    def assertValid(self, permutation, exclude):
+        self.assertEqual(sorted(permutation), list(range(len(permutation))))
+        self.assertFalse(has_fixed_point(permutation))
+        self.assertFalse(set(enumerate(permutation)) & set(exclude))
+
+    def test_derangement_respects_exclusions(self):
+        for num in [6, 9, 50, 3000]:
+            exclude = families(num, 3)
+            self.assertValid(constrained_derangement(num, exclude, seed=num), exclude)
+
+    def test_cycle_respects_exclusions(self):
+        for num in [4, 9, 11, 50, 3000]:
+            exclude = families(num, 2)
+            cycle = constrained_cycle(num, exclude, seed=num)
+            self.assertValid(cycle, exclude)
+            self.assertEqual(count_cycles(cycle), 1)
+
+    def test_dense_exclusions_are_repaired(self):
+        rng = random.Random(0)
+        exclude = [(a, b) for a in range(300) for b in range(300) if a != b and rng.random() < 0.6]
+        self.assertValid(constrained_derangement(300, exclude, seed=1), exclude)
+        cycle = constrained_cycle(300, exclude, seed=1)
+        self.assertValid(cycle, exclude)
+        self.assertEqual(count_cycles(cycle), 1)
+
+    def test_infeasible_draws_fail_fast(self):
+        exclude = [(a, 0) for a in range(1, 20000)]
+        for solve in [constrained_derangement, constrained_cycle]:
+            start = time.perf_counter()
+            with self.assertRaises(DrawInfeasible):
+                solve(20000, exclude, seed=0)
+            self.assertLess(time.perf_counter() - start, 5)
+        # A family of more than half the group cannot all draw outside of it.
+        with self.assertRaises(DrawInfeasible):
+            constrained_derangement(7, families(7, 4))
+        # Two halves where the first one cannot reach the second one have derangements, but no cycle.
+        one_way = [(a, b) for a in range(3) for b in range(3, 6)]
+        self.assertValid(constrained_derangement(6, one_way, seed=0), one_way)
+        with self.assertRaises(DrawInfeasible):
+            constrained_cycle(6, one_way)
+        with self.assertRaises(DrawInfeasible):
+            constrained_cycle(40, [(a, b) for a in range(20) for b in range(20, 40)])
+        with self.assertRaises(DrawInfeasible):
+            constrained_cycle(1)
+
+    def test_sparse_links_are_never_reported_infeasible(self):
+        # Two halves with a single allowed link each way: a cycle exists, but the search may give up.
+        for num in [40, 600]:
+            half = num // 2
+            exclude = [(a, b) for a in range(half) for b in range(half, num) if (a, b) != (0, half)]
+            exclude += [(b, a) for b in range(half, num) for a in range(half) if (b, a) != (half + 1, 1)]
+            for seed in range(3):
+                try:
+                    cycle = constrained_cycle(num, exclude, seed=seed)
+                except DrawNotFound:
+                    continue
+                self.assertValid(cycle, exclude)
+                self.assertEqual(count_cycles(cycle), 1)
+
+    def test_avoided_pairs_are_kept_out_when_possible(self):
+        exclude = families(100, 2)
+        previous = constrained_cycle(100, exclude, seed=1)
+        avoid = list(enumerate(previous))
+        for solve in [constrained_derangement, constrained_cycle]:
+            permutation = solve(100, exclude, avoid, seed=2)
+            self.assertValid(permutation, exclude)
+            self.assertFalse(set(enumerate(permutation)) & set(avoid))
+
+    def test_avoided_pairs_are_drawn_when_needed(self):
+        # 0 -> 1 -> 2 -> 0 and 0 -> 2 -> 1 -> 0 are the only cycles of 3 elements.
+        self.assertEqual(constrained_cycle(3, [(0, 2)], [(0, 1), (1, 2), (2, 0)], seed=0), [1, 2, 0])
+        self.assertValid(constrained_derangement(50, [], [(a, b) for a in range(50) for b in range(50)], seed=0), [])
+
+    def test_seed_is_reproducible(self):
+        exclude = families(500, 4)
+        self.assertEqual(constrained_cycle(500, exclude, seed=3), constrained_cycle(500, exclude, seed=3))
+        self.assertEqual(constrained_derangement(500, exclude, seed=3), constrained_derangement(500, exclude, seed=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
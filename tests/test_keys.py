@@ -0,0 +1,61 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+from app.keys import hex_to_bytes, uuid7_hex
+from app.utils import test_headers
+import app.rest
+from app.models import User, Group
+from config_test import create_db
+from flask.testing import FlaskClient
+from migrations.m0004_binary_keys import is_converted, model_foreign_keys
+from sqlalchemy.dialects.mysql import BINARY, VARBINARY, VARCHAR
+import time
+
+
+class KeysTestCase(unittest.TestCase):
+    def test_uuid7_is_time_ordered(self):
+        ids = []
+        for _ in range(3):
+            ids.append(uuid7_hex())
+            time.sleep(0.002)
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(key) == 32 and key[12] == '7' and key[16] in '89ab' for key in ids))
+
+    def test_only_binary_16_columns_are_converted(self):
+        self.assertTrue(is_converted({'type': BINARY(16)}))
+        # A run that died after turning the column into VARBINARY must convert it again.
+        for column_type in [VARCHAR(32), VARBINARY(32), BINARY(32)]:
+            self.assertFalse(is_converted({'type': column_type}))
+
+    def test_foreign_keys_come_from_the_models(self):
+        keys = {(foreign_key.table.name, foreign_key.column_keys[0]) for foreign_key in model_foreign_keys()}
+        self.assertTrue({('group', 'creator'), ('friend', 'user_id'), ('friend', 'group_id'),
+                         ('friend', 'friend_id')} <= keys)
+
+    def test_malformed_ids_match_nothing(self):
+        self.assertEqual(hex_to_bytes('ab' * 16), b'\xab' * 16)
+        for value in ['', 'ab', 'z' * 32, 'ab' * 17]:
+            self.assertEqual(hex_to_bytes(value), b'')
+
+
+class BinaryKeysTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_db()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.app_test = FlaskClient(self.app)
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_ids_are_read_as_hex(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(creator=user.id).first()
+        self.assertEqual(len(user.id), 32)
+        self.assertEqual(Group.query.filter_by(id=group.id.upper()).first(), group)
+        self.assertEqual({friend.group_id for friend in group.friends}, {group.id})
+
+    def test_malformed_group_id_is_not_found(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        self.assertEqual(self.app_test.get('/sugetgroup/not-a-group', headers=headers).status_code, 404)
+        self.assertEqual(self.app_test.get('/getfriendsgroup/not-a-group', headers=headers).status_code, 401)
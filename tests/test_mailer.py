@@ -0,0 +1,102 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+import datetime
+from app.mailer import OutboxDispatcher, SMTPSender
+import app.rest
+from app.models import EmailOutbox
+from app.passwords import password_hasher
+from app.utils import test_headers
+import app.config as app_config
+from config_test import create_db
+from fake_smtp import FakeSMTPServer
+from flask.testing import FlaskClient
+import json
+import jwt
+
+
+db, app = app_config.db, app_config.app
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        create_db()
+        self.app_context = app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_signup_only_enqueues(self):
+        payload = {'name': 'test', 'email': 'test@example.com', 'social_media': '', 'password': 'test'}
+        response = FlaskClient(app).post('/signup', json=payload, headers=test_headers(payload))
+        self.assertEqual(response.status_code, 201)
+        email = EmailOutbox.query.one()
+        self.assertEqual((email.kind, email.email, email.status), ('confirmation', 'test@example.com', 'PENDING'))
+
+    def test_enqueue_deduplicates_by_token(self):
+        self.assertTrue(EmailOutbox.enqueue('recovery', 'email1@example.com', 'token'))
+        self.assertFalse(EmailOutbox.enqueue('recovery', 'email1@example.com', 'token'))
+        self.assertEqual(EmailOutbox.query.count(), 1)
+
+    def test_dispatcher_delivers_batches(self):
+        for i in range(5):
+            EmailOutbox.enqueue('confirmation', f'user{i}@example.com', f'token{i}')
+        with FakeSMTPServer() as smtp:
+            dispatcher = OutboxDispatcher(SMTPSender(smtp.host, smtp.port), batch_size=10, workers=2)
+            try:
+                self.assertEqual(dispatcher.run_once(), 5)
+                self.assertEqual(dispatcher.run_once(), 0)
+            finally:
+                dispatcher.stop()
+        self.assertEqual(sorted(message['To'] for message in smtp.messages), [f'user{i}@example.com' for i in range(5)])
+        self.assertEqual(smtp.connections, 2)
+        self.assertTrue(all(email.status == 'SENT' for email in EmailOutbox.query.all()))
+
+    def test_delivered_email_no_longer_holds_the_token(self):
+        EmailOutbox.enqueue('recovery', 'email1@example.com', 'token')
+        with FakeSMTPServer() as smtp:
+            dispatcher = OutboxDispatcher(SMTPSender(smtp.host, smtp.port))
+            try:
+                dispatcher.run_once()
+            finally:
+                dispatcher.stop()
+        email = EmailOutbox.query.one()
+        self.assertEqual((email.status, email.token), ('SENT', None))
+        self.assertIn('/login_with_recovery_code/token', smtp.messages[0].get_payload(decode=True).decode())
+        # The dedupe key still keeps the same token from being sent twice.
+        self.assertFalse(EmailOutbox.enqueue('recovery', 'email1@example.com', 'token'))
+
+    def test_signup_token_does_not_carry_the_password(self):
+        payload = {'name': 'test', 'email': 'test@example.com', 'social_media': '', 'password': 'secret'}
+        FlaskClient(app).post('/signup', json=payload, headers=test_headers(payload))
+        claims = jwt.decode(EmailOutbox.query.one().token, options={'verify_signature': False})
+        self.assertNotIn('password', claims)
+        self.assertNotIn('secret', json.dumps(claims))
+        self.assertTrue(password_hasher.verify(claims['password_hash'], 'secret'))
+
+    def test_dispatcher_retries_with_backoff(self):
+        EmailOutbox.enqueue('recovery', 'email1@example.com', 'token')
+        with FakeSMTPServer(fail=True) as smtp:
+            dispatcher = OutboxDispatcher(SMTPSender(smtp.host, smtp.port), max_attempts=2, backoff=60)
+            try:
+                dispatcher.run_once()
+                email = EmailOutbox.query.one()
+                self.assertEqual((email.status, email.attempts), ('PENDING', 1))
+                self.assertGreater(email.next_attempt_at, datetime.datetime.now() + datetime.timedelta(seconds=50))
+                self.assertEqual(dispatcher.run_once(), 0)
+                email.next_attempt_at = datetime.datetime.now()
+                db.session.commit()
+                dispatcher.run_once()
+            finally:
+                dispatcher.stop()
+        email = EmailOutbox.query.one()
+        self.assertEqual((email.status, email.attempts), ('FAILED', 2))
+        self.assertTrue(email.last_error)
+        self.assertIsNone(email.token)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 import root_path
 root_path.define_sys_path()
 import unittest
+import datetime
 from app.models import User, Group, Friend
 import app.config as app_config
 from dotenv import load_dotenv
 from config_test import create_db
+from sqlalchemy import event
+from app.passwords import PasswordHasher
+from migrations import upgrade
+from migrations.explain import mysql_plan_uses_index, report
 
 
 db, app = app_config.db, app_config.app
@@ -26,6 +31,16 @@ class TestModels(unittest.TestCase):
             user = User.query.filter_by(name='user1').first()
             self.assertTrue(user.check_password('password1'))
             self.assertFalse(user.check_password('password2'))
+    def test_password_check_in_process_pool(self):
+        hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+        try:
+            password_hash = hasher.hash('password1')
+            self.assertTrue(hasher.verify(password_hash, 'password1'))
+            self.assertFalse(hasher.verify(password_hash, 'password2'))
+            self.assertFalse(hasher.needs_rehash(password_hash))
+            self.assertTrue(hasher.needs_rehash(PasswordHasher('pbkdf2:sha256:2000').hash('password1')))
+        finally:
+            hasher.shutdown()
     
     def test_perfectdraw(self):
         with app.app_context():
@@ -38,6 +53,73 @@ class TestModels(unittest.TestCase):
             group:Group = Group.query.first()
             group.imperfect_drawn()
             self.assertFalse(any(friend.friend_id == friend.user_id for friend in group.friends))
+    def test_perfectdraw_is_a_single_cycle(self):
+        with app.app_context():
+            group:Group = Group.query.first()
+            group.perfect_drawn()
+            assignment = {friend.user_id: friend.friend_id for friend in group.friends}
+            current, visited = group.friends[0].user_id, set()
+            while current not in visited:
+                visited.add(current)
+                current = assignment[current]
+            self.assertEqual(len(visited), 4)
+            self.assertEqual(group.drawn, 'PERFECT')
+    def test_serialize_batches_user_lookups(self):
+        with app.app_context():
+            group:Group = Group.query.first()
+            group.perfect_drawn()
+            group = Group.query.first()
+            len(group.friends)
+            statements = []
+            def count_statement(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                serialized = group.serialize()
+                su_serialized = group.su_serialize()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+            self.assertEqual(len(statements), 2)
+            self.assertEqual(len(serialized['friends']), 4)
+            self.assertTrue(all(friend['friend_name'] for friend in su_serialized['friends']))
+    def test_hot_queries_use_indexes(self):
+        with app.app_context():
+            with db.engine.connect() as connection:
+                results = report(connection)
+            self.assertEqual([name for name, indexed in results.items() if not indexed], [])
+    def test_mysql_plan_needs_a_chosen_key(self):
+        indexed = {'table': 'friend', 'type': 'ref', 'possible_keys': 'ix_friend_user_id', 'key': 'ix_friend_user_id'}
+        self.assertTrue(mysql_plan_uses_index([indexed]))
+        self.assertFalse(mysql_plan_uses_index([dict(indexed, type='ALL', key=None)]))
+        self.assertFalse(mysql_plan_uses_index([indexed, dict(indexed, type='ALL')]))
+    def test_migrations_are_idempotent(self):
+        with app.app_context():
+            db.session.remove()
+            with db.engine.begin() as connection:
+                connection.execute(db.text('DROP INDEX ix_group_creator ON `group`')
+                                   if db.engine.dialect.name == 'mysql' else db.text('DROP INDEX ix_group_creator'))
+            logs = []
+            upgrade(db.engine, logs.append)
+            self.assertEqual(logs, ['m0001_hot_lookup_indexes: ix_group_creator', 'm0002_email_outbox: nothing to do',
+                                    'm0003_group_version: nothing to do', 'm0004_binary_keys: nothing to do',
+                                    'm0005_draw_job: nothing to do', 'm0006_outbox_token_nullable: nothing to do'])
+            logs = []
+            upgrade(db.engine, logs.append)
+            self.assertEqual(logs, ['m0001_hot_lookup_indexes: nothing to do', 'm0002_email_outbox: nothing to do',
+                                    'm0003_group_version: nothing to do', 'm0004_binary_keys: nothing to do',
+                                    'm0005_draw_job: nothing to do', 'm0006_outbox_token_nullable: nothing to do'])
+    def test_kickout_only_leaves_the_given_group(self):
+        with app.app_context():
+            user = User.query.filter_by(email='email2@example.com').first()
+            group1 = Group.query.first()
+            group2 = Group('group2', user.id, datetime.datetime.now(), 10, 20)
+            db.session.add(group2)
+            db.session.commit()
+            db.session.add(Friend(user.id, group2.id, 'gift'))
+            db.session.commit()
+            group2.kick_out(user.id)
+            self.assertIsNotNone(Friend.query.filter_by(user_id=user.id, group_id=group1.id).first())
+            self.assertIsNone(Friend.query.filter_by(user_id=user.id, group_id=group2.id).first())
     def test_kickout(self):
         with app.app_context():
             user = User.query.filter_by(email='email1@example.com').first()
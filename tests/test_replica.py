@@ -0,0 +1,77 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+import app.rest as rest
+from app.cache import group_cache, token_cache
+from app.models import User, Group
+from app.routing import REPLICA_BIND, primary_pins
+from app.utils import test_headers
+from config_test import create_db
+from flask.testing import FlaskClient
+from sqlalchemy import create_engine, insert, select, update
+import os
+import tempfile
+
+
+db = rest.db
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """
+    Uses a SQLite copy of the test database as the replica, then changes the copy so the
+    tests can tell which database answered.
+    """
+    def setUp(self):
+        self.app = create_db()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.app_test = FlaskClient(self.app)
+        token_cache.clear()
+        group_cache.clear()
+        primary_pins.clear()
+
+        handle, self.replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.replica = create_engine(f'sqlite:///{self.replica_path}')
+        db.metadata.create_all(self.replica)
+        with db.engine.connect() as primary, self.replica.begin() as replica:
+            for table in db.metadata.sorted_tables:
+                rows = [row._asdict() for row in primary.execute(select(table))]
+                if rows:
+                    replica.execute(insert(table), rows)
+            replica.execute(update(Group.__table__).values(description='replica copy'))
+        db.engines[REPLICA_BIND] = self.replica
+
+        self.admin = User.query.filter_by(email='email1@example.com').first().generate_access_token()
+        self.member = User.query.filter_by(email='email2@example.com').first().generate_access_token()
+        self.group_id = Group.query.filter_by(description='group1').first().id
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engines.pop(REPLICA_BIND, None)
+        self.replica.dispose()
+        os.remove(self.replica_path)
+        self.app_context.pop()
+
+    def descriptions(self, url, token):
+        response = self.app_test.get(url, headers=test_headers(authorization=token))
+        self.assertEqual(response.status_code, 200)
+        return {group['description'] for group in response.json}
+
+    def test_read_only_resources_use_the_replica(self):
+        self.assertEqual(self.descriptions('/getjoinedgroups', self.member), {'replica copy'})
+        self.assertEqual(self.descriptions('/getgroupcreatedby', self.admin), {'replica copy'})
+        response = self.app_test.get(f'/sugetgroup/{self.group_id}', headers=test_headers(authorization=self.admin))
+        self.assertEqual(response.json['description'], 'group1')
+
+    def test_streamed_responses_use_the_replica(self):
+        response = self.app_test.get('/sugetgroups?format=ndjson', headers=test_headers(authorization=self.admin))
+        self.assertIn(b'replica copy', response.data)
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        response = self.app_test.put('/perfectdrawngroup', json={'group_id': self.group_id},
+                                     headers=test_headers(authorization=self.admin))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.descriptions('/getjoinedgroups', self.admin), {'group1'})
+        self.assertEqual(self.descriptions('/getjoinedgroups', self.member), {'replica copy'})
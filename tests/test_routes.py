@@ -4,14 +4,23 @@ root_path.define_sys_path()
 
 from app.utils import test_headers
 import app.rest as rest
-from app.models import User, Friend, Group
-from config_test import create_db
+from app.cache import group_cache, token_cache
+from app.logs import REQUEST_LOGGER
+from app.jobs import draw_jobs
+from app.models import DrawJob, User, Friend, Group
+from app.draw import DrawNotFound
+from config_test import count_queries, create_db
 import datetime
 from flask.testing import FlaskClient
 from freezegun import freeze_time
+from sqlalchemy import event
+import json
+import logging
 import jwt
 import unittest
+from unittest.mock import patch
 import uuid
+from werkzeug.security import generate_password_hash
 
 
 
@@ -97,6 +106,20 @@ class LoginTestCase(unittest.TestCase):
         response = self.app_test.post('/login', json=payload, headers=headers)
         self.assertEqual(response.status_code, 401)
 
+    def test_login_rehashes_outdated_password_hash(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        user.password_hash = generate_password_hash('password1', method='pbkdf2:sha256:1000')
+        rest.db.session.commit()
+        payload = {
+            'email': 'email1@example.com',
+            'password': 'password1'
+        }
+        response = self.app_test.post('/login', json=payload, headers=test_headers(payload))
+        self.assertEqual(response.status_code, 200)
+        user = User.query.filter_by(email='email1@example.com').first()
+        self.assertFalse(user.needs_rehash())
+        self.assertTrue(user.check_password('password1'))
+
 class SignUpTestCase(unittest.TestCase):
     def setUp(self):
         setup(self)
@@ -116,10 +139,12 @@ class SignUpTestCase(unittest.TestCase):
            }
            headers = test_headers(payload)
            response = self.app_test.post('/signup', json=payload, headers=headers)
-           payload['exp'] = datetime.datetime.now() + datetime.timedelta(days=1)
-           test_token = jwt.encode(payload, rest.SECRET_KEY, algorithm='HS256')
            self.assertEqual(response.status_code, 201)
-           self.assertEqual(response.json['access_token'], test_token)
+           claims = jwt.decode(response.json['access_token'], rest.SECRET_KEY, algorithms=['HS256'],
+                               options={'verify_exp': False})
+           self.assertTrue(rest.password_hasher.verify(claims.pop('password_hash'), payload.pop('password')))
+           payload['exp'] = int((datetime.datetime.now() + datetime.timedelta(days=1)).timestamp())
+           self.assertEqual(claims, payload)
     
     def test_key_error(self):
         payload = {
@@ -264,6 +289,52 @@ class CreateGroupTestCase(unittest.TestCase):
             }
             headers = test_headers(payload=payload,authorization=user.generate_access_token())
             response = self.app_test.post('/create_group', json=payload, headers=headers)
+            self.assertEqual(response.status_code, 201)
+        group = Group.query.filter_by(description='test').first()
+        self.assertEqual([(friend.user_id, friend.is_admin, friend.gift_desired) for friend in group.friends],
+                         [(user.id, True, 'gift')])
+
+    def test_create_group_in_one_transaction(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        payload = {'description': 'test', 'event_date': '2030-12-24', 'min_gift_price': 10, 'max_gift_price': 20}
+        headers = test_headers(payload=payload,authorization=user.generate_access_token())
+        self.app_test.get('/user', headers=headers)
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(rest.db.session, 'after_commit', listener)
+        try:
+            with count_queries() as statements:
+                response = self.app_test.post('/create_group', json=payload, headers=headers)
+        finally:
+            event.remove(rest.db.session, 'after_commit', listener)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(len(statements), 2)
+
+    def test_create_groups(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        groups = [{'description': f'batch{i}', 'event_date': '2030-12-24', 'min_gift_price': 10, 'max_gift_price': 20,
+                   'creator_desired_gift': f'gift{i}'} for i in range(5)]
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.post('/create_groups', json={'groups': groups}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        ids = response.json['ids']
+        self.assertEqual(len(ids), 5)
+        for i, group_id in enumerate(ids):
+            group = Group.query.filter_by(id=group_id).first()
+            self.assertEqual((group.description, group.creator, group.drawn, group.version), (f'batch{i}', user.id, 'NO', 0))
+            self.assertEqual([(friend.user_id, friend.is_admin, friend.gift_desired) for friend in group.friends],
+                             [(user.id, True, f'gift{i}')])
+
+    def test_create_groups_is_all_or_nothing(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        groups = [{'description': 'ok', 'event_date': '2030-12-24', 'min_gift_price': 10, 'max_gift_price': 20},
+                  {'description': 'bad', 'event_date': '2030-12-24', 'min_gift_price': 30, 'max_gift_price': 20}]
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.post('/create_groups', json={'groups': groups}, headers=headers)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.json['index'], 1)
+        self.assertEqual(Group.query.count(), 1)
 
     def test_create_group_invalid_gift_prices(self):
         user:User = User.query.filter_by(email='email1@example.com').first()
@@ -325,6 +396,51 @@ class PerfectDrawnTestCase(unittest.TestCase):
         response = self.app_test.put('/perfectdrawngroup', json=payload, headers=test_headers(authorization=user.generate_access_token()))
         self.assertEqual(response.status_code, 401)
 
+    def test_perfect_drawn_with_exclusions(self):
+        users = [User.query.filter_by(email=f'email{number}@example.com').first() for number in range(1, 5)]
+        group:Group = Group.query.filter_by(description='group1').first()
+        payload = {
+            'group_id': group.id,
+            'exclude': [[users[0].id, users[1].id], [users[2].id.upper(), users[3].id]]
+        }
+        response = self.app_test.put('/perfectdrawngroup', json=payload, headers=test_headers(authorization=users[0].generate_access_token()))
+        self.assertEqual(response.status_code, 200)
+        pairs = set(Group.drawn_pairs(group.id))
+        self.assertEqual(len(pairs), 4)
+        for a, b in [(0, 1), (2, 3)]:
+            self.assertNotIn((users[a].id, users[b].id), pairs)
+            self.assertNotIn((users[b].id, users[a].id), pairs)
+
+    def test_perfect_drawn_infeasible(self):
+        users = [User.query.filter_by(email=f'email{number}@example.com').first() for number in range(1, 5)]
+        group:Group = Group.query.filter_by(description='group1').first()
+        payload = {
+            'group_id': group.id,
+            'exclude': [[users[0].id, user.id] for user in users[1:]]
+        }
+        response = self.app_test.put('/perfectdrawngroup', json=payload, headers=test_headers(authorization=users[0].generate_access_token()))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Group.query.filter_by(description='group1').first().drawn, 'NO')
+
+    def test_perfect_drawn_not_found_can_be_retried(self):
+        users = [User.query.filter_by(email=f'email{number}@example.com').first() for number in range(1, 3)]
+        group:Group = Group.query.filter_by(description='group1').first()
+        payload = {'group_id': group.id, 'exclude': [[users[0].id, users[1].id]]}
+        with patch('app.models.constrained_cycle', side_effect=DrawNotFound('No single cycle was found, try again')):
+            response = self.app_test.put('/perfectdrawngroup', json=payload, headers=test_headers(authorization=users[0].generate_access_token()))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Group.query.filter_by(description='group1').first().drawn, 'NO')
+
+    def test_perfect_drawn_invalid_rules(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        group:Group = Group.query.filter_by(description='group1').first()
+        payload = {
+            'group_id': group.id,
+            'exclude': [[user.id]]
+        }
+        response = self.app_test.put('/perfectdrawngroup', json=payload, headers=test_headers(authorization=user.generate_access_token()))
+        self.assertEqual(response.status_code, 400)
+
 
 class ImperfectDrawnTestCase(unittest.TestCase):
     def setUp(self):
@@ -358,6 +474,28 @@ class ImperfectDrawnTestCase(unittest.TestCase):
                                      headers=test_headers(authorization=user.generate_access_token()))
         self.assertEqual(response.status_code, 401)
 
+    def test_imperfect_drawn_avoids_previous_draw(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        group:Group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        self.app_test.put('/perfectdrawngroup', json={'group_id': group.id}, headers=headers)
+        previous = set(Group.drawn_pairs(group.id))
+        response = self.app_test.put('/imperfectdrawngroup', json={'group_id': group.id, 'avoid_group_id': group.id},
+                                     headers=headers)
+        self.assertEqual(response.status_code, 200)
+        pairs = set(Group.drawn_pairs(group.id))
+        self.assertEqual(len(pairs), 4)
+        self.assertFalse(pairs & previous)
+
+    def test_imperfect_drawn_avoid_group_of_another_user(self):
+        user:User = User.query.filter_by(email='email1@example.com').first()
+        other:User = User.query.filter_by(email='email2@example.com').first()
+        group:Group = Group.query.filter_by(description='group1').first()
+        other_group = Group.create('other', other.id, datetime.datetime.now(), 10, 20)
+        response = self.app_test.put('/imperfectdrawngroup', json={'group_id': group.id, 'avoid_group_id': other_group.id},
+                                     headers=test_headers(authorization=user.generate_access_token()))
+        self.assertEqual(response.status_code, 401)
+
 
 class SugetGroupsTestCase(unittest.TestCase):
     
@@ -378,6 +516,16 @@ class SugetGroupsTestCase(unittest.TestCase):
         response = self.app_test.get('/sugetgroups', headers=headers)
         self.assertEqual(response.status_code, 401)
 
+    def test_sugetgroups_ndjson_stream(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.get('/sugetgroups?format=ndjson', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(json.loads(lines[0])['friends']), 4)
+
 class SugetUsersTestCase(unittest.TestCase):
     def setUp(self):
         setup(self)
@@ -396,6 +544,18 @@ class SugetUsersTestCase(unittest.TestCase):
         response = self.app_test.get('/sugetusers', headers=headers)
         self.assertEqual(response.status_code, 401)
 
+    def test_sugetusers_keyset_pagination(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.get('/sugetusers?limit=3', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 3)
+        next_cursor = response.headers['X-Next-Cursor']
+        self.assertEqual(next_cursor, response.json[-1]['id'])
+        response = self.app_test.get(f'/sugetusers?limit=3&after={next_cursor}', headers=headers)
+        self.assertEqual(len(response.json), 1)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
 class SugetGroupTestCase(unittest.TestCase):
     def setUp(self):
         setup(self)
@@ -409,6 +569,15 @@ class SugetGroupTestCase(unittest.TestCase):
         headers = test_headers(authorization=user.generate_access_token())
         response = self.app_test.get(f'/sugetgroup/{group.id}', headers=headers)
         self.assertEqual(response.status_code, 200)
+    def test_sugetgroup_formats_dates_and_prices(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group:Group = Group.query.filter_by(description='group1').first()
+        group_cache.clear()
+        headers = test_headers(authorization=user.generate_access_token())
+        for _ in range(2):
+            response = self.app_test.get(f'/sugetgroup/{group.id}', headers=headers)
+            self.assertEqual(response.json['event_date'], group.event_date.strftime('%Y-%m-%d %H:%M:%S'))
+            self.assertEqual((response.json['min_gift_price'], response.json['max_gift_price']), ('100.00', '200.00'))
     def test_sugetgroup_without_super_user(self):
         user = User.query.filter_by(email='email2@example.com').first()
         group:Group = Group.query.filter_by(description='group1').first()
@@ -417,6 +586,380 @@ class SugetGroupTestCase(unittest.TestCase):
         response = self.app_test.get(f'/sugetgroup/{group.id}', headers=headers)
         self.assertEqual(response.status_code, 401)
 
+class TokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        token_cache.clear()
+    def tearDown(self):
+        teardown(self)
+
+    def test_repeated_token_is_served_from_cache(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        self.app_test.get('/user', headers=headers)
+        response = self.app_test.get('/user', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['email'], 'email1@example.com')
+        response = self.app_test.get('/sucachestats', headers=headers)
+        self.assertEqual(response.json['token_cache']['misses'], 1)
+        self.assertEqual(response.json['token_cache']['hits'], 2)
+
+    def test_user_update_invalidates_cached_token(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.get('/sugetusers', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        user.is_superuser = False
+        rest.db.session.commit()
+        response = self.app_test.get('/sugetusers', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_cached_token_expires(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        with freeze_time('2019-12-01 01:01:01'):
+            headers = test_headers(authorization=user.generate_access_token())
+            response = self.app_test.get('/user', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        with freeze_time('2019-12-01 01:20:01'):
+            response = self.app_test.get('/user', headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+class GroupCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        group_cache.clear()
+    def tearDown(self):
+        teardown(self)
+
+    def test_group_reads_are_served_from_cache(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        first = self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers)
+        second = self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers)
+        self.assertEqual(first.json, second.json)
+        self.assertEqual((group_cache.hits, group_cache.misses), (1, 1))
+
+    def test_draw_invalidates_cached_group(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.get(f'/sugetgroup/{group.id}', headers=headers)
+        self.assertTrue(all(friend['friend_id'] is None for friend in response.json['friends']))
+        self.app_test.put('/perfectdrawngroup', json={'group_id': group.id}, headers=headers)
+        response = self.app_test.get(f'/sugetgroup/{group.id}', headers=headers)
+        self.assertTrue(all(friend['friend_id'] for friend in response.json['friends']))
+
+    def test_kick_invalidates_cached_group(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        kicked = User.query.filter_by(email='email2@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        self.assertEqual(len(self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers).json), 4)
+        self.app_test.delete(f'/kickoutgroup/{group.id}/{kicked.id}', headers=headers)
+        self.assertEqual(len(self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers).json), 3)
+
+class ConditionalGetTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        token_cache.clear()
+        group_cache.clear()
+    def tearDown(self):
+        teardown(self)
+
+    def test_unchanged_group_is_not_modified(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        first = self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        with count_queries() as statements:
+            second = self.app_test.get(f'/getfriendsgroup/{group.id}', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(len(statements), 1)
+
+    def test_mutations_change_the_etag(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        kicked = User.query.filter_by(email='email2@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        etags = [self.app_test.get(f'/getfriendsgroup/{group.id}', headers=headers).headers['ETag']]
+        self.app_test.put('/perfectdrawngroup', json={'group_id': group.id}, headers=headers)
+        etags.append(self.app_test.get(f'/getmyfriend/{group.id}', headers=headers).headers['ETag'])
+        response = self.app_test.get(f'/getmyfriend/{group.id}', headers={**headers, 'If-None-Match': etags[-1]})
+        self.assertEqual(response.status_code, 304)
+        self.app_test.delete(f'/kickoutgroup/{group.id}/{kicked.id}', headers=headers)
+        response = self.app_test.get(f'/getfriendsgroup/{group.id}', headers={**headers, 'If-None-Match': etags[0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 3)
+        self.assertEqual(Group.query.filter_by(id=group.id).first().version, 2)
+
+    def test_etags_are_per_user(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        other = User.query.filter_by(email='email2@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        etag = self.app_test.get(f'/getfriendsgroup/{group.id}',
+                                 headers=test_headers(authorization=user.generate_access_token())).headers['ETag']
+        response = self.app_test.get(f'/getfriendsgroup/{group.id}',
+                                     headers={**test_headers(authorization=other.generate_access_token()), 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_current_user_is_not_modified(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        etag = self.app_test.get('/user', headers=headers).headers['ETag']
+        response = self.app_test.get('/user', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.app_test.get('/user', headers={**headers, 'If-None-Match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['email'], 'email1@example.com')
+
+class QueryCountTestCase(unittest.TestCase):
+    """
+    Locks in the number of queries run by each endpoint, with a warm token cache and a cold group cache.
+    """
+    def setUp(self):
+        setup(self)
+        token_cache.clear()
+        group_cache.clear()
+        self.user = User.query.filter_by(email='email1@example.com').first()
+        self.group = Group.query.filter_by(description='group1').first()
+        self.headers = test_headers(authorization=self.user.generate_access_token())
+        self.app_test.get('/user', headers=self.headers)
+    def tearDown(self):
+        teardown(self)
+
+    def assertQueries(self, expected, method, url, **kwargs):
+        with count_queries() as statements:
+            response = getattr(self.app_test, method)(url, headers=self.headers, **kwargs)
+        self.assertLess(response.status_code, 400)
+        self.assertEqual(len(statements), expected, '\n'.join(statements))
+
+    def test_reads(self):
+        group_id = self.group.id
+        self.assertQueries(0, 'get', '/user')
+        self.assertQueries(4, 'get', f'/getfriendsgroup/{group_id}')
+        self.assertQueries(4, 'get', f'/sugetgroup/{group_id}')
+        # Only the ids and versions, the payload was cached by /getfriendsgroup.
+        self.assertQueries(1, 'get', '/getgroupcreatedby')
+        self.assertQueries(3, 'get', '/getjoinedgroups')
+
+    def test_writes(self):
+        group_id = self.group.id
+        kicked = User.query.filter_by(email='email2@example.com').first()
+        # The draws also check that no background draw of the group is active.
+        self.assertQueries(6, 'put', '/perfectdrawngroup', json={'group_id': group_id})
+        self.assertQueries(2, 'get', f'/getmyfriend/{group_id}')
+        self.assertQueries(6, 'put', '/imperfectdrawngroup', json={'group_id': group_id})
+        self.assertQueries(6, 'delete', f'/kickoutgroup/{group_id}/{kicked.id}')
+        # A repair only looks up the giver of the kicked friend and updates its assignment.
+        kicked = User.query.filter_by(email='email3@example.com').first()
+        self.assertQueries(6, 'put', '/perfectdrawngroup', json={'group_id': group_id})
+        self.assertQueries(7, 'delete', f'/kickoutgroup/{group_id}/{kicked.id}?repair=1')
+
+class DrawJobTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        self.user = User.query.filter_by(email='email1@example.com').first()
+        self.group = Group.query.filter_by(description='group1').first()
+        self.headers = test_headers(authorization=self.user.generate_access_token())
+    def tearDown(self):
+        draw_jobs.wait(10)
+        teardown(self)
+
+    def draw_async(self, path, **payload):
+        return self.app_test.put(f'{path}?async=1', json={'group_id': self.group.id, **payload}, headers=self.headers)
+
+    def test_background_draw(self):
+        response = self.draw_async('/perfectdrawngroup')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json['job_id']
+        self.assertEqual(response.headers['Location'], f'/drawjob/{job_id}')
+        self.assertTrue(draw_jobs.wait(10))
+        response = self.app_test.get(f'/drawjob/{job_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json['status'], response.json['drawn'], response.json['message']), ('DONE', 'PERFECT', None))
+        self.assertIsNotNone(response.json['finished_at'])
+        rest.db.session.expire_all()
+        self.assertEqual(Group.query.filter_by(id=self.group.id).first().drawn, 'PERFECT')
+        self.assertEqual(len(Group.drawn_pairs(self.group.id)), 4)
+        self.assertIsNone(DrawJob.active(self.group.id))
+
+    def test_infeasible_background_draw(self):
+        users = [User.query.filter_by(email=f'email{number}@example.com').first() for number in range(1, 5)]
+        response = self.draw_async('/imperfectdrawngroup', exclude=[[users[0].id, user.id] for user in users[1:]])
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(draw_jobs.wait(10))
+        response = self.app_test.get(f'/drawjob/{response.json["job_id"]}', headers=self.headers)
+        self.assertEqual(response.json['status'], 'FAILED')
+        self.assertEqual(response.json['message'], 'The exclusions leave no valid draw')
+        rest.db.session.expire_all()
+        self.assertEqual(Group.query.filter_by(id=self.group.id).first().drawn, 'NO')
+        self.assertIsNone(DrawJob.active(self.group.id))
+
+    def test_one_draw_per_group(self):
+        job = DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT')
+        for path in ['/perfectdrawngroup', '/imperfectdrawngroup']:
+            response = self.draw_async(path)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json['job_id'], job.id)
+            response = self.app_test.put(path, json={'group_id': self.group.id}, headers=self.headers)
+            self.assertEqual(response.status_code, 409)
+        self.assertEqual(DrawJob.query.count(), 1)
+        self.assertEqual(Group.query.filter_by(id=self.group.id).first().drawn, 'NO')
+
+    def test_lost_jobs_time_out(self):
+        with freeze_time(datetime.datetime.now() - datetime.timedelta(hours=1)):
+            lost = DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT')
+        lost_id = lost.id
+        response = self.draw_async('/perfectdrawngroup')
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(draw_jobs.wait(10))
+        rest.db.session.expire_all()
+        lost = rest.db.session.get(DrawJob, lost_id)
+        self.assertEqual((lost.status, lost.message, lost.active_group_id), ('FAILED', 'Timed out', None))
+        self.assertEqual(rest.db.session.get(DrawJob, response.json['job_id']).status, 'DONE')
+
+    def test_running_job_is_timed_from_its_start(self):
+        with freeze_time(datetime.datetime.now() - datetime.timedelta(hours=1)):
+            job = DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT')
+        self.assertTrue(job.start())
+        rest.db.session.commit()
+        self.assertIsNone(DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT'))
+        self.assertEqual(DrawJob.active(self.group.id).status, 'RUNNING')
+
+    def test_timed_out_job_keeps_its_status(self):
+        with freeze_time(datetime.datetime.now() - datetime.timedelta(hours=1)):
+            job = DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT')
+            self.assertTrue(job.start())
+            rest.db.session.commit()
+        job_id = job.id
+        self.assertIsNotNone(DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT'))
+        rest.db.session.expire_all()
+        self.assertFalse(rest.db.session.get(DrawJob, job_id).finish('DONE'))
+        rest.db.session.commit()
+        draw_jobs.run(job_id)
+        rest.db.session.expire_all()
+        job = rest.db.session.get(DrawJob, job_id)
+        self.assertEqual((job.status, job.message), ('FAILED', 'Timed out'))
+        self.assertEqual(Group.query.filter_by(id=self.group.id).first().drawn, 'NO')
+
+    def test_job_status_access(self):
+        job = DrawJob.enqueue(self.group.id, self.user.id, 'PERFECT')
+        outsider = User('user5', 'email5@example.com', 'www.instagram.com/user5', 'password5')
+        rest.db.session.add(outsider)
+        rest.db.session.commit()
+        response = self.app_test.get(f'/drawjob/{job.id}', headers=test_headers(authorization=outsider.generate_access_token()))
+        self.assertEqual(response.status_code, 401)
+        response = self.app_test.get(f'/drawjob/{"0" * 32}', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.app_test.get(f'/drawjob/{job.id.upper()}', headers=self.headers)
+        self.assertEqual(response.json['status'], 'QUEUED')
+
+class AddFriendsGroupTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        self.admin = User.query.filter_by(email='email1@example.com').first()
+        self.group = Group.query.filter_by(description='group1').first()
+        self.headers = test_headers(authorization=self.admin.generate_access_token())
+        self.new_users = [User(f'new{i}', f'new{i}@example.com', '', 'password') for i in range(3)]
+        rest.db.session.add_all(self.new_users)
+        rest.db.session.commit()
+    def tearDown(self):
+        teardown(self)
+
+    def test_add_friends(self):
+        friends = [
+            {'email': 'new0@example.com', 'gift_desired': 'a book'},
+            {'user_id': self.new_users[1].id.upper()},
+            {'email': 'new0@example.com'},
+            {'email': 'email2@example.com'},
+            {'email': 'nobody@example.com'},
+            {'user_id': 'not-an-id'},
+        ]
+        url = f'/addfriendsgroup/{self.group.id}'
+        self.app_test.get('/user', headers=self.headers)
+        with count_queries() as statements:
+            response = self.app_test.post(url, json={'friends': friends}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {
+            'processed': 6,
+            'added': [self.new_users[0].id, self.new_users[1].id],
+            'duplicates': ['new0@example.com', 'email2@example.com'],
+            'not_found': ['nobody@example.com', 'not-an-id'],
+        })
+        # group, admin check, members, users IN, executemany insert, version bump
+        self.assertEqual(len(statements), 6)
+        friend = Friend.query.filter_by(user_id=self.new_users[0].id, group_id=self.group.id).first()
+        self.assertEqual((friend.gift_desired, friend.is_admin), ('a book', False))
+        self.assertEqual(Friend.query.filter_by(group_id=self.group.id).count(), 6)
+
+    def test_adding_friends_clears_the_draw(self):
+        self.group.perfect_drawn()
+        response = self.app_test.post(f'/addfriendsgroup/{self.group.id}', json={'friends': [{'email': 'new2@example.com'}]},
+                                      headers=self.headers)
+        self.assertEqual(response.json['added'], [self.new_users[2].id])
+        group = Group.query.filter_by(id=self.group.id).first()
+        self.assertEqual(group.drawn, 'NO')
+        self.assertTrue(all(friend.friend_id is None for friend in group.friends))
+
+    def test_streamed_progress(self):
+        friends = [{'email': user.email} for user in self.new_users] + [{'email': 'email3@example.com'}]
+        original, rest.IMPORT_CHUNK_SIZE = rest.IMPORT_CHUNK_SIZE, 2
+        try:
+            response = self.app_test.post(f'/addfriendsgroup/{self.group.id}?format=ndjson', json={'friends': friends},
+                                          headers=self.headers)
+            lines = [json.loads(line) for line in response.data.splitlines()]
+        finally:
+            rest.IMPORT_CHUNK_SIZE = original
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(lines[:2], [{'processed': 2, 'added': 2, 'duplicates': 0, 'not_found': 0},
+                                     {'processed': 4, 'added': 3, 'duplicates': 1, 'not_found': 0}])
+        self.assertEqual(lines[2]['added'], [user.id for user in self.new_users])
+        self.assertEqual(Friend.query.filter_by(group_id=self.group.id).count(), 7)
+
+    def test_add_friends_requires_an_admin(self):
+        member = User.query.filter_by(email='email2@example.com').first()
+        headers = test_headers(authorization=member.generate_access_token())
+        response = self.app_test.post(f'/addfriendsgroup/{self.group.id}', json={'friends': [{'email': 'new0@example.com'}]},
+                                      headers=headers)
+        self.assertEqual(response.status_code, 401)
+        for body in [{}, {'friends': 'new0@example.com'}, {'friends': [{'name': 'new0'}]},
+                     {'friends': [{'email': 'new0@example.com', 'gift_desired': 'x' * 81}]}]:
+            response = self.app_test.post(f'/addfriendsgroup/{self.group.id}', json=body, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Friend.query.filter_by(group_id=self.group.id).count(), 4)
+
+class RequestLoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        setup(self)
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        logging.getLogger(REQUEST_LOGGER).addHandler(self.handler)
+    def tearDown(self):
+        logging.getLogger(REQUEST_LOGGER).removeHandler(self.handler)
+        teardown(self)
+
+    def test_request_is_logged_with_route_status_and_latency(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        self.app_test.get(f'/getfriendsgroup/{group.id}', headers=test_headers(authorization=user.generate_access_token()))
+        fields = self.records[-1].fields
+        self.assertEqual(fields['route'], '/getfriendsgroup/<string:group_id>')
+        self.assertEqual(fields['status'], 200)
+        self.assertGreaterEqual(fields['latency_ms'], 0)
+        self.assertNotIn('body', fields)
+
+    def test_body_is_logged_for_decorated_resources(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        group = Group.query.filter_by(description='group1').first()
+        self.app_test.put('/perfectdrawngroup', json={'group_id': group.id},
+                          headers=test_headers(authorization=user.generate_access_token()))
+        self.assertIn(group.id, self.records[-1].fields['body'])
+
 class UserTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -438,6 +981,30 @@ class UserTestCase(unittest.TestCase):
         group.perfect_drawn()
         response = self.app_test.get(f'/getmyfriend/{group.id}', headers=headers)
         self.assertEqual(response.status_code, 200)
+
+    def test_get_my_friend_reads_the_gift_of_the_same_group(self):
+        users = User.query.order_by(User.email).all()
+        other = Group('group2', users[0].id, datetime.datetime.now(), 10, 20)
+        rest.db.session.add(other)
+        rest.db.session.flush()
+        rest.db.session.add_all([Friend(user.id, other.id, f'other {user.name}') for user in users])
+        rest.db.session.commit()
+        other.perfect_drawn()
+        group = Group.query.filter_by(description='group1').first()
+        group.perfect_drawn()
+        friend = Friend.query.filter_by(user_id=users[0].id, group_id=group.id).first()
+        assignee = Friend.query.filter_by(user_id=friend.friend_id, group_id=group.id).first()
+        headers = test_headers(authorization=users[0].generate_access_token())
+        response = self.app_test.get(f'/getmyfriend/{group.id}', headers=headers)
+        self.assertEqual(response.json, {'friend_name': User.query.filter_by(id=friend.friend_id).first().name,
+                                         'friend_id': friend.friend_id, 'friend_gift': assignee.gift_desired})
+
+    def test_get_my_friend_before_the_draw(self):
+        user = User.query.filter_by(email='email1@example.com').first()
+        headers = test_headers(authorization=user.generate_access_token())
+        group = Group.query.filter_by(description='group1').first()
+        response = self.app_test.get(f'/getmyfriend/{group.id}', headers=headers)
+        self.assertEqual(response.json, {'friend_name': None, 'friend_id': None, 'friend_gift': None})
     
 class KickGroupTestCase(unittest.TestCase):
     def setUp(self):
@@ -478,6 +1045,58 @@ class KickGroupTestCase(unittest.TestCase):
         expected_response = {'message': 'User Kicked, Another Draw Must Be Made'}
         self.assertEqual(response.json, expected_response)
     
+    def assignment(self, group_id):
+        rest.db.session.expire_all()
+        return {friend.user_id: friend.friend_id for friend in Friend.query.filter_by(group_id=group_id)}
+
+    def kick(self, group_id, user_id, query='?repair=1'):
+        admin = User.query.filter_by(email='email1@example.com').first()
+        return self.app_test.delete(f'/kickoutgroup/{group_id}/{user_id}{query}',
+                                    headers=test_headers(authorization=admin.generate_access_token()))
+
+    def test_kick_repairs_perfect_draw(self):
+        group:Group = Group.query.filter_by(description='group1').first()
+        group.perfect_drawn()
+        before = self.assignment(group.id)
+        user = User.query.filter_by(email='email2@example.com').first()
+        response = self.kick(group.id, user.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'message': 'User Kicked, Draw Repaired'})
+        self.assertEqual(Group.query.filter_by(id=group.id).first().drawn, 'PERFECT')
+        after = self.assignment(group.id)
+        giver = next(giver for giver, receiver in before.items() if receiver == user.id)
+        self.assertEqual(after[giver], before[user.id])
+        self.assertEqual({k: v for k, v in after.items() if k != giver},
+                         {k: v for k, v in before.items() if k not in (giver, user.id)})
+        current, seen = giver, set()
+        while current not in seen:
+            seen.add(current)
+            current = after[current]
+        self.assertEqual(seen, set(after))
+
+    def test_kick_repairs_imperfect_draw_of_a_pair(self):
+        group:Group = Group.query.filter_by(description='group1').first()
+        a, b, c, d = (friend.user_id for friend in group.friends)
+        group.save_assignment({a: b, b: a, c: d, d: c}, 'IMPERFECT')
+        response = self.kick(group.id, b)
+        self.assertEqual(response.json, {'message': 'User Kicked, Draw Repaired'})
+        after = self.assignment(group.id)
+        self.assertEqual(set(after), {a, c, d})
+        self.assertEqual(set(after.values()), {a, c, d})
+        self.assertTrue(all(giver != receiver for giver, receiver in after.items()))
+        self.assertEqual(len([giver for giver in (c, d) if after[giver] != {c: d, d: c}[giver]]), 1)
+
+    def test_kick_cannot_repair_last_pair(self):
+        group:Group = Group.query.filter_by(description='group1').first()
+        group.perfect_drawn()
+        users = [friend.user_id for friend in group.friends if not friend.is_admin]
+        for user_id in users[:2]:
+            self.assertEqual(self.kick(group.id, user_id).json, {'message': 'User Kicked, Draw Repaired'})
+        response = self.kick(group.id, users[2])
+        self.assertEqual(response.json, {'message': 'User Kicked, Another Draw Must Be Made'})
+        self.assertEqual(Group.query.filter_by(id=group.id).first().drawn, 'NO')
+        self.assertEqual(set(self.assignment(group.id).values()), {None})
+
     def test_no_admin_try_kick(self):
         fake_admin = User.query.filter_by(email='email2@example.com').first()
         group:Group = Group.query.filter_by(description='group1').first()
@@ -501,6 +1120,24 @@ class JoinedGroupTestCase(unittest.TestCase):
         headers = test_headers(authorization=user.generate_access_token())
         response = self.app_test.get('/getjoinedgroups', headers=headers)
         self.assertEqual(response.status_code, 200)
+
+    def test_get_joined_groups_paginated(self):
+        user:User = User.query.filter_by(email='email2@example.com').first()
+        group2 = Group('group2', user.id, datetime.datetime.now(), 10, 20)
+        rest.db.session.add(group2)
+        rest.db.session.commit()
+        rest.db.session.add(Friend(user.id, group2.id, 'gift'))
+        rest.db.session.commit()
+        headers = test_headers(authorization=user.generate_access_token())
+        response = self.app_test.get('/getjoinedgroups', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(group['description'] for group in response.json), ['group1', 'group2'])
+        response = self.app_test.get('/getjoinedgroups?limit=1', headers=headers)
+        self.assertEqual(len(response.json), 1)
+        next_cursor = response.headers['X-Next-Cursor']
+        response = self.app_test.get(f'/getjoinedgroups?limit=1&after={next_cursor}', headers=headers)
+        self.assertEqual(len(response.json), 1)
+        self.assertNotEqual(response.json[0]['id'], next_cursor)
     
     
     
@@ -0,0 +1,45 @@
+import root_path
+root_path.define_sys_path()
+import unittest
+from app.serializers import CODECS, load_codec
+import datetime
+import decimal
+import json
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_codecs_encode_like_the_api(self):
+        payload = {
+            'event_date': datetime.datetime(2020, 1, 2, 3, 4, 5, 678),
+            'day': datetime.date(2020, 1, 2),
+            'min_gift_price': decimal.Decimal('10.50'),
+            'friends': [{'friend_id': None, 'is_admin': True, 'user_name': 'ção'}],
+        }
+        expected = {
+            'event_date': '2020-01-02 03:04:05',
+            'day': '2020-01-02',
+            'min_gift_price': '10.50',
+            'friends': [{'friend_id': None, 'is_admin': True, 'user_name': 'ção'}],
+        }
+        for name in CODECS:
+            try:
+                _, dumps, loads = load_codec(name)
+            except ImportError:
+                continue
+            encoded = dumps(payload)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(json.loads(encoded), expected)
+            self.assertEqual(loads(encoded), expected)
+
+    def test_unknown_values_are_rejected(self):
+        for name in CODECS:
+            try:
+                _, dumps, _ = load_codec(name)
+            except ImportError:
+                continue
+            with self.assertRaises(TypeError):
+                dumps({'value': object()})
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            load_codec('yaml')